@@ -0,0 +1,287 @@
+# benchmarks/run_benchmarks.py
+"""
+Benchmark de punta a punta de las fases de src/main.py contra el stand-in local
+de TOTVS y una base de datos MySQL LOCAL.
+
+  python benchmarks/run_benchmarks.py --tamanos 1000,100000,1000000 \
+      --db-host 127.0.0.1 --db-user bench --db-password bench --db-database totvs_bench
+
+Por cada tamaño genera un PickList sintético, levanta el stand-in y mide
+filas/s, round trips (HTTP y BD) y memoria pico de cada fase. Los resultados se
+guardan en benchmarks/results/ para comparar corridas.
+
+ATENCIÓN: el benchmark recrea las tablas (benchmarks/schema.sql) en la base indicada
+con --db-*/BENCH_DB_*; nunca usa las credenciales DB_* del .env.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(RAIZ, 'src'))
+
+from config.settings import settings
+
+# El benchmark no debe compartir el token cacheado ni grabar tráfico
+settings.TOKEN_CACHE_FILE = ''
+settings.TOKEN_BACKGROUND_REFRESH = False
+settings.API_RECORD_DIR = ''
+settings.PICKLIST_DUMP_FILE = ''
+
+from api.api_services import APIService
+from api.standin import StandInServer
+from synthetic import escribir_picklist
+from services.data_service import DataService
+from services.pipeline import ejecutar_pipeline
+from utils.helpers import validate_data
+from utils.logger import logger
+
+SCHEMA = os.path.join(RAIZ, 'benchmarks', 'schema.sql')
+RESULTADOS = os.path.join(RAIZ, 'benchmarks', 'results')
+
+
+class ContadorRoundTrips:
+    """Total de round trips de todas las conexiones (principal, escritores y depósitos)."""
+
+    def __init__(self):
+        self.round_trips = 0
+        self._lock = threading.Lock()
+
+    def sumar(self):
+        with self._lock:
+            self.round_trips += 1
+
+
+class ContadorCursor:
+    """Envuelve un cursor de mysql-connector y cuenta sus round trips (execute/executemany) en `contador`."""
+
+    def __init__(self, cursor, contador: ContadorRoundTrips):
+        self._cursor = cursor
+        self._contador = contador
+
+    def execute(self, *args, **kwargs):
+        self._contador.sumar()
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._contador.sumar()
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+
+@contextmanager
+def contando_round_trips():
+    """
+    Envuelve el cursor de cada conexión que tome DataService del pool mientras dura el
+    bloque, incluidos los escritores de _insertar_paralelo y los hilos por depósito.
+    """
+    contador = ContadorRoundTrips()
+    original = DataService.conectar_bd
+
+    def conectar_bd(self):
+        original(self)
+        self.cursor = ContadorCursor(self.cursor, contador)
+
+    DataService.conectar_bd = conectar_bd
+    try:
+        yield contador
+    finally:
+        DataService.conectar_bd = original
+
+
+def _medir(resultados: list, tamano: int, fase: str, fn, filas_fn, round_trips_fn):
+    tracemalloc.reset_peak()
+    rt0 = round_trips_fn()
+    t0 = time.perf_counter()
+    salida = fn()
+    segundos = time.perf_counter() - t0
+    filas = filas_fn(salida)
+    fila = {
+        "tamano": tamano,
+        "fase": fase,
+        "filas": filas,
+        "segundos": round(segundos, 4),
+        "filas_por_s": round(filas / segundos, 1) if segundos > 0 else None,
+        "round_trips": round_trips_fn() - rt0,
+        "memoria_pico_mb": round(tracemalloc.get_traced_memory()[1] / 1e6, 2),
+    }
+    resultados.append(fila)
+    print(f"  {fase:<40} {filas:>9} filas  {segundos:9.3f}s  {fila['filas_por_s'] or 0:>11} filas/s  "
+          f"{fila['round_trips']:>7} RT  {fila['memoria_pico_mb']:>9} MB")
+    return salida
+
+
+def _aplicar_schema(cursor):
+    with open(SCHEMA, encoding='utf-8') as f:
+        sentencias = "\n".join(l for l in f if not l.lstrip().startswith('--'))
+    for sql in sentencias.split(';'):
+        if sql.strip():
+            cursor.execute(sql)
+
+
+def benchmark_tamano(tamano: int, args, resultados: list):
+    print(f"\n== {tamano} líneas ==")
+    ruta = os.path.join(tempfile.gettempdir(), f"picklist_bench_{tamano}.json")
+    if not os.path.exists(ruta):
+        escribir_picklist(ruta, tamano)
+    with open(ruta, encoding='utf-8') as f:
+        picklist_origen = json.load(f)
+
+    server = StandInServer(picklist=picklist_origen, latencia=args.latencia)
+    del picklist_origen
+    server.iniciar_en_hilo()
+    base = server.url_base
+    settings.API_URL = base + '/RYM0501'
+    settings.API_URL_PROUBI = base + '/RYM0503'
+    settings.API_TOKEN_URL = base + '/token'
+
+    api_service = APIService()
+    api_service.api.oauth_manager.token_url = settings.API_TOKEN_URL
+    http_rt = lambda: server.stats['token'] + server.stats['rym0501'] + server.stats['rym0503']
+    if args.pipeline and not args.sin_db:
+        try:
+            _benchmark_pipeline(tamano, api_service, resultados)
+        finally:
+            api_service.cerrar()
+            server.shutdown()
+            server.server_close()
+        return
+
+    try:
+        picklist = _medir(resultados, tamano, "fetch (obtener_picklist)",
+                          api_service.obtener_picklist, len, http_rt)
+        productos_ubi = _medir(resultados, tamano, "proubi (obtener_productos_ubicacion_batch)",
+                               lambda: api_service.obtener_productos_ubicacion_batch(picklist),
+                               lambda _: len(picklist), http_rt)
+    finally:
+        api_service.cerrar()
+        server.shutdown()
+        server.server_close()
+
+    _medir(resultados, tamano, "validate (validate_data)",
+           lambda: sum(1 for r in picklist if validate_data(r)), lambda n: n, lambda: 0)
+
+    if args.sin_db:
+        return
+
+    with contando_round_trips() as contador:
+        _benchmark_bd(tamano, picklist, productos_ubi, contador, resultados)
+
+
+def _benchmark_bd(tamano: int, picklist: list, productos_ubi: list, contador: ContadorRoundTrips,
+                  resultados: list):
+    data_service = DataService()
+    data_service.conectar_bd()
+    try:
+        _aplicar_schema(data_service.cursor)
+        data_service.cnx.commit()
+        db_rt = lambda: contador.round_trips
+
+        _medir(resultados, tamano, "insertar_datos",
+               lambda: data_service.insertar_datos(picklist, mapear=False), lambda _: len(picklist), db_rt)
+        _medir(resultados, tamano, "insertar_productos_ubicacion",
+               lambda: data_service.insertar_productos_ubicacion(productos_ubi, mapear=False),
+               lambda _: len(productos_ubi), db_rt)
+        _medir(resultados, tamano, "mapear_ubicaciones", data_service.mapear_ubicaciones, lambda n: n, db_rt)
+    finally:
+        data_service.cerrar_conexion()
+
+
+def _benchmark_pipeline(tamano: int, api_service, resultados: list):
+    """Fetch, PROUBI y escritura solapados (services/pipeline.py) como una sola fase."""
+    with contando_round_trips() as contador:
+        data_service = DataService()
+        data_service.conectar_bd()
+        try:
+            _aplicar_schema(data_service.cursor)
+            data_service.cnx.commit()
+            _medir(resultados, tamano, "pipeline (rym0501 + proubi + bd)",
+                   lambda: ejecutar_pipeline(api_service, data_service),
+                   lambda r: r["registros"], lambda: contador.round_trips)
+        finally:
+            data_service.cerrar_conexion()
+
+
+def _commit_actual() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de punta a punta contra stand-in y MySQL local.")
+    parser.add_argument("--tamanos", default="1000,100000,1000000")
+    parser.add_argument("--latencia", type=float, default=0.0, help="Latencia simulada por llamada HTTP (s).")
+    parser.add_argument("--modo-carga", choices=("filas", "bulk", "json"), default=settings.DB_MODO_CARGA,
+                        help="Modo de escritura de DataService (bulk requiere local_infile=ON en el servidor).")
+    parser.add_argument("--escritores", type=int, default=settings.DB_ESCRITORES,
+                        help="Conexiones que escriben los detalles en paralelo (modo filas).")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Mide fetch, PROUBI y escritura solapados en una sola fase (requiere BD).")
+    parser.add_argument("--sin-db", action="store_true", help="Solo mide las fases de API y validación.")
+    parser.add_argument("--db-host", default=os.getenv('BENCH_DB_HOST', '127.0.0.1'))
+    parser.add_argument("--db-port", type=int, default=int(os.getenv('BENCH_DB_PORT', 3306)))
+    parser.add_argument("--db-user", default=os.getenv('BENCH_DB_USER', 'root'))
+    parser.add_argument("--db-password", default=os.getenv('BENCH_DB_PASSWORD', ''))
+    parser.add_argument("--db-database", default=os.getenv('BENCH_DB_DATABASE', 'totvs_bench'))
+    parser.add_argument("--salida", help="Archivo de resultados (por defecto benchmarks/results/bench_<fecha>.json)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s [%(levelname)s] %(message)s')
+    logger.setLevel(logging.WARNING)
+
+    settings.DB_HOST = args.db_host
+    settings.DB_PORT = args.db_port
+    settings.DB_USER = args.db_user
+    settings.DB_PASSWORD = args.db_password
+    settings.DB_DATABASE = args.db_database
+    settings.DB_MODO_CARGA = args.modo_carga
+    settings.DB_ESCRITORES = max(1, args.escritores)
+    settings.DB_POOL_SIZE = max(settings.DB_POOL_SIZE, settings.DB_ESCRITORES + 1)
+
+    tracemalloc.start()
+    resultados: list[dict] = []
+    for tamano in [int(t) for t in args.tamanos.split(',') if t.strip()]:
+        benchmark_tamano(tamano, args, resultados)
+    tracemalloc.stop()
+
+    os.makedirs(RESULTADOS, exist_ok=True)
+    salida = args.salida or os.path.join(RESULTADOS, f"bench_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump({
+            "fecha": datetime.now().isoformat(timespec='seconds'),
+            "commit": _commit_actual(),
+            "config": {
+                "PROUBI_MAX_WORKERS": settings.PROUBI_MAX_WORKERS,
+                "PROUBI_RANGO_MAX_PARES": settings.PROUBI_RANGO_MAX_PARES,
+                "PROUBI_RANGO_PREFIJO_PRODUCTO": settings.PROUBI_RANGO_PREFIJO_PRODUCTO,
+                "PROUBI_RANGO_PREFIJO_UBICACION": settings.PROUBI_RANGO_PREFIJO_UBICACION,
+                "RYM0501_STREAMING": settings.RYM0501_STREAMING,
+                "PU_UPSERT_POR_LOTES": settings.PU_UPSERT_POR_LOTES,
+                "DB_MODO_CARGA": settings.DB_MODO_CARGA,
+                "DB_CHUNK_GRUPOS": settings.DB_CHUNK_GRUPOS,
+                "DB_ESCRITORES": settings.DB_ESCRITORES,
+                "pipeline": args.pipeline,
+                "PIPELINE_TRAMO_REGISTROS": settings.PIPELINE_TRAMO_REGISTROS,
+                "latencia": args.latencia,
+                "db": not args.sin_db,
+            },
+            "resultados": resultados,
+        }, f, indent=2)
+    print(f"\nResultados guardados en {salida}")
+
+
+if __name__ == "__main__":
+    main()
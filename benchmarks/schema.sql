@@ -0,0 +1,73 @@
+-- benchmarks/schema.sql
+-- Esquema aproximado al de producción, reconstruido a partir de las columnas y
+-- llaves que usan src/db/operations.py y los scripts de limpieza. Solo para la
+-- base de datos LOCAL del benchmark: borra y recrea las tablas.
+
+SET FOREIGN_KEY_CHECKS = 0;
+DROP TABLE IF EXISTS PickListDetalle;
+DROP TABLE IF EXISTS PickList;
+DROP TABLE IF EXISTS ProductosUbicacion;
+DROP TABLE IF EXISTS Productos;
+DROP TABLE IF EXISTS Tienda;
+DROP TABLE IF EXISTS Clientes;
+DROP TABLE IF EXISTS SyncEstado;
+SET FOREIGN_KEY_CHECKS = 1;
+
+CREATE TABLE Clientes (
+    ClienteID      VARCHAR(20)  NOT NULL PRIMARY KEY,
+    ClienteNombre  VARCHAR(255) NULL
+);
+
+CREATE TABLE Tienda (
+    TiendaPK       INT          NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    ClienteID      VARCHAR(20)  NOT NULL,
+    TiendaID       VARCHAR(20)  NOT NULL,
+    DestinoNombre  VARCHAR(255) NULL,
+    KEY idx_cliente_tienda (ClienteID, TiendaID)
+);
+
+CREATE TABLE Productos (
+    ProductoID           VARCHAR(50)  NOT NULL PRIMARY KEY,
+    ProductoDescripcion  VARCHAR(255) NULL
+);
+
+CREATE TABLE PickList (
+    PickListID     INT          NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    ClienteID      VARCHAR(20)  NULL,
+    Pedido         VARCHAR(30)  NOT NULL,
+    Cliente        VARCHAR(255) NULL,
+    Tienda         VARCHAR(20)  NULL,
+    TiendaTOTVS    VARCHAR(20)  NULL,
+    PickListFecha  DATETIME     NULL,
+    UNIQUE KEY uq_pedido (Pedido)
+);
+
+CREATE TABLE PickListDetalle (
+    PickListDetalleID  INT           NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    PickListID         INT           NOT NULL,
+    ProductoID         VARCHAR(50)   NOT NULL,
+    CantidadRequerida  DECIMAL(12,2) NULL,
+    UbicacionTotvs     VARCHAR(30)   NULL,
+    UbicacionID        VARCHAR(36)   NULL,
+    Recolectado        TINYINT       NOT NULL DEFAULT 0,
+    CantidadSurtida    DECIMAL(12,2) NOT NULL DEFAULT 0,
+    Item               VARCHAR(10)   NULL,
+    TiendaTOTVS        VARCHAR(20)   NULL,
+    OC                 VARCHAR(40)   NULL,
+    Precio             DECIMAL(12,2) NULL,
+    Pedido             VARCHAR(30)   NULL,
+    ClienteID          VARCHAR(20)   NULL,
+    UNIQUE KEY uq_detalle (PickListID, Item, ProductoID),
+    KEY idx_producto_ubicacion (ProductoID, UbicacionTotvs),
+    CONSTRAINT fk_detalle_producto FOREIGN KEY (ProductoID) REFERENCES Productos (ProductoID)
+);
+
+CREATE TABLE ProductosUbicacion (
+    ProductoUbicacionID  VARCHAR(36)  NOT NULL PRIMARY KEY,
+    ProductoID           VARCHAR(50)  NOT NULL,
+    UbicacionID          VARCHAR(30)  NOT NULL,
+    AnaquelID            VARCHAR(30)  NULL,
+    Stock                INT          NOT NULL DEFAULT 0,
+    StockMinimo          INT          NULL,
+    UNIQUE KEY uk_producto_ubicacion (ProductoID, UbicacionID)
+);
@@ -0,0 +1,82 @@
+# benchmarks/synthetic.py
+"""
+Generador de PickList sintético (RYM0501) con la forma de picklist_response.json.
+
+Uso:
+  python benchmarks/synthetic.py --lineas 100000 --salida /tmp/picklist_100k.json
+
+Las filas PROUBI (RYM0503) no se generan aquí: el stand-in las deriva de forma
+determinista de los pares (producto, ubicacion) del PickList.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(RAIZ, 'src'))
+
+from utils.json_stream import EscritorArregloJSON
+
+PLANTILLA = os.path.join(RAIZ, 'picklist_response.json')
+
+
+def _cargar_plantilla() -> list[dict]:
+    with open(PLANTILLA, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def generar_registros(lineas: int, semilla: int = 42, items_por_pedido: int = 12,
+                      productos: int | None = None, depositos=("01",)):
+    """
+    Genera `lineas` registros RYM0501. Conserva el relleno con espacios de los campos
+    de TOTVS y reparte los registros en pedidos de ~`items_por_pedido` líneas.
+    """
+    plantilla = _cargar_plantilla()
+    rng = random.Random(semilla)
+    productos = productos or max(10, lineas // 5)
+    clientes = [("000134", "AMAZON"), ("000201", "LIVERPOOL"), ("000317", "WALMART"), ("000422", "COPPEL")]
+    pedido_base = 200000
+
+    for i in range(lineas):
+        base = plantilla[i % len(plantilla)]
+        n_pedido, n_item = divmod(i, items_por_pedido)
+        cliente, nombre = clientes[n_pedido % len(clientes)]
+        prod = rng.randrange(productos)
+        r = dict(base)
+        r["producto"] = f"{900 + prod % 100:03d}-{prod:06d}".ljust(20)
+        r["descripcion"] = f"PARTE SINTETICA {prod}".ljust(150)
+        r["ubicacion"] = f"A{prod % 40:02d}N{chr(65 + prod % 26)}CH{prod % 9}".ljust(15)
+        r["deposito"] = depositos[n_pedido % len(depositos)]
+        r["pedido"] = str(pedido_base + n_pedido)
+        r["item"] = f"{n_item + 1:02d}"
+        r["cliente"] = cliente
+        r["tienda"] = f"{n_pedido % 5 + 1:02d}"
+        r["nombre"] = nombre
+        r["cantidad_liberada"] = rng.randint(1, 50)
+        r["precio"] = rng.randint(10, 2000)
+        r["oc"] = f"MS-{19900000 + n_pedido}".ljust(20)
+        r["fecha"] = f"2025{1 + n_pedido % 12:02d}{1 + n_pedido % 28:02d}"
+        yield r
+
+
+def escribir_picklist(ruta: str, lineas: int, **kwargs) -> str:
+    with EscritorArregloJSON(ruta) as escritor:
+        for r in generar_registros(lineas, **kwargs):
+            escritor.escribir(r)
+    return ruta
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera un PickList RYM0501 sintético.")
+    parser.add_argument("--lineas", type=int, default=1000)
+    parser.add_argument("--salida", required=True)
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args(argv)
+    escribir_picklist(args.salida, args.lineas, semilla=args.semilla)
+    print(f"{args.lineas} registros escritos en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,14 @@
-import mysql.connector
 import os
-from dotenv import load_dotenv
+import sys
 
-load_dotenv()
+# Añadimos 'src' al path para usar el pool de conexiones de db.connection
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
 
-db_config = {
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT'),
-    'database': os.getenv('DB_DATABASE'),
-}
+from db.connection import get_db_connection
 
 def check_schema():
     try:
-        cnx = mysql.connector.connect(**db_config)
+        cnx = get_db_connection()
         cursor = cnx.cursor()
         
         tables = ['PickList', 'PickListDetalle']
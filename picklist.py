@@ -7,6 +7,7 @@ from mysql.connector import errorcode
 from datetime import datetime
 import logging
 import os
+import sys
 import uuid
 from dotenv import load_dotenv
 
@@ -28,14 +29,9 @@ API_URL = os.getenv('API_URL')
 API_USERNAME = os.getenv('API_USERNAME')
 API_PASSWORD = os.getenv('API_PASSWORD')
 
-db_config = {
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT'),
-    'database': os.getenv('DB_DATABASE'),
-    'raise_on_warnings': False
-}
+# La BD se toma del pool de conexiones de src/db/connection.py (DB_* del .env)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from db.connection import get_db_connection
 
 # Tamaño de lote para commits intermedios si lo deseas (no obligatorio aquí)
 CHUNK_SIZE = 500
@@ -109,7 +105,7 @@ def conectar_base_datos():
     Retorna (cnx, cursor).
     """
     try:
-        cnx = mysql.connector.connect(**db_config)
+        cnx = get_db_connection()
         cursor = cnx.cursor()
         logging.info("Conexión a la base de datos establecida.")
         return cnx, cursor
@@ -1,6 +1,11 @@
 # src/api/api_services.py
-import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from api.client import APIClient
+from api.proubi_planner import clave_par, planificar_consultas, repartir_respuestas
+from config.settings import settings
+from utils.json_stream import ArregloJSONIncompleto, EscritorArregloJSON
 from utils.logger import logger
 
 def _clean(x: str | None) -> str:
@@ -11,44 +16,147 @@ def _to_int(x):
     except:
         return 0
 
+# Referencia desde la que RYM0501 devuelve registros: serie = fecha AAAAMMDD y folio = hora
+# HH:MM:SS, ambos completados con puntos. Es el body fijo que se usaba antes del watermark.
+WATERMARK_INICIAL = {"serie": "20230719.......", "folio": "12:04:29......."}
+
+
+def _referencia(valor: str) -> str:
+    return valor.ljust(15, ".")
+
+
+def watermark_desde_registros(registros, actual: dict | None = None) -> dict | None:
+    """
+    Calcula el siguiente watermark a partir de la `fecha` (AAAAMMDD) más reciente de
+    los registros procesados. Como RYM0501 no devuelve hora, el folio queda en 00:00:00:
+    la siguiente corrida vuelve a pedir ese día completo y los repetidos se descartan
+    por INSERT IGNORE. Devuelve None si no hay una fecha posterior a `actual`.
+    """
+    maxima = ""
+    for r in registros:
+        fecha = _clean(r.get("fecha"))
+        if len(fecha) == 8 and fecha.isdigit() and fecha > maxima:
+            maxima = fecha
+    if not maxima:
+        return None
+    nuevo = {"serie": _referencia(maxima), "folio": _referencia("00:00:00")}
+    if actual and nuevo["serie"][:8] <= str(actual.get("serie", ""))[:8]:
+        return None
+    return nuevo
+
+
 class APIService:
     """Orquesta RYM0501 (PickList) y PROUBI (RYM0503)."""
 
-    def __init__(self):
+    def __init__(self, depositos=None):
         self.api = APIClient()
+        # Depósitos permitidos: el resto de RYM0501 y de PROUBI se descarta
+        self.depositos = tuple(depositos or settings.DEPOSITOS)
 
-    # 1) PICKLIST desde RYM0501 (GET con body JSON)
-    def obtener_picklist(self) -> list[dict]:
-        logger.info("Solicitando PickList a RYM0501...")
+    def cerrar(self):
+        """Cierra la sesión HTTP compartida (registra conexiones nuevas vs reutilizadas)."""
+        self.api.close()
+
+    def log_conexiones(self):
+        """Registra el uso de la sesión HTTP desde el último registro, sin cerrarla (modo daemon)."""
+        self.api.log_metricas()
+        self.api.log_conexiones()
 
-        body = {
-            "referencia_serie": "20230719.......",
-            "referencia_folio": "12:04:29......."
+    # 1) PICKLIST desde RYM0501 (GET con body JSON)
+    def _build_picklist_body(self, watermark: dict | None = None) -> dict:
+        wm = watermark or WATERMARK_INICIAL
+        return {
+            "referencia_serie": wm["serie"],
+            "referencia_folio": wm["folio"]
         }
 
-        data = self.api.get_rym0501(json_body=body)  # GET con body JSON
+    def iter_picklist(self, watermark: dict | None = None):
+        """
+        Modo streaming: parsea la respuesta de RYM0501 registro a registro, filtra los
+        depósitos permitidos al vuelo y entrega cada registro sin construir la lista completa.
+        El volcado de depuración (settings.PICKLIST_DUMP_FILE) es opcional y compacto.
+        Con `watermark` solo se piden los registros posteriores a esa serie/folio.
+
+        Si la respuesta no es un arreglo no entrega nada. Si el arreglo llega cortado
+        lanza ArregloJSONIncompleto: lo entregado hasta ahí es parcial y el llamador no
+        debe avanzar el watermark.
+        """
+        logger.info("Solicitando PickList a RYM0501 (streaming) desde %s...", watermark or WATERMARK_INICIAL)
+        depositos_encontrados = Counter()
+        with EscritorArregloJSON(settings.PICKLIST_DUMP_FILE) as volcado:
+            try:
+                for r in self.api.iter_rym0501(json_body=self._build_picklist_body(watermark)):
+                    if not isinstance(r, dict):
+                        continue
+                    deposito = _clean(r.get("deposito"))
+                    depositos_encontrados[deposito] += 1
+                    # Filtrar para tomar solo los depósitos configurados (refacciones = "01")
+                    if deposito not in self.depositos:
+                        continue
+                    volcado.escribir(r)
+                    yield r
+            except ArregloJSONIncompleto as e:
+                logger.error("Respuesta PickList de RYM0501 cortada tras %s registros: %s",
+                             sum(depositos_encontrados.values()), e)
+                raise
+            except ValueError as e:
+                logger.error("Respuesta PickList no es lista: %s", e)
+                return
+
+        logger.info("Depósitos encontrados en la API RYM0501: %s", dict(depositos_encontrados))
+        self._log_aceptados(depositos_encontrados)
+        if settings.PICKLIST_DUMP_FILE:
+            logger.info("PickList volcado en %s", settings.PICKLIST_DUMP_FILE)
+
+    def obtener_picklist(self, watermark: dict | None = None) -> list[dict]:
+        if settings.RYM0501_STREAMING:
+            try:
+                return list(self.iter_picklist(watermark))
+            except ArregloJSONIncompleto:
+                # Un PickList parcial no se escribe: la corrida falla y el watermark no se mueve
+                raise
+            except Exception as e:
+                logger.error("Error leyendo PickList de RYM0501: %s", e)
+                return []
+
+        logger.info("Solicitando PickList a RYM0501 desde %s...", watermark or WATERMARK_INICIAL)
+
+        data = self.api.get_rym0501(json_body=self._build_picklist_body(watermark))  # GET con body JSON
 
         if not isinstance(data, list):
             logger.error("Respuesta PickList no es lista.")
             return []
 
         # Log para depuración: Ver qué depósitos vienen realmente
-        depositos_encontrados = set(_clean(r.get("deposito")) for r in data)
-        logger.info("Depósitos encontrados en la API RYM0501: %s", depositos_encontrados)
+        depositos_encontrados = Counter(_clean(r.get("deposito")) for r in data)
+        logger.info("Depósitos encontrados en la API RYM0501: %s", dict(depositos_encontrados))
 
-        # Filtrar para tomar solo las refacciones (depósito "01")
-        data = [r for r in data if _clean(r.get("deposito")) == "01"]
+        # Filtrar para tomar solo los depósitos configurados (refacciones = "01")
+        data = [r for r in data if _clean(r.get("deposito")) in self.depositos]
 
-        logger.info("PickList: %s registros tras filtrar por depósito 01.", len(data))
-        with open("picklist_response.json", "w") as f:
-            json.dump(data, f, indent=4)
+        self._log_aceptados(depositos_encontrados)
+        with EscritorArregloJSON(settings.PICKLIST_DUMP_FILE) as volcado:
+            for r in data:
+                volcado.escribir(r)
+        if settings.PICKLIST_DUMP_FILE:
+            logger.info("PickList volcado en %s", settings.PICKLIST_DUMP_FILE)
         return data
 
+    def _log_aceptados(self, depositos_encontrados: Counter):
+        por_deposito = {d: depositos_encontrados.get(d, 0) for d in self.depositos}
+        logger.info("PickList: %s registros tras filtrar por depósitos %s: %s",
+                    sum(por_deposito.values()), ", ".join(self.depositos), por_deposito)
+
+    def _deposito(self, reg: dict) -> str:
+        """Depósito del registro; si no está permitido se usa el primero configurado."""
+        depo = _clean(reg.get("deposito"))
+        return depo if depo in self.depositos else self.depositos[0]
+
     # 2) Construye el body para PROUBI (RYM0503) a partir de un registro del PickList
     def _build_proubi_body(self, reg: dict) -> dict:
         prod = _clean(reg.get("producto"))
-        # Se asegura que la consulta a PROUBI sea solo para el depósito 01 (Refacciones)
-        depo = "01" 
+        # Se asegura que la consulta a PROUBI sea solo para el depósito (permitido) del registro
+        depo = self._deposito(reg)
         ubi  = _clean(reg.get("ubicacion"))
         return {
             "de_producto":  prod, "a_producto":   prod,
@@ -63,26 +171,122 @@ class APIService:
         res = self.api.get_proubi(json_body=body)
         return res if isinstance(res, list) else []
 
-    # 4) Batch: a partir del PickList arma registros para ProductosUbicacion
-    def obtener_productos_ubicacion_batch(self, picklist: list[dict]) -> list[dict]:
+    # 4) Ejecuta varias consultas PROUBI con un máximo de llamadas en vuelo.
+    #    Las respuestas se devuelven en el mismo orden que `bodies`, junto con las
+    #    métricas de latencia de esta llamada (no se guardan en la instancia, que
+    #    comparten los hilos por depósito).
+    def _consultar_proubi_bodies(self, bodies: list[dict], max_workers: int) -> tuple[list[list[dict]], dict]:
+        latencias = [0.0] * len(bodies)
+
+        def _consultar(args):
+            i, body = args
+            t0 = time.perf_counter()
+            res = self.api.get_proubi(json_body=body)
+            latencias[i] = time.perf_counter() - t0
+            logger.debug("PROUBI #%s %.3fs: %s", i, latencias[i], body)
+            return res if isinstance(res, list) else []
+
+        t0 = time.perf_counter()
+        if max_workers <= 1 or len(bodies) <= 1:
+            resultados = [_consultar(x) for x in enumerate(bodies)]
+        else:
+            # Obtener el token antes de abrir el pool evita que cada hilo lo pida a la vez.
+            # Si falla, cada llamada registrará su propio error.
+            try:
+                self.api.oauth_manager.get_token()
+            except Exception:
+                pass
+            workers = min(max_workers, len(bodies))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="proubi") as pool:
+                resultados = list(pool.map(_consultar, enumerate(bodies)))
+
+        return resultados, self._registrar_latencias(latencias, time.perf_counter() - t0, max_workers)
+
+    def _registrar_latencias(self, latencias: list[float], total: float, max_workers: int) -> dict:
+        if not latencias:
+            return {}
+        orden = sorted(latencias)
+        metricas = {
+            "llamadas":   len(orden),
+            "workers":    max(1, max_workers),
+            "total_s":    round(total, 3),
+            "p50_s":      round(orden[len(orden) // 2], 3),
+            "p95_s":      round(orden[min(len(orden) - 1, int(len(orden) * 0.95))], 3),
+            "max_s":      round(orden[-1], 3),
+        }
+        logger.info(
+            "PROUBI: %(llamadas)s llamadas en %(total_s)ss (workers=%(workers)s) | "
+            "latencia p50=%(p50_s)ss p95=%(p95_s)ss max=%(max_s)ss",
+            metricas,
+        )
+        return metricas
+
+    # 5) Convierte la respuesta PROUBI de un registro del PickList en filas de ProductosUbicacion
+    def _mapear_proubi(self, reg: dict, proubi_list: list[dict]) -> list[dict]:
+        out: list[dict] = []
+        depo = self._deposito(reg)
+        for r in proubi_list:
+            # FILTRO CRÍTICO: Asegurar que solo capturamos stock del depósito del registro
+            if _clean(r.get("deposito")) != depo:
+                 continue
+
+            out.append({
+                "ProductoID":          _clean(r.get("producto")) or _clean(reg.get("producto")),
+                "ProductoDescripcion": _clean(r.get("descripcion")) or "",
+                "UbicacionID":         _clean(r.get("ubicacion")),
+                "AnaquelID":           _clean(r.get("anaquel") or ""),
+                "Stock":               _to_int(r.get("cantidadTotal")),
+                "StockMinimo":         int(r.get("stock_minimo") or 0),
+                "SYNC":                0,
+                "SYNCUsuario":         "api-sync",
+                "tmpSwap":             None,
+            })
+        return out
+
+    # 6) Batch: a partir del PickList arma registros para ProductosUbicacion
+    def obtener_productos_ubicacion_batch(self, picklist: list[dict], max_workers: int | None = None,
+                                          max_pares_rango: int | None = None,
+                                          metricas: dict | None = None) -> list[dict]:
+        """
+        Consulta PROUBI para los pares (producto, ubicacion) del PickList con hasta
+        `max_workers` llamadas en paralelo (por defecto settings.PROUBI_MAX_WORKERS; 1 = secuencial).
+
+        Los pares repetidos se consultan una sola vez y, si `max_pares_rango` > 1
+        (por defecto settings.PROUBI_RANGO_MAX_PARES), los pares ordenados se agrupan
+        en consultas por rango, acotadas en ancho por PROUBI_RANGO_PREFIJO_PRODUCTO y
+        PROUBI_RANGO_PREFIJO_UBICACION. Cada línea se consulta en su depósito. El resultado
+        conserva el orden del PickList y una entrada por línea, igual que la versión secuencial.
+        Si se pasa `metricas`, se llena con las latencias PROUBI de esta llamada.
+        """
+        if max_workers is None:
+            max_workers = settings.PROUBI_MAX_WORKERS
+        if max_pares_rango is None:
+            max_pares_rango = settings.PROUBI_RANGO_MAX_PARES
+
+        pares = [(reg.get("producto"), reg.get("ubicacion")) for reg in picklist]
+        depositos = [self._deposito(reg) for reg in picklist]
+        # Un plan por depósito; todas las consultas comparten el mismo pool de llamadas
+        planes = {
+            depo: planificar_consultas([p for p, d in zip(pares, depositos) if d == depo], depo, max_pares_rango,
+                                       settings.PROUBI_RANGO_PREFIJO_PRODUCTO, settings.PROUBI_RANGO_PREFIJO_UBICACION)
+            for depo in dict.fromkeys(depositos)
+        }
+        consultas = [c for plan in planes.values() for c in plan]
+        logger.info("PROUBI plan: %s líneas -> %s pares únicos -> %s consultas (max_pares_rango=%s, depósitos %s)",
+                    len(picklist), sum(len(c["pares"]) for c in consultas), len(consultas), max_pares_rango,
+                    ", ".join(planes) or "-")
+
+        resultados, latencias = self._consultar_proubi_bodies([c["body"] for c in consultas], max_workers)
+        if metricas is not None:
+            metricas.update(latencias)
+        respuestas = iter(resultados)
+        por_par = {}
+        for depo, plan in planes.items():
+            for clave, filas in repartir_respuestas(plan, [next(respuestas) for _ in plan]).items():
+                por_par[(depo, clave)] = filas
+
         out: list[dict] = []
-        for reg in picklist:
-            proubi_list = self.consultar_proubi_por_registro(reg)
-            for r in proubi_list:
-                # FILTRO CRÍTICO: Asegurar que solo capturamos stock del depósito 01
-                if _clean(r.get("deposito")) != "01":
-                     continue
-
-                out.append({
-                    "ProductoID":          _clean(r.get("producto")) or _clean(reg.get("producto")),
-                    "ProductoDescripcion": _clean(r.get("descripcion")) or "",
-                    "UbicacionID":         _clean(r.get("ubicacion")),
-                    "AnaquelID":           _clean(r.get("anaquel") or ""),
-                    "Stock":               _to_int(r.get("cantidadTotal")),
-                    "StockMinimo":         int(r.get("stock_minimo") or 0),
-                    "SYNC":                0,
-                    "SYNCUsuario":         "api-sync",
-                    "tmpSwap":             None,
-                })
+        for reg, (prod, ubi), depo in zip(picklist, pares, depositos):
+            out.extend(self._mapear_proubi(reg, por_par.get((depo, clave_par(prod, ubi)), [])))
         logger.info("ProductosUbicacion a insertar/actualizar: %s", len(out))
-        return out
\ No newline at end of file
+        return out
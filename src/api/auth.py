@@ -1,9 +1,18 @@
+import json
+import os
+import threading
 import time
+from contextlib import contextmanager
 import requests
 from requests_oauthlib import OAuth1
 from config.settings import settings
 from utils.logger import logger
 
+try:
+    import fcntl
+except ImportError:  # Windows: the cache still works, without the inter-process lock
+    fcntl = None
+
 class OAuth2Manager:
     _instance = None
 
@@ -24,37 +33,168 @@ class OAuth2Manager:
         self.refresh_token = None
         self.expires_at = 0
 
+        # Shared keep-alive session (set by APIClient); falls back to plain requests
+        self.session = None
+        self.timeout = settings.API_TOKEN_TIMEOUT
+
+        # Token cache shared by short-lived runs and parallel workers
+        self.cache_file = settings.TOKEN_CACHE_FILE
+        self.refresh_margin = settings.TOKEN_REFRESH_MARGIN
+        self.background_refresh = settings.TOKEN_BACKGROUND_REFRESH
+        self._lock = threading.Lock()
+        self._timer = None
+        # Margin used by the scheduled refresh (refresh_margin capped for short-lived tokens)
+        self._refresh_buffer = self.refresh_margin
+        self._load_cache()
+        if self._is_token_valid():
+            self._schedule_refresh()
+
+    def bind_session(self, session):
+        """Uses the given requests.Session for token calls so they reuse pooled connections."""
+        self.session = session
+
+    def unbind_session(self, session):
+        if self.session is session:
+            self.session = None
+
+    def _post(self, data):
+        auth = OAuth1(self.consumer_key, self.consumer_secret)
+        http = self.session or requests
+        return http.post(self.token_url, auth=auth, data=data, timeout=self.timeout)
+
     def get_token(self):
-        """Returns a valid access token, refreshing or fetching a new one if necessary."""
+        """
+        Returns a valid access token, refreshing or fetching a new one if necessary.
+        Refresh is single-flight: one caller (thread or process) refreshes while the others wait
+        and then reuse its token.
+        """
         if self._is_token_valid():
             return self.access_token
-        
-        if self.refresh_token:
-            if self._refresh_access_token():
-                return self.access_token
 
-        self._fetch_new_token()
-        return self.access_token
+        with self._lock:
+            # Another thread may have refreshed while we were waiting
+            if not self._is_token_valid():
+                self._renew()
+            return self.access_token
+
+    def _renew(self, buffer=60):
+        """
+        Refreshes or fetches the token under the inter-process lock, unless the cache already
+        holds one valid for more than `buffer` seconds. Call with self._lock held.
+        """
+        with self._cache_lock():
+            # Another process may have refreshed while we were waiting
+            self._load_cache()
+            if self._is_token_valid(buffer):
+                self._schedule_refresh()
+                return
+
+            if not (self.refresh_token and self._refresh_access_token()):
+                self._fetch_new_token()
+            self._save_cache()
+        self._schedule_refresh()
+
+    def stop(self):
+        """Cancels the background refresh timer."""
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
 
-    def _is_token_valid(self):
+    def _schedule_refresh(self):
+        """
+        Schedules a background refresh `refresh_margin` seconds before expires_at. The margin is
+        capped at half the token's remaining lifetime, so a token that lives less than the margin
+        is refreshed halfway through instead of every second.
+        """
+        if not self.background_refresh or not self.access_token:
+            return
+        if self._timer:
+            self._timer.cancel()
+        remaining = self.expires_at - time.time()
+        self._refresh_buffer = min(self.refresh_margin, remaining / 2)
+        delay = max(1.0, remaining - self._refresh_buffer)
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            with self._lock:
+                self._timer = None
+                # Skipped if another process already left a token valid beyond the margin
+                self._renew(buffer=self._refresh_buffer)
+            logger.info("Access token refreshed in background (expires in %.0fs).", self.expires_at - time.time())
+        except Exception as e:
+            logger.warning(f"Background token refresh failed, will refresh on demand: {e}")
+
+    @contextmanager
+    def _cache_lock(self):
+        if not self.cache_file or fcntl is None:
+            yield
+            return
+        with open(self.cache_file + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_cache(self):
+        """Loads the token from the cache file if it belongs to the same endpoint/user and is newer."""
+        if not self.cache_file:
+            return
+        try:
+            with open(self.cache_file, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable token cache {self.cache_file}: {e}")
+            return
+        if data.get("token_url") != self.token_url or data.get("username") != self.username:
+            return
+        if float(data.get("expires_at") or 0) > self.expires_at:
+            self.access_token = data.get("access_token")
+            self.refresh_token = data.get("refresh_token")
+            self.expires_at = float(data["expires_at"])
+
+    def _save_cache(self):
+        if not self.cache_file or not self.access_token:
+            return
+        data = {
+            "token_url": self.token_url,
+            "username": self.username,
+            "access_token": self.access_token,
+            "refresh_token": self.refresh_token,
+            "expires_at": self.expires_at,
+        }
+        tmp = f"{self.cache_file}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.cache_file)
+        except OSError as e:
+            logger.warning(f"Could not write token cache {self.cache_file}: {e}")
+
+    def _is_token_valid(self, buffer=60):
         """Checks if the current access token is valid with a buffer time."""
-        # Buffer of 60 seconds
-        return self.access_token and time.time() < (self.expires_at - 60)
+        # Buffer of 60 seconds by default
+        return bool(self.access_token) and time.time() < (self.expires_at - buffer)
 
     def _fetch_new_token(self):
         """Fetches a new access token using password grant and OAuth 1.0 signature."""
         logger.info("Fetching new access token...")
         try:
-            # Prepare OAuth 1.0 signature for client authentication
-            auth = OAuth1(self.consumer_key, self.consumer_secret)
-            
+            # OAuth 1.0 signature for client authentication is added in _post
             data = {
                 "grant_type": "password",
                 "username": self.username,
                 "password": self.password
             }
             
-            response = requests.post(self.token_url, auth=auth, data=data)
+            response = self._post(data)
             response.raise_for_status()
             
             self._update_tokens(response.json())
@@ -68,15 +208,13 @@ class OAuth2Manager:
         """Refreshes the access token using the refresh token."""
         logger.info("Refreshing access token...")
         try:
-            # Assuming refresh usually requires client authentication too
-            auth = OAuth1(self.consumer_key, self.consumer_secret)
-            
+            # Assuming refresh usually requires client authentication too (see _post)
             data = {
                 "grant_type": "refresh_token",
                 "refresh_token": self.refresh_token
             }
             
-            response = requests.post(self.token_url, auth=auth, data=data) 
+            response = self._post(data)
             if response.status_code != 200:
                 logger.warning(f"Failed to refresh token: {response.text}")
                 return False
@@ -1,11 +1,18 @@
 # src/api/client.py
+import codecs
 import json as _json
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 # from requests.auth import HTTPBasicAuth  # Removed BasicAuth
 from urllib.parse import urljoin
 from config.settings import settings
+from utils.json_stream import iter_json_array
 from utils.logger import logger
-from .auth import OAuth2Manager 
+from .auth import OAuth2Manager
+from .standin import Grabador
+from .resilience import CircuitBreaker, STATUS_REINTENTABLES, calcular_espera, parse_retry_after
 
 class APIClient:
     def __init__(self):
@@ -13,14 +20,148 @@ class APIClient:
         self.url_proubi  = settings.API_URL_PROUBI   # p.ej. https://.../rest/RYM0503
         # self.auth = HTTPBasicAuth(settings.API_USERNAME, settings.API_PASSWORD) # Removed
         self.oauth_manager = OAuth2Manager() # Added OAuth Manager
-        self.timeout = 60
+        self.timeouts = {
+            "rym0501": settings.API_RYM0501_TIMEOUT,
+            "proubi":  settings.API_PROUBI_TIMEOUT,
+        }
         self.verify_ssl = True
+        self.session = self._crear_sesion()
+        self.oauth_manager.bind_session(self.session)
 
-    def _get(self, url: str, *, params=None, json_body=None, headers=None):
+        self.max_reintentos = settings.API_RETRY_MAX
+        self.breakers = {
+            endpoint: CircuitBreaker(
+                endpoint.upper(),
+                umbral_error=settings.API_CB_UMBRAL_ERROR,
+                min_llamadas=settings.API_CB_MIN_LLAMADAS,
+                ventana=settings.API_CB_VENTANA,
+                enfriamiento=settings.API_CB_ENFRIAMIENTO,
+            )
+            for endpoint in self.timeouts
+        }
+        self.metricas = {
+            endpoint: {"llamadas": 0, "reintentos": 0, "fallidas": 0, "rechazadas": 0}
+            for endpoint in self.timeouts
+        }
+        self._metricas_lock = threading.Lock()
+        self._dormir = time.sleep
+
+        # Estadísticas de conexiones ya registradas (log_conexiones muestra solo lo nuevo)
+        self._conexiones_registradas = {}
+
+        # Grabación de tráfico real para reproducirlo con api/standin.py
+        self.grabador = Grabador(settings.API_RECORD_DIR) if settings.API_RECORD_DIR else None
+
+    def _crear_sesion(self) -> requests.Session:
+        """
+        Sesión keep-alive compartida por RYM0501, RYM0503 y el endpoint de token.
+        Cada endpoint tiene su propio adaptador (pool de conexiones) con el tamaño de Settings.
+        """
+        session = requests.Session()
+        session.headers.update({"Accept-Encoding": "gzip", "Connection": "keep-alive"})
+        self._adapters = {}
+        for nombre, url, tamano in (
+            ("rym0501", self.url_rym0501, settings.API_RYM0501_POOL_SIZE),
+            ("proubi",  self.url_proubi,  settings.API_PROUBI_POOL_SIZE),
+            ("token",   settings.API_TOKEN_URL, settings.API_TOKEN_POOL_SIZE),
+        ):
+            if not url:
+                continue
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, tamano))
+            session.mount(url, adapter)
+            self._adapters[nombre] = adapter
+        return session
+
+    def stats_conexiones(self) -> dict:
+        """Peticiones, conexiones nuevas y reutilizadas por endpoint desde que se abrió la sesión."""
+        stats = {}
+        for nombre, adapter in self._adapters.items():
+            peticiones = nuevas = 0
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                peticiones += pool.num_requests
+                nuevas += pool.num_connections
+            stats[nombre] = {
+                "peticiones": peticiones,
+                "nuevas": nuevas,
+                "reutilizadas": max(0, peticiones - nuevas),
+            }
+        return stats
+
+    def _contar(self, endpoint: str, campo: str):
+        with self._metricas_lock:
+            self.metricas[endpoint][campo] += 1
+
+    def log_metricas(self):
+        """Registra llamadas, reintentos, fallos y estado del circuit breaker por endpoint."""
+        for endpoint, m in self.metricas.items():
+            breaker = self.breakers[endpoint]
+            logger.info("API %s: %s llamadas | %s reintentos | %s fallidas | %s rechazadas por breaker | "
+                        "breaker=%s (aperturas=%s)",
+                        endpoint, m["llamadas"], m["reintentos"], m["fallidas"], m["rechazadas"],
+                        breaker.estado, breaker.aperturas)
+
+    def log_conexiones(self) -> dict:
+        """
+        Registra peticiones y conexiones nuevas/reutilizadas por endpoint desde el registro
+        anterior (la sesión sigue abierta, p.ej. entre ciclos del daemon). Devuelve ese delta.
+        """
+        actuales = self.stats_conexiones()
+        delta = {}
+        for nombre, s in actuales.items():
+            previas = self._conexiones_registradas.get(nombre, {})
+            d = {k: v - previas.get(k, 0) for k, v in s.items()}
+            d["reutilizadas"] = max(0, d["peticiones"] - d["nuevas"])
+            delta[nombre] = d
+            if d["peticiones"]:
+                logger.info("Conexiones HTTP %s: %s peticiones | %s nuevas | %s reutilizadas",
+                            nombre, d["peticiones"], d["nuevas"], d["reutilizadas"])
+        self._conexiones_registradas = actuales
+        return delta
+
+    def close(self):
+        """Registra el uso de conexiones y cierra la sesión HTTP."""
+        if self.session is None:
+            return
+        self.log_metricas()
+        self.log_conexiones()
+        self.oauth_manager.unbind_session(self.session)
+        self.session.close()
+        self.session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _get(self, url: str, *, endpoint: str, params=None, json_body=None, headers=None):
+        """Devuelve el JSON de la respuesta o None si la llamada no se pudo completar."""
+        resp = self._enviar(url, endpoint=endpoint, params=params, json_body=json_body, headers=headers)
+        if resp is None:
+            return None
+        try:
+            data = resp.json()
+        except ValueError as e:
+            logger.error("Respuesta no JSON en %s: %s", resp.url, e)
+            self._contar(endpoint, "fallidas")
+            return None
+        if self.grabador:
+            self.grabador.grabar(endpoint, json_body, data)
+        return data
+
+    def _enviar(self, url: str, *, endpoint: str, params=None, json_body=None, headers=None, stream=False):
+        """
+        GET idempotente con reintentos (errores de red, timeouts, 429 y 5xx) y circuit breaker.
+        Devuelve la respuesta 2xx o None si la llamada no se pudo completar.
+        """
         h = {"Accept": "application/json"}
         if json_body is not None:
             h["Content-Type"] = "application/json"
-        
+
         # Add Authorization header
         try:
             token = self.oauth_manager.get_token()
@@ -29,33 +170,107 @@ class APIClient:
             logger.error(f"Failed to get OAuth token: {e}")
             return None
 
+        breaker = self.breakers[endpoint]
+        if not breaker.permitir():
+            self._contar(endpoint, "rechazadas")
+            logger.error("Circuit breaker %s abierto: se omite GET %s %s", endpoint.upper(), url, json_body or "")
+            return None
+        self._contar(endpoint, "llamadas")
+
         if headers:
             h.update(headers)
+        data = _json.dumps(json_body) if json_body is not None else None
 
-        try:
-            resp = requests.request(
-                method="GET",
-                url=url,
-                # auth=self.auth, # Removed
-                params=params,
-                data=_json.dumps(json_body) if json_body is not None else None,
-                headers=h,
-                timeout=self.timeout,
-                verify=self.verify_ssl,
-            )
-            resp.raise_for_status()
-            logger.info("GET OK: %s (%.2fs)", resp.url, resp.elapsed.total_seconds())
-            return resp.json()
-        except requests.HTTPError:
-            logger.error("HTTP %s en %s: %s", resp.status_code, resp.url, resp.text)
-        except Exception as e:
-            logger.error("Error GET %s: %s", url, e)
+        intento = 0
+        while True:
+            retry_after = None
+            try:
+                resp = self.session.request(
+                    method="GET",
+                    url=url,
+                    # auth=self.auth, # Removed
+                    params=params,
+                    data=data,
+                    headers=h,
+                    timeout=self.timeouts[endpoint],
+                    verify=self.verify_ssl,
+                    stream=stream,
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                motivo = f"{type(e).__name__}: {e}"
+            except Exception as e:
+                breaker.registrar_fallo()
+                logger.error("Error GET %s: %s", url, e)
+                break
+            else:
+                if resp.status_code in STATUS_REINTENTABLES:
+                    motivo = f"HTTP {resp.status_code}"
+                    retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                    resp.close()
+                elif resp.status_code >= 400:
+                    # Error del cliente: reintentar no cambia el resultado y no indica caída del servicio
+                    breaker.registrar_exito()
+                    logger.error("HTTP %s en %s: %s", resp.status_code, resp.url, resp.text)
+                    break
+                else:
+                    breaker.registrar_exito()
+                    logger.info("GET OK: %s (%.2fs)", resp.url, resp.elapsed.total_seconds())
+                    return resp
+
+            breaker.registrar_fallo()
+            if intento >= self.max_reintentos:
+                logger.error("GET %s falló tras %s intentos: %s", url, intento + 1, motivo)
+                break
+            if retry_after is not None and retry_after > settings.API_RETRY_AFTER_MAX:
+                logger.error("GET %s: Retry-After=%.0fs excede el máximo (%.0fs); no se reintenta",
+                             url, retry_after, settings.API_RETRY_AFTER_MAX)
+                break
+            if not breaker.permitir():
+                self._contar(endpoint, "rechazadas")
+                logger.error("Circuit breaker %s abierto: se cancelan los reintentos de %s", endpoint.upper(), url)
+                break
+
+            espera = retry_after if retry_after is not None else calcular_espera(
+                intento, settings.API_RETRY_BACKOFF_BASE, settings.API_RETRY_BACKOFF_MAX)
+            intento += 1
+            self._contar(endpoint, "reintentos")
+            logger.warning("Reintento %s/%s de GET %s en %.2fs (%s)",
+                           intento, self.max_reintentos, url, espera, motivo)
+            self._dormir(espera)
+
+        self._contar(endpoint, "fallidas")
         return None
 
     def get_rym0501(self, path: str = "", *, params=None, json_body=None, headers=None):
         url = self.url_rym0501 if not path else urljoin(self.url_rym0501.rstrip("/") + "/", path.lstrip("/"))
-        return self._get(url, params=params, json_body=json_body, headers=headers)
+        return self._get(url, endpoint="rym0501", params=params, json_body=json_body, headers=headers)
+
+    def iter_rym0501(self, path: str = "", *, params=None, json_body=None, headers=None, chunk_size=64 * 1024):
+        """
+        Igual que get_rym0501 pero sin cargar la respuesta completa: devuelve los
+        elementos del arreglo JSON a medida que llegan. Los reintentos cubren solo
+        el establecimiento de la respuesta; un corte a mitad del cuerpo se propaga.
+        Lanza ValueError si la respuesta no es un arreglo JSON y ArregloJSONIncompleto
+        si el arreglo llega cortado.
+        """
+        url = self.url_rym0501 if not path else urljoin(self.url_rym0501.rstrip("/") + "/", path.lstrip("/"))
+        resp = self._enviar(url, endpoint="rym0501", params=params, json_body=json_body, headers=headers,
+                            stream=True)
+        if resp is None:
+            return
+        decoder = codecs.getincrementaldecoder(resp.encoding or "utf-8")(errors="replace")
+        try:
+            textos = (decoder.decode(c) for c in resp.iter_content(chunk_size=chunk_size))
+            if not self.grabador:
+                yield from iter_json_array(textos)
+                return
+            with self.grabador.picklist() as escritor:
+                for elemento in iter_json_array(textos):
+                    escritor.escribir(elemento)
+                    yield elemento
+        finally:
+            resp.close()
 
     def get_proubi(self, path: str = "", *, params=None, json_body=None, headers=None):
         url = self.url_proubi if not path else urljoin(self.url_proubi.rstrip("/") + "/", path.lstrip("/"))
-        return self._get(url, params=params, json_body=json_body, headers=headers)
+        return self._get(url, endpoint="proubi", params=params, json_body=json_body, headers=headers)
@@ -0,0 +1,108 @@
+# src/api/proubi_planner.py
+"""
+Planificador de consultas PROUBI (RYM0503).
+
+Elimina pares (producto, ubicacion) repetidos y agrupa los pares ordenados en
+consultas por rango usando los límites de_*/a_* que ya acepta el endpoint.
+Después reparte las respuestas de cada rango de vuelta a sus pares.
+"""
+
+
+def _clean(x) -> str:
+    return str(x or "").strip()
+
+
+def clave_par(producto, ubicacion) -> tuple[str, str]:
+    """Clave normalizada de un par (producto, ubicacion)."""
+    return _clean(producto), _clean(ubicacion).upper()
+
+
+def _body(de_prod, a_prod, depo, de_ubi, a_ubi) -> dict:
+    return {
+        "de_producto":  de_prod, "a_producto":   a_prod,
+        "de_deposito":  depo,    "a_deposito":   depo,
+        "de_ubicacion": de_ubi,  "a_ubicacion":  a_ubi,
+    }
+
+
+def _mismo_rango(inicio: tuple[str, str], clave: tuple[str, str], prefijo_producto: int,
+                 prefijo_ubicacion: int) -> bool:
+    """True si `clave` puede entrar en el rango que empieza en `inicio` sin ensancharlo de más."""
+    return (clave[0][:prefijo_producto] == inicio[0][:prefijo_producto]
+            and clave[1][:prefijo_ubicacion] == inicio[1][:prefijo_ubicacion])
+
+
+def planificar_consultas(pares, deposito: str, max_pares: int, prefijo_producto: int = 0,
+                         prefijo_ubicacion: int = 0) -> list[dict]:
+    """
+    Devuelve la lista de consultas para cubrir `pares` (iterable de (producto, ubicacion)).
+
+    Cada consulta es un dict con:
+      - "body":  body JSON para RYM0503
+      - "pares": claves que cubre
+      - "rango": False si es la consulta exacta de un solo par
+
+    `max_pares` limita cuántos pares distintos entran en un rango. Con 1 se obtiene una
+    consulta exacta por par (comportamiento original, sin duplicados). Los pares con
+    producto o ubicación vacíos siempre se consultan por separado.
+
+    Pocos pares no bastan para acotar la respuesta: el rango trae todo el catálogo entre
+    sus extremos. Con `prefijo_producto`/`prefijo_ubicacion` > 0 un rango solo une pares
+    que comparten esos primeros caracteres con su primer par; si no, se abre otro rango.
+    """
+    originales: dict[tuple[str, str], tuple[str, str]] = {}
+    for prod, ubi in pares:
+        originales.setdefault(clave_par(prod, ubi), (_clean(prod), _clean(ubi)))
+
+    consultas: list[dict] = []
+    agrupables = []
+    for clave in sorted(originales):
+        if max_pares <= 1 or not clave[0] or not clave[1]:
+            prod, ubi = originales[clave]
+            consultas.append({"body": _body(prod, prod, deposito, ubi, ubi), "pares": [clave], "rango": False})
+        else:
+            agrupables.append(clave)
+
+    grupos: list[list[tuple[str, str]]] = []
+    for clave in agrupables:
+        if (grupos and len(grupos[-1]) < max_pares
+                and _mismo_rango(grupos[-1][0], clave, prefijo_producto, prefijo_ubicacion)):
+            grupos[-1].append(clave)
+        else:
+            grupos.append([clave])
+
+    for grupo in grupos:
+        if len(grupo) == 1:
+            prod, ubi = originales[grupo[0]]
+            consultas.append({"body": _body(prod, prod, deposito, ubi, ubi), "pares": grupo, "rango": False})
+            continue
+        ubicaciones = [c[1] for c in grupo]
+        consultas.append({
+            "body": _body(grupo[0][0], grupo[-1][0], deposito, min(ubicaciones), max(ubicaciones)),
+            "pares": grupo,
+            "rango": True,
+        })
+    return consultas
+
+
+def repartir_respuestas(consultas: list[dict], respuestas: list[list[dict]]) -> dict[tuple[str, str], list[dict]]:
+    """
+    Reparte las respuestas de `consultas` (mismo orden) por par.
+
+    Una consulta exacta asigna su respuesta completa al par, como antes. Una consulta
+    por rango trae también filas de pares no pedidos; solo se conservan las que
+    coinciden con algún par de la consulta.
+    """
+    por_par: dict[tuple[str, str], list[dict]] = {}
+    for consulta, filas in zip(consultas, respuestas):
+        if not consulta["rango"]:
+            por_par[consulta["pares"][0]] = list(filas)
+            continue
+        pedidos = set(consulta["pares"])
+        for clave in pedidos:
+            por_par.setdefault(clave, [])
+        for fila in filas:
+            clave = clave_par(fila.get("producto"), fila.get("ubicacion"))
+            if clave in pedidos:
+                por_par[clave].append(fila)
+    return por_par
@@ -0,0 +1,117 @@
+# src/api/resilience.py
+"""
+Reintentos con backoff exponencial (jitter) y circuit breaker por endpoint
+para las llamadas GET a TOTVS.
+"""
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from utils.logger import logger
+
+# Códigos que justifican reintentar un GET idempotente
+STATUS_REINTENTABLES = frozenset({429, 500, 502, 503, 504})
+
+
+def parse_retry_after(valor) -> float | None:
+    """Convierte un header Retry-After (segundos o fecha HTTP) en segundos de espera."""
+    if valor is None:
+        return None
+    valor = str(valor).strip()
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        fecha = parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return None
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return max(0.0, (fecha - datetime.now(timezone.utc)).total_seconds())
+
+
+def calcular_espera(intento: int, base: float, maximo: float, rng=random.random) -> float:
+    """Backoff exponencial con 'full jitter': uniforme entre 0 y min(maximo, base * 2**intento)."""
+    return rng() * min(maximo, base * (2 ** intento))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por tasa de error sobre una ventana deslizante de llamadas.
+
+    - cerrado:     deja pasar todo; si en las últimas `ventana` llamadas (mínimo
+                   `min_llamadas`) la tasa de error llega a `umbral_error`, se abre.
+    - abierto:     rechaza de inmediato durante `enfriamiento` segundos.
+    - semiabierto: deja pasar una sola llamada de prueba; si va bien se cierra,
+                   si falla vuelve a abrirse.
+    """
+    CERRADO = "cerrado"
+    ABIERTO = "abierto"
+    SEMIABIERTO = "semiabierto"
+
+    def __init__(self, nombre: str, umbral_error: float = 0.5, min_llamadas: int = 10,
+                 ventana: int = 20, enfriamiento: float = 30.0, reloj=time.monotonic):
+        self.nombre = nombre
+        self.umbral_error = umbral_error
+        self.min_llamadas = max(1, min_llamadas)
+        self.enfriamiento = enfriamiento
+        self._reloj = reloj
+        self._resultados = deque(maxlen=max(ventana, self.min_llamadas))
+        self._estado = self.CERRADO
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        self.aperturas = 0
+        self._lock = threading.Lock()
+
+    @property
+    def estado(self) -> str:
+        with self._lock:
+            return self._estado
+
+    def permitir(self) -> bool:
+        with self._lock:
+            if self._estado == self.CERRADO:
+                return True
+            if self._estado == self.ABIERTO:
+                if self._reloj() - self._abierto_desde < self.enfriamiento:
+                    return False
+                self._cambiar(self.SEMIABIERTO)
+            if self._prueba_en_curso:
+                return False
+            self._prueba_en_curso = True
+            return True
+
+    def registrar_exito(self):
+        with self._lock:
+            if self._estado == self.SEMIABIERTO:
+                self._resultados.clear()
+                self._prueba_en_curso = False
+                self._cambiar(self.CERRADO)
+            self._resultados.append(True)
+
+    def registrar_fallo(self):
+        with self._lock:
+            if self._estado == self.SEMIABIERTO:
+                self._prueba_en_curso = False
+                self._abrir()
+                return
+            self._resultados.append(False)
+            if self._estado == self.CERRADO and len(self._resultados) >= self.min_llamadas:
+                errores = self._resultados.count(False)
+                if errores / len(self._resultados) >= self.umbral_error:
+                    self._abrir()
+
+    def _abrir(self):
+        self._abierto_desde = self._reloj()
+        self.aperturas += 1
+        self._cambiar(self.ABIERTO)
+
+    def _cambiar(self, estado: str):
+        if estado != self._estado:
+            logger.warning("Circuit breaker %s: %s -> %s", self.nombre, self._estado, estado)
+            self._estado = estado
@@ -0,0 +1,307 @@
+# src/api/standin.py
+"""
+Servidor local que sustituye a TOTVS (RYM0501, RYM0503 y token) reproduciendo
+respuestas grabadas, para pruebas de carga y de regresión sin tocar producción.
+
+Grabación: con settings.API_RECORD_DIR definido, APIClient guarda en ese directorio
+  - rym0501.json:  último PickList recibido (arreglo JSON)
+  - rym0503.jsonl: una línea {"body": ..., "response": [...]} por consulta PROUBI
+
+Reproducción (desde src/):
+  python -m api.standin --port 8081 --grabaciones ../recordings --latencia 0.05 --tasa-error 0.02
+
+y apuntar API_URL, API_URL_PROUBI y API_TOKEN_URL a
+  http://127.0.0.1:8081/rest/RYM0501, .../rest/RYM0503 y .../rest/api/oauth2/v1/token
+"""
+import argparse
+import bisect
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils.json_stream import EscritorArregloJSON
+
+_RAIZ = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PICKLIST_POR_DEFECTO = os.path.join(_RAIZ, "picklist_response.json")
+
+
+def _clean(x) -> str:
+    return str(x or "").strip()
+
+
+class Grabador:
+    """Guarda respuestas reales de APIClient en el formato que reproduce StandInServer."""
+
+    def __init__(self, directorio: str):
+        self.directorio = directorio
+        os.makedirs(directorio, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def picklist(self):
+        """Escritor incremental para el PickList (se usa mientras se consume el streaming)."""
+        return EscritorArregloJSON(os.path.join(self.directorio, "rym0501.json"))
+
+    def grabar(self, endpoint: str, body, respuesta):
+        if endpoint == "rym0501":
+            with self.picklist() as escritor:
+                for r in respuesta if isinstance(respuesta, list) else []:
+                    escritor.escribir(r)
+            return
+        linea = json.dumps({"body": body, "response": respuesta}, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            with open(os.path.join(self.directorio, "rym0503.jsonl"), "a", encoding="utf-8") as f:
+                f.write(linea + "\n")
+
+
+def escalar_picklist(registros: list[dict], escala: int):
+    """Repite el PickList `escala` veces; cada copia usa pedidos distintos (sufijo -k)."""
+    for k in range(max(1, escala)):
+        for r in registros:
+            if k == 0:
+                yield r
+            else:
+                rr = dict(r)
+                rr["pedido"] = f"{_clean(r.get('pedido'))}-{k}"
+                yield rr
+
+
+class CatalogoProubi:
+    """Filas PROUBI indexadas por producto para responder consultas exactas y por rango."""
+
+    def __init__(self, filas: list[dict]):
+        unicas = {}
+        for f in filas:
+            clave = (_clean(f.get("producto")), _clean(f.get("ubicacion")).upper(), _clean(f.get("deposito")))
+            unicas[clave] = f
+        self._claves = sorted(unicas)
+        self._filas = [unicas[c] for c in self._claves]
+        self._productos = [c[0] for c in self._claves]
+
+    def __len__(self):
+        return len(self._filas)
+
+    def consultar(self, body: dict) -> list[dict]:
+        de_p, a_p = _clean(body.get("de_producto")), _clean(body.get("a_producto"))
+        de_d, a_d = _clean(body.get("de_deposito")), _clean(body.get("a_deposito"))
+        de_u, a_u = _clean(body.get("de_ubicacion")).upper(), _clean(body.get("a_ubicacion")).upper()
+        inicio = bisect.bisect_left(self._productos, de_p)
+        fin = bisect.bisect_right(self._productos, a_p)
+        out = []
+        for (prod, ubi, depo), fila in zip(self._claves[inicio:fin], self._filas[inicio:fin]):
+            if de_d <= depo <= a_d and de_u <= ubi <= a_u:
+                out.append(fila)
+        return out
+
+
+def proubi_sintetico(registro: dict) -> dict:
+    """Fila PROUBI determinista para un registro del PickList (stock derivado del par)."""
+    prod, ubi = _clean(registro.get("producto")), _clean(registro.get("ubicacion"))
+    semilla = zlib.crc32(f"{prod}|{ubi}".encode())
+    return {
+        "producto": prod,
+        "descripcion": _clean(registro.get("descripcion")),
+        "deposito": _clean(registro.get("deposito")) or "01",
+        "ubicacion": ubi,
+        "anaquel": "",
+        "cantidadTotal": semilla % 500,
+        "stock_minimo": semilla % 7,
+    }
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, direccion=("127.0.0.1", 0), *, picklist: list[dict] | None = None,
+                 proubi: list[dict] | None = None, escala: int = 1, latencia: float = 0.0,
+                 jitter: float = 0.0, tasa_error: float = 0.0, retry_after: float | None = None,
+                 expires_in: int = 3600, semilla: int | None = None):
+        super().__init__(direccion, _Handler)
+        self.picklist = picklist or []
+        self.escala = escala
+        # Las filas grabadas prevalecen sobre las sintéticas del mismo par
+        filas = [proubi_sintetico(r) for r in self.picklist]
+        filas.extend(proubi or [])
+        self.catalogo = CatalogoProubi(filas)
+        self.latencia = latencia
+        self.jitter = jitter
+        self.tasa_error = tasa_error
+        self.retry_after = retry_after
+        self.expires_in = expires_in
+        self._rng = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.stats = {"token": 0, "rym0501": 0, "rym0503": 0, "errores": 0}
+
+    @classmethod
+    def desde_grabaciones(cls, directorio: str | None, **kwargs):
+        """Carga rym0501.json / rym0503.jsonl de `directorio` (o picklist_response.json si no hay)."""
+        ruta_picklist = os.path.join(directorio, "rym0501.json") if directorio else ""
+        if not os.path.exists(ruta_picklist):
+            ruta_picklist = PICKLIST_POR_DEFECTO
+        with open(ruta_picklist, encoding="utf-8") as f:
+            picklist = json.load(f)
+        proubi = []
+        ruta_proubi = os.path.join(directorio, "rym0503.jsonl") if directorio else ""
+        if os.path.exists(ruta_proubi):
+            with open(ruta_proubi, encoding="utf-8") as f:
+                for linea in f:
+                    if linea.strip():
+                        proubi.extend(json.loads(linea).get("response") or [])
+        return cls(picklist=picklist, proubi=proubi, **kwargs)
+
+    @property
+    def url_base(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/rest"
+
+    def iniciar_en_hilo(self) -> threading.Thread:
+        hilo = threading.Thread(target=self.serve_forever, name="standin", daemon=True)
+        hilo.start()
+        return hilo
+
+    def handle_error(self, request, client_address):
+        # Un cliente que cierra su pool a mitad de una conexión keep-alive no es un error del stand-in
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+    def contar(self, clave: str):
+        with self._lock:
+            self.stats[clave] += 1
+
+    def simular(self) -> bool:
+        """Aplica la latencia configurada; devuelve True si esta llamada debe fallar."""
+        with self._lock:
+            espera = self.latencia + (self._rng.uniform(0, self.jitter) if self.jitter else 0)
+            falla = self._rng.random() < self.tasa_error
+        if espera:
+            time.sleep(espera)
+        return falla
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: StandInServer
+
+    def log_message(self, *args):
+        pass
+
+    def _leer_body(self) -> dict:
+        largo = int(self.headers.get("Content-Length") or 0)
+        crudo = self.rfile.read(largo) if largo else b""
+        if not crudo:
+            return {}
+        try:
+            return json.loads(crudo)
+        except ValueError:
+            return {}
+
+    def _json(self, status: int, data, headers=None):
+        cuerpo = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _error(self):
+        self.server.contar("errores")
+        headers = {}
+        if self.server.retry_after is not None:
+            headers["Retry-After"] = str(self.server.retry_after)
+        self._json(503, {"error": "stand-in: error simulado"}, headers)
+
+    def do_POST(self):
+        largo = int(self.headers.get("Content-Length") or 0)
+        if largo:
+            self.rfile.read(largo)
+        if not self.path.rstrip("/").endswith("/token"):
+            return self._json(404, {"error": "ruta desconocida"})
+        self.server.contar("token")
+        if self.server.simular():
+            return self._error()
+        n = self.server.stats["token"]
+        self._json(200, {"access_token": f"standin-{n}", "refresh_token": f"standin-r{n}",
+                         "expires_in": self.server.expires_in})
+
+    def do_GET(self):
+        body = self._leer_body()
+        ruta = self.path.split("?", 1)[0].rstrip("/").upper()
+        if ruta.endswith("/__STATS"):
+            return self._json(200, self.server.stats)
+        if ruta.endswith("/RYM0501"):
+            self.server.contar("rym0501")
+            if self.server.simular():
+                return self._error()
+            return self._picklist(body)
+        if ruta.endswith("/RYM0503"):
+            self.server.contar("rym0503")
+            if self.server.simular():
+                return self._error()
+            return self._json(200, self.server.catalogo.consultar(body))
+        self._json(404, {"error": "ruta desconocida"})
+
+    def _picklist(self, body: dict):
+        """Envía el PickList escalado en bloques (chunked) para no armarlo completo en memoria."""
+        desde = _clean(body.get("referencia_serie"))[:8]
+        desde = desde if desde.isdigit() else ""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        bloque, primero = ["["], True
+        for r in escalar_picklist(self.server.picklist, self.server.escala):
+            if desde and _clean(r.get("fecha")) < desde:
+                continue
+            bloque.append(("" if primero else ",") + json.dumps(r, ensure_ascii=False))
+            primero = False
+            if len(bloque) >= 500:
+                self._chunk("".join(bloque))
+                bloque = []
+        bloque.append("]")
+        self._chunk("".join(bloque))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _chunk(self, texto: str):
+        datos = texto.encode("utf-8")
+        if datos:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(datos), datos))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stand-in local de TOTVS (RYM0501, RYM0503 y token).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--grabaciones", help="Directorio con rym0501.json / rym0503.jsonl grabados.")
+    parser.add_argument("--escala", type=int, default=1, help="Multiplica el PickList N veces.")
+    parser.add_argument("--latencia", type=float, default=0.0, help="Latencia fija por llamada (s).")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Latencia aleatoria adicional máxima (s).")
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="Fracción de llamadas que responden 503.")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After enviado con los 503.")
+    parser.add_argument("--expires-in", type=int, default=3600, help="Vigencia de los tokens emitidos (s).")
+    parser.add_argument("--semilla", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    server = StandInServer.desde_grabaciones(
+        args.grabaciones, direccion=(args.host, args.port), escala=args.escala, latencia=args.latencia,
+        jitter=args.jitter, tasa_error=args.tasa_error, retry_after=args.retry_after,
+        expires_in=args.expires_in, semilla=args.semilla,
+    )
+    print(f"Stand-in TOTVS escuchando en {server.url_base} "
+          f"({len(server.picklist)} registros x{args.escala}, {len(server.catalogo)} filas PROUBI)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,18 @@ from dotenv import load_dotenv
 # Cargar variables de entorno desde .env
 load_dotenv()
 
+def _env_bool(nombre: str, default: bool) -> bool:
+    valor = os.getenv(nombre)
+    if valor is None or not valor.strip():
+        return default
+    return valor.strip().lower() in ('1', 'true', 'yes', 'si', 'sí')
+
+def _env_lista(nombre: str, default: str) -> tuple[str, ...]:
+    valor = os.getenv(nombre)
+    if valor is None or not valor.strip():
+        valor = default
+    return tuple(dict.fromkeys(v.strip() for v in valor.split(',') if v.strip()))
+
 class Settings:
     # Configuración del API
     API_URL = os.getenv('API_URL')
@@ -15,6 +27,47 @@ class Settings:
     API_CONSUMER_KEY = os.getenv('API_CONSUMER_KEY')
     API_CONSUMER_SECRET = os.getenv('API_CONSUMER_SECRET')
     API_TOKEN_URL = os.getenv('API_TOKEN_URL')
+
+    # Sesión HTTP: timeouts (segundos) y tamaño del pool de conexiones por endpoint
+    API_RYM0501_TIMEOUT = float(os.getenv('API_RYM0501_TIMEOUT', 60))
+    API_PROUBI_TIMEOUT = float(os.getenv('API_PROUBI_TIMEOUT', 60))
+    API_TOKEN_TIMEOUT = float(os.getenv('API_TOKEN_TIMEOUT', 30))
+    API_RYM0501_POOL_SIZE = int(os.getenv('API_RYM0501_POOL_SIZE', 2))
+    API_PROUBI_POOL_SIZE = int(os.getenv('API_PROUBI_POOL_SIZE', os.getenv('PROUBI_MAX_WORKERS', 8)))
+    API_TOKEN_POOL_SIZE = int(os.getenv('API_TOKEN_POOL_SIZE', 1))
+
+    # Caché del token OAuth compartida entre corridas/procesos (vacío = solo en memoria)
+    TOKEN_CACHE_FILE = os.getenv('TOKEN_CACHE_FILE', '.token_cache.json')
+    # Segundos antes de expires_at en que se renueva el token en segundo plano (como mucho la mitad de su vida)
+    TOKEN_REFRESH_MARGIN = float(os.getenv('TOKEN_REFRESH_MARGIN', 300))
+    TOKEN_BACKGROUND_REFRESH = _env_bool('TOKEN_BACKGROUND_REFRESH', True)
+
+    # Reintentos de GET (backoff exponencial con jitter; Retry-After se respeta hasta API_RETRY_AFTER_MAX)
+    API_RETRY_MAX = int(os.getenv('API_RETRY_MAX', 3))
+    API_RETRY_BACKOFF_BASE = float(os.getenv('API_RETRY_BACKOFF_BASE', 0.5))
+    API_RETRY_BACKOFF_MAX = float(os.getenv('API_RETRY_BACKOFF_MAX', 30))
+    API_RETRY_AFTER_MAX = float(os.getenv('API_RETRY_AFTER_MAX', 120))
+
+    # Circuit breaker por endpoint
+    API_CB_UMBRAL_ERROR = float(os.getenv('API_CB_UMBRAL_ERROR', 0.5))
+    API_CB_MIN_LLAMADAS = int(os.getenv('API_CB_MIN_LLAMADAS', 10))
+    API_CB_VENTANA = int(os.getenv('API_CB_VENTANA', 20))
+    API_CB_ENFRIAMIENTO = float(os.getenv('API_CB_ENFRIAMIENTO', 30))
+
+    # RYM0501: parseo incremental de la respuesta y volcado opcional (vacío = sin volcado)
+    RYM0501_STREAMING = _env_bool('RYM0501_STREAMING', True)
+    PICKLIST_DUMP_FILE = os.getenv('PICKLIST_DUMP_FILE', '')
+
+    # Directorio donde APIClient graba el tráfico real para el stand-in local (vacío = no grabar)
+    API_RECORD_DIR = os.getenv('API_RECORD_DIR', '')
+
+    # Concurrencia de consultas PROUBI (RYM0503). 1 = secuencial.
+    PROUBI_MAX_WORKERS = int(os.getenv('PROUBI_MAX_WORKERS', 8))
+    # Máximo de pares (producto, ubicacion) por consulta de rango. 1 = una consulta exacta por par.
+    PROUBI_RANGO_MAX_PARES = int(os.getenv('PROUBI_RANGO_MAX_PARES', 1))
+    # Ancho máximo de un rango: sus productos/ubicaciones comparten estos primeros caracteres (0 = sin límite)
+    PROUBI_RANGO_PREFIJO_PRODUCTO = int(os.getenv('PROUBI_RANGO_PREFIJO_PRODUCTO', 3))
+    PROUBI_RANGO_PREFIJO_UBICACION = int(os.getenv('PROUBI_RANGO_PREFIJO_UBICACION', 1))
     
     # Configuración de la Base de Datos
     DB_USER = os.getenv('DB_USER')
@@ -22,7 +75,45 @@ class Settings:
     DB_HOST = os.getenv('DB_HOST')
     DB_PORT = int(os.getenv('DB_PORT', 3306))
     DB_DATABASE = os.getenv('DB_DATABASE')
+    # Pool de conexiones: tamaño, espera máxima por una conexión libre (s) e intentos de ping/reconexión
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 4))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_PING_INTENTOS = int(os.getenv('DB_PING_INTENTOS', 3))
+    # Filas por INSERT multi-fila y tope de bytes por sentencia (0 = usar @@max_allowed_packet)
+    DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', 500))
+    DB_MAX_PACKET_BYTES = int(os.getenv('DB_MAX_PACKET_BYTES', 0))
+    # Grupos (pedido) por transacción en insertar_datos, con checkpoint reanudable (0 = una sola transacción)
+    DB_CHUNK_GRUPOS = int(os.getenv('DB_CHUNK_GRUPOS', 500))
+    # Conexiones que escriben PickListDetalle en paralelo (modo filas); requiere DB_POOL_SIZE > DB_ESCRITORES
+    DB_ESCRITORES = int(os.getenv('DB_ESCRITORES', 1))
+    # Modo de escritura: 'filas' (INSERT multi-fila), 'bulk' (LOAD DATA LOCAL INFILE a staging)
+    # o 'json' (un documento JSON por tramo con JSON_TABLE, pocos round trips)
+    DB_MODO_CARGA = os.getenv('DB_MODO_CARGA', 'filas')
+    # ProductosUbicacion: upsert multi-fila con IDs determinísticos (False = una sentencia por fila)
+    PU_UPSERT_POR_LOTES = _env_bool('PU_UPSERT_POR_LOTES', True)
+    # ProductosUbicacion: solo escribir los pares nuevos o con Stock distinto al guardado
+    PU_SOLO_CAMBIOS = _env_bool('PU_SOLO_CAMBIOS', True)
+    # PickListDetalle: actualizar las líneas existentes que cambiaron en TOTVS (false = solo INSERT IGNORE)
+    DETALLE_RECONCILIAR = _env_bool('DETALLE_RECONCILIAR', True)
+    # PickListDetalleID por debajo de la marca que se vuelven a revisar al crear Productos faltantes
+    # (cubre IDs menores que se confirmaron después de mover la marca)
+    PRODUCTOS_VENTANA_DETALLE = int(os.getenv('PRODUCTOS_VENTANA_DETALLE', 5000))
     
+    # Depósitos que se sincronizan (separados por coma). Cada uno se escribe en su propio
+    # proceso concurrente a partir de una sola descarga de RYM0501.
+    DEPOSITOS = _env_lista('DEPOSITOS', '01')
+
+    # Sincronización incremental: True ignora el watermark guardado y pide todo el historial
+    SYNC_FULL_RESYNC = _env_bool('SYNC_FULL_RESYNC', False)
+    # Modo daemon (daemon.py): segundos entre ciclos y demora aleatoria máxima antes de cada uno
+    SYNC_INTERVALO_S = float(os.getenv('SYNC_INTERVALO_S', 300))
+    SYNC_JITTER_S = float(os.getenv('SYNC_JITTER_S', 15))
+    # Pipeline (--pipeline): descarga, PROUBI y escritura a la vez, por tramos de registros
+    SYNC_PIPELINE = _env_bool('SYNC_PIPELINE', False)
+    PIPELINE_TRAMO_REGISTROS = int(os.getenv('PIPELINE_TRAMO_REGISTROS', 5000))
+    # Tramos que pueden esperar en cada cola antes de frenar a la etapa anterior
+    PIPELINE_COLA = int(os.getenv('PIPELINE_COLA', 2))
+
     # Otros ajustes
     LOG_FILE = os.getenv('LOG_FILE', 'app.log')
 
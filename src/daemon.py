@@ -0,0 +1,137 @@
+# src/daemon.py
+"""
+Modo daemon: repite la sincronización de main.py cada SYNC_INTERVALO_S segundos (más
+un jitter aleatorio de hasta SYNC_JITTER_S) en un solo proceso, reutilizando entre
+ciclos la sesión HTTP, el token OAuth, el pool de MySQL y la caché de dimensiones.
+
+  python -m src.daemon --intervalo 300 --jitter 15
+
+- Los ciclos nunca se solapan: uno empieza cuando termina el anterior y, si se atrasó,
+  los turnos vencidos se saltean. Entre procesos, el bloqueo GET_LOCK de sincronizar()
+  evita correr a la vez que otra instancia (p.ej. un cron con main.py).
+- SIGTERM/SIGINT: se termina el tramo en curso (queda confirmado con su checkpoint) y
+  el proceso sale; la próxima ejecución retoma desde ahí.
+- Por cada ciclo se registra la duración y la deriva respecto de la hora programada.
+"""
+import os
+import random
+import signal
+import sys
+import threading
+import time
+
+# Los módulos de src/ se importan sin prefijo; así funciona tanto `python -m src.daemon`
+# como `python src/daemon.py`
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from main import construir_parser, aplicar_args, sincronizar
+from services.data_service import DataService, IngestaInterrumpida
+from db.cache import DimensionCache
+from db.connection import cerrar_pool
+from api.api_services import APIService
+from config.settings import settings
+from utils.logger import setup_logger, logger
+
+
+def parse_args(argv=None):
+    parser = construir_parser("Sincroniza PickList y ProductosUbicacion desde TOTVS de forma continua.")
+    parser.add_argument("--intervalo", type=float, default=settings.SYNC_INTERVALO_S,
+                        help="Segundos entre el inicio de un ciclo y el siguiente.")
+    parser.add_argument("--jitter", type=float, default=settings.SYNC_JITTER_S,
+                        help="Demora aleatoria extra (0..jitter segundos) antes de cada ciclo.")
+    parser.add_argument("--ciclos", type=int, default=0, help="Cantidad de ciclos a ejecutar (0 = sin límite).")
+    return parser.parse_args(argv)
+
+
+def ejecutar_ciclo(args, api_service: APIService, data_service: DataService) -> bool:
+    """
+    Un ciclo con una conexión del pool; los errores se registran y no detienen el daemon.
+    Al terminar registra el uso de la sesión HTTP del ciclo (la sesión sigue abierta).
+    """
+    try:
+        data_service.conectar_bd()
+        return sincronizar(args, api_service, data_service)
+    except IngestaInterrumpida as e:
+        logger.warning(f"Ciclo interrumpido: {e}")
+    except Exception as e:
+        logger.error(f"Error en el ciclo de sincronización: {e}")
+    finally:
+        data_service.cerrar_conexion()
+        try:
+            api_service.log_conexiones()
+        except Exception as e:
+            logger.warning(f"No se pudieron registrar las conexiones HTTP del ciclo: {e}")
+    return False
+
+
+def siguiente_turno(programado: float, ahora: float, intervalo: float) -> tuple[float, int]:
+    """Próximo inicio programado posterior a `ahora` y cuántos turnos vencidos se saltean."""
+    siguiente = programado + intervalo
+    saltados = 0
+    if siguiente < ahora:
+        saltados = int((ahora - siguiente) // intervalo) + 1
+        siguiente += saltados * intervalo
+    return siguiente, saltados
+
+
+def ejecutar_daemon(args, api_service: APIService, data_service: DataService, detener: threading.Event) -> int:
+    """Bucle de ciclos hasta `detener` (o args.ciclos). Devuelve los ciclos ejecutados."""
+    intervalo = max(1.0, args.intervalo)
+    ciclo = 0
+    programado = time.monotonic()
+    inicio_esperado = programado
+    while not detener.is_set():
+        ciclo += 1
+        inicio = time.monotonic()
+        deriva = inicio - inicio_esperado
+        ok = ejecutar_ciclo(args, api_service, data_service)
+        fin = time.monotonic()
+
+        programado, saltados = siguiente_turno(programado, fin, intervalo)
+        jitter = random.uniform(0, max(0.0, args.jitter))
+        inicio_esperado = programado + jitter
+        logger.info("Ciclo %s %s: %.3fs | deriva %.3fs | próximo en %.1fs%s",
+                    ciclo, "completo" if ok else "sin completar", fin - inicio, deriva,
+                    inicio_esperado - fin, f" | {saltados} turnos vencidos omitidos" if saltados else "")
+
+        if args.ciclos and ciclo >= args.ciclos:
+            break
+        detener.wait(max(0.0, inicio_esperado - time.monotonic()))
+    return ciclo
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logger()
+    aplicar_args(args)
+
+    detener = threading.Event()
+
+    def _senal(signum, _frame):
+        logger.info("Señal %s recibida: se termina el tramo en curso y se detiene el daemon.", signum)
+        detener.set()
+
+    signal.signal(signal.SIGTERM, _senal)
+    signal.signal(signal.SIGINT, _senal)
+    logger.info("Daemon iniciado: intervalo %ss, jitter hasta %ss.", args.intervalo, args.jitter)
+
+    # Recursos que se mantienen entre ciclos
+    api_service = APIService()
+    data_service = DataService(cache=DimensionCache())
+    data_service.detener = detener
+    try:
+        if args.normalizar_ubicaciones:
+            data_service.conectar_bd()
+            try:
+                data_service.normalizar_ubicaciones()
+            finally:
+                data_service.cerrar_conexion()
+        ciclos = ejecutar_daemon(args, api_service, data_service, detener)
+        logger.info("Daemon detenido tras %s ciclos.", ciclos)
+    finally:
+        api_service.cerrar()
+        cerrar_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# src/db/cache.py
+
+import threading
+
+from db.operations import (
+    TAMANO_LOTE_DEFECTO,
+    MAX_BYTES_DEFECTO,
+    asegurar_productos_batch,
+    asegurar_clientes_batch,
+    asegurar_tiendas_batch,
+)
+from utils.logger import logger
+
+
+class DimensionCache:
+    """
+    Claves existentes de Productos, Clientes y Tienda en memoria.
+
+    Se cargan con un SELECT por tabla la primera vez que se usan y, a partir de ahí,
+    solo se insertan las claves que falten (una sentencia por tabla y lote). Las claves
+    insertadas quedan pendientes hasta confirmar() (tras el commit); descartar() las
+    olvida si hubo rollback. Una misma instancia puede reutilizarse entre corridas.
+    """
+
+    def __init__(self):
+        self.productos: set[str] = set()
+        self.clientes: set[str] = set()
+        self.tiendas: set[tuple[str, str]] = set()
+        self._pendientes = {"productos": set(), "clientes": set(), "tiendas": set()}
+        self.cargado = False
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+
+    def cargar(self, cursor):
+        """Lee las claves existentes de las tres tablas."""
+        with self._lock:
+            cursor.execute("SELECT ProductoID FROM Productos")
+            self.productos = {(r[0] or "").strip() for r in cursor.fetchall()}
+            cursor.execute("SELECT ClienteID FROM Clientes")
+            self.clientes = {(r[0] or "").strip() for r in cursor.fetchall()}
+            cursor.execute("SELECT ClienteID, TiendaID FROM Tienda")
+            self.tiendas = {((r[0] or "").strip(), (r[1] or "").strip()) for r in cursor.fetchall()}
+            for pendientes in self._pendientes.values():
+                pendientes.clear()
+            self.cargado = True
+        logger.info("Caché de dimensiones cargada: %s productos | %s clientes | %s tiendas",
+                    len(self.productos), len(self.clientes), len(self.tiendas))
+
+    def invalidar(self):
+        """Fuerza a recargar las claves en el próximo uso."""
+        with self._lock:
+            self.cargado = False
+
+    def _faltantes(self, nombre: str, conocidas: set, claves) -> list:
+        pendientes = self._pendientes[nombre]
+        faltan = sorted(k for k in claves if k not in conocidas and k not in pendientes)
+        self.aciertos += len(claves) - len(faltan)
+        self.fallos += len(faltan)
+        pendientes.update(faltan)
+        return faltan
+
+    def asegurar(self, cursor, productos: dict, clientes, tiendas,
+                 tamano_lote: int = TAMANO_LOTE_DEFECTO, max_bytes: int = MAX_BYTES_DEFECTO) -> dict:
+        """
+        Inserta los Productos ({ProductoID: descripcion}), Clientes y Tienda ((ClienteID, TiendaID))
+        que no estén en la caché. Las claves vacías se ignoran y las nuevas se insertan ordenadas.
+        Devuelve las filas insertadas por tabla.
+        """
+        if not self.cargado:
+            self.cargar(cursor)
+
+        with self._lock:
+            prods = self._faltantes("productos", self.productos, {p for p in productos if p})
+            clis = self._faltantes("clientes", self.clientes, {c for c in clientes if c})
+            tnds = self._faltantes("tiendas", self.tiendas, {(c, t) for c, t in tiendas if c and t})
+
+        insertados = {
+            "productos": asegurar_productos_batch(cursor, [(p, productos[p]) for p in prods], tamano_lote, max_bytes),
+            "clientes": asegurar_clientes_batch(cursor, clis, tamano_lote, max_bytes),
+            "tiendas": asegurar_tiendas_batch(cursor, tnds, tamano_lote, max_bytes),
+        }
+        if prods or clis or tnds:
+            logger.info("Dimensiones nuevas: %s productos | %s clientes | %s tiendas",
+                        insertados["productos"], insertados["clientes"], insertados["tiendas"])
+        return insertados
+
+    def registrar_productos(self, productos):
+        """Agrega ProductoID ya confirmados en la BD por otra vía (p.ej. desde PickListDetalle)."""
+        with self._lock:
+            if self.cargado:
+                self.productos.update(productos)
+
+    def confirmar(self):
+        """Incorpora las claves pendientes (llamar después del commit)."""
+        with self._lock:
+            self.productos |= self._pendientes["productos"]
+            self.clientes |= self._pendientes["clientes"]
+            self.tiendas |= self._pendientes["tiendas"]
+            for pendientes in self._pendientes.values():
+                pendientes.clear()
+
+    def descartar(self):
+        """Olvida las claves pendientes (llamar después del rollback)."""
+        with self._lock:
+            for pendientes in self._pendientes.values():
+                pendientes.clear()
+
+    def log_estadisticas(self):
+        total = self.aciertos + self.fallos
+        logger.info("Caché de dimensiones: %s aciertos | %s fallos (%.1f%% aciertos)",
+                    self.aciertos, self.fallos, 100.0 * self.aciertos / total if total else 0.0)
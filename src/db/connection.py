@@ -1,34 +1,123 @@
+import threading
+import time
+from contextlib import contextmanager
+
 import mysql.connector
-from mysql.connector import errorcode
+from mysql.connector import errorcode, pooling
 from config.settings import settings
 from utils.logger import logger
 
+_pool = None
+_pool_lock = threading.Lock()
+
+# Máximo de conexiones que admite un pool de mysql-connector
+TAMANO_MAXIMO_POOL = pooling.CNX_POOL_MAXSIZE
+
+
+def _config_bd() -> dict:
+    return {
+        "user": settings.DB_USER,
+        "password": settings.DB_PASSWORD,
+        "host": settings.DB_HOST,
+        "port": settings.DB_PORT,
+        "database": settings.DB_DATABASE,
+        "raise_on_warnings": False,
+        # LOAD DATA LOCAL INFILE solo se habilita para el modo de carga bulk
+        "allow_local_infile": settings.DB_MODO_CARGA.strip().lower() == "bulk",
+    }
+
+
+def _log_error_conexion(err: mysql.connector.Error):
+    if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
+        logger.error("Error: Credenciales de acceso denegadas.")
+    elif err.errno == errorcode.ER_BAD_DB_ERROR:
+        logger.error("Error: La base de datos no existe.")
+    else:
+        logger.error(f"Error al conectar a la base de datos: {err}")
+
+
+def obtener_pool() -> pooling.MySQLConnectionPool:
+    """
+    Pool de conexiones del proceso (DB_POOL_SIZE conexiones), creado en el primer uso.
+    La configuración se toma de Settings en ese momento.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                tamano = max(1, min(settings.DB_POOL_SIZE, TAMANO_MAXIMO_POOL))
+                if settings.DB_POOL_SIZE > TAMANO_MAXIMO_POOL:
+                    logger.warning("DB_POOL_SIZE=%s supera el máximo de mysql-connector: el pool tendrá %s "
+                                   "conexiones y los hilos que pidan más esperarán DB_POOL_TIMEOUT.",
+                                   settings.DB_POOL_SIZE, tamano)
+                try:
+                    _pool = pooling.MySQLConnectionPool(
+                        pool_name="totvs_services",
+                        pool_size=tamano,
+                        pool_reset_session=True,
+                        **_config_bd(),
+                    )
+                except mysql.connector.Error as err:
+                    _log_error_conexion(err)
+                    raise
+                logger.info("Pool de conexiones MySQL creado (%s conexiones) hacia %s:%s/%s",
+                            tamano, settings.DB_HOST, settings.DB_PORT, settings.DB_DATABASE)
+    return _pool
+
+
+def cerrar_pool():
+    """Cierra las conexiones libres del pool; el próximo uso crea uno nuevo."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool._remove_connections()
+            _pool = None
+            logger.info("Pool de conexiones MySQL cerrado.")
+
+
 def get_db_connection():
-    try:
-        # Debug temporal
-        print("DEBUG DB CONNECTION")
-        print("DB_USER:", settings.DB_USER)
-        print("DB_PASSWORD:", repr(settings.DB_PASSWORD))
-        print("DB_HOST:", settings.DB_HOST)
-        print("DB_PORT:", settings.DB_PORT)
-        print("DB_DATABASE:", settings.DB_DATABASE)
-
-        cnx = mysql.connector.connect(
-            user=settings.DB_USER,
-            password=settings.DB_PASSWORD,
-            host=settings.DB_HOST,
-            port=settings.DB_PORT,
-            database=settings.DB_DATABASE,
-            raise_on_warnings=False
-        )
-        logger.info("Conexión a la base de datos establecida exitosamente.")
-        return cnx
+    """
+    Toma una conexión del pool (espera hasta DB_POOL_TIMEOUT segundos si están todas
+    en uso) y verifica que siga viva con ping(reconnect=True).
+    Al llamar close() la conexión vuelve al pool en lugar de cerrarse.
+    """
+    pool = obtener_pool()
+    limite = time.monotonic() + settings.DB_POOL_TIMEOUT
+    while True:
+        try:
+            cnx = pool.get_connection()
+            break
+        except pooling.PoolError:
+            if time.monotonic() >= limite:
+                logger.error("Pool de conexiones agotado tras %.1fs de espera.", settings.DB_POOL_TIMEOUT)
+                raise
+            time.sleep(0.05)
 
+    try:
+        cnx.ping(reconnect=True, attempts=settings.DB_PING_INTENTOS, delay=1)
     except mysql.connector.Error as err:
-        if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
-            logger.error("Error: Credenciales de acceso denegadas.")
-        elif err.errno == errorcode.ER_BAD_DB_ERROR:
-            logger.error("Error: La base de datos no existe.")
-        else:
-            logger.error(f"Error al conectar a la base de datos: {err}")
-        raise
\ No newline at end of file
+        cnx.close()
+        _log_error_conexion(err)
+        raise
+    return cnx
+
+
+@contextmanager
+def conexion():
+    """
+    Préstamo de una conexión del pool:
+
+        with conexion() as cnx:
+            ...
+
+    Si hay una excepción con una transacción abierta se hace rollback antes de devolverla.
+    """
+    cnx = get_db_connection()
+    try:
+        yield cnx
+    except Exception:
+        if cnx.in_transaction:
+            cnx.rollback()
+        raise
+    finally:
+        cnx.close()
@@ -1,6 +1,8 @@
 # src/db/operations.py
 
 from utils.logger import logger
+from decimal import Decimal, InvalidOperation
+import json
 import mysql.connector
 import uuid
 
@@ -24,36 +26,107 @@ def insertar_picklist(cursor, data):
     return cursor.lastrowid  # sirve tanto en insert como en duplicado
 
 
+# Tamaño por defecto de lote y de paquete para los INSERT multi-fila
+TAMANO_LOTE_DEFECTO = 500
+MAX_BYTES_DEFECTO = 4 * 1024 * 1024
 
-def insertar_picklist_detalle(cursor, picklist_id, data):
-    ubic = (data.get('ubicacion') or '').strip().upper()
-    prod = (data.get('producto') or '').strip()
-    item = data.get('item')
 
-    oc = (data.get('oc') or '').strip()
-    precio = data.get('precio')
+def obtener_max_allowed_packet(cursor, defecto: int = MAX_BYTES_DEFECTO) -> int:
+    """Devuelve @@max_allowed_packet del servidor (o `defecto` si no se puede leer)."""
+    try:
+        cursor.execute("SELECT @@max_allowed_packet")
+        fila = cursor.fetchone()
+        valor = int(fila[0]) if fila else 0
+    except (mysql.connector.Error, TypeError, ValueError):
+        return defecto
+    return valor if valor >= 1024 else defecto
 
-    sql = """
+
+# Caracteres que el conector escapa con una barra al interpolar un texto
+_ESCAPADOS = ("\\", "'", '"', "\0", "\n", "\r", "\x1a")
+
+
+def _tamano_valor(v) -> int:
+    # Bytes UTF-8 (max_allowed_packet cuenta bytes, no caracteres), comillas y escapes
+    if v is None:
+        return 4  # NULL
+    texto = str(v)
+    return len(texto.encode("utf-8")) + sum(texto.count(c) for c in _ESCAPADOS) + 2
+
+
+def _tamano_fila(args) -> int:
+    """Estimación (bytes) de una fila de VALUES ya escapada: valores, comillas, escapes y separadores."""
+    return sum(_tamano_valor(v) + 2 for v in args) + 4
+
+
+def lotes_por_tamano(filas, tamano_lote: int = TAMANO_LOTE_DEFECTO, max_bytes: int = MAX_BYTES_DEFECTO):
+    """
+    Parte `filas` (tuplas de argumentos) en lotes de como mucho `tamano_lote` filas
+    cuyo tamaño estimado no supere `max_bytes` (se deja margen para el SQL base).
+    """
+    limite = max(1024, int(max_bytes * 0.9))
+    lote, bytes_lote = [], 0
+    for args in filas:
+        tam = _tamano_fila(args)
+        if lote and (len(lote) >= tamano_lote or bytes_lote + tam > limite):
+            yield lote
+            lote, bytes_lote = [], 0
+        lote.append(args)
+        bytes_lote += tam
+    if lote:
+        yield lote
+
+
+def insertar_multifila(cursor, sql_prefijo: str, filas, *, sql_sufijo: str = "", fila_sql: str | None = None,
+                       tamano_lote: int = TAMANO_LOTE_DEFECTO, max_bytes: int = MAX_BYTES_DEFECTO) -> list[tuple[int, int]]:
+    """
+    Ejecuta `sql_prefijo` VALUES (...),(...) `sql_sufijo` por lotes.
+    `fila_sql` permite una plantilla de fila propia (p.ej. "(%s, %s, NOW())").
+    Devuelve [(filas_del_lote, rowcount), ...] para que el llamador interprete los conteos.
+    """
+    resultados = []
+    for lote in lotes_por_tamano(filas, tamano_lote, max_bytes):
+        fila = fila_sql or "(" + ", ".join(["%s"] * len(lote[0])) + ")"
+        sql = f"{sql_prefijo} VALUES {', '.join([fila] * len(lote))} {sql_sufijo}"
+        cursor.execute(sql, tuple(v for args in lote for v in args))
+        resultados.append((len(lote), cursor.rowcount))
+    return resultados
+
+
+_SQL_DETALLE = """
     INSERT IGNORE INTO PickListDetalle
         (PickListID, ProductoID, CantidadRequerida, UbicacionTotvs,
          Recolectado, CantidadSurtida, Item, TiendaTOTVS, OC, Precio)
-    VALUES
-        (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """
+"""
 
-    args = (
+
+def _args_detalle(picklist_id, data) -> tuple:
+    ubic = (data.get('ubicacion') or '').strip().upper()
+    prod = (data.get('producto') or '').strip()
+    oc = (data.get('oc') or '').strip()
+    return (
         picklist_id,
         prod,
         data.get('cantidad_liberada'),
         ubic,
         0,
         0,
-        item,
+        data.get('item'),
         data.get('tienda'),
         oc,
-        precio
+        data.get('precio')
     )
 
+
+def insertar_picklist_detalle(cursor, picklist_id, data):
+    args = _args_detalle(picklist_id, data)
+    item, prod = args[6], args[1]
+
+    sql = _SQL_DETALLE + """
+    VALUES
+        (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """
+
     cursor.execute(sql, args)
 
     if cursor.rowcount == 1:
@@ -62,6 +135,169 @@ def insertar_picklist_detalle(cursor, picklist_id, data):
         logger.info(f"⏭️ EXISTENTE - OMITIDO (PL={picklist_id}, Item={item}, Prod={prod})")
 
 
+def insertar_picklist_detalle_batch(cursor, detalles, tamano_lote: int = TAMANO_LOTE_DEFECTO,
+                                    max_bytes: int = MAX_BYTES_DEFECTO) -> tuple[int, int]:
+    """
+    Inserta (INSERT IGNORE multi-fila) una lista de (picklist_id, detalle) por lotes.
+    Devuelve (insertados, omitidos) a partir del rowcount de cada lote: con INSERT IGNORE
+    el rowcount son las filas nuevas y el resto ya existían (UNIQUE).
+    """
+    resultados = insertar_multifila(
+        cursor, _SQL_DETALLE, (_args_detalle(pid, det) for pid, det in detalles),
+        tamano_lote=tamano_lote, max_bytes=max_bytes,
+    )
+    insertados = sum(max(0, rc) for _, rc in resultados)
+    total = sum(n for n, _ in resultados)
+    logger.info("PickListDetalle por lotes: %s lotes | %s nuevos | %s existentes omitidos",
+                len(resultados), insertados, total - insertados)
+    return insertados, total - insertados
+
+
+# Líneas que cambiaron en TOTVS: se pisan cantidad, ubicación, precio y OC. UbicacionID se
+# limpia antes de pisar UbicacionTotvs (las asignaciones del ON DUPLICATE KEY van en orden)
+# para que el mapeo la vuelva a resolver con la ubicación nueva.
+_SQL_DETALLE_CAMBIOS = """
+    INSERT INTO PickListDetalle
+        (PickListID, ProductoID, CantidadRequerida, UbicacionTotvs,
+         Recolectado, CantidadSurtida, Item, TiendaTOTVS, OC, Precio)
+"""
+_SQL_DETALLE_CAMBIOS_SUFIJO = """
+    ON DUPLICATE KEY UPDATE
+        UbicacionID       = IF(UbicacionTotvs <=> VALUES(UbicacionTotvs), UbicacionID, NULL),
+        UbicacionTotvs    = VALUES(UbicacionTotvs),
+        CantidadRequerida = VALUES(CantidadRequerida),
+        Precio            = VALUES(Precio),
+        OC                = VALUES(OC)
+"""
+
+def _valor_numerico(valor):
+    # Por valor y no por texto: 2, 2.0 y Decimal('2.00') son iguales sea cual sea la escala de la columna
+    if valor is None or valor == '':
+        return None
+    try:
+        return Decimal(str(valor))
+    except InvalidOperation:
+        return str(valor)
+
+
+def contenido_detalle(cantidad, ubicacion, precio, oc) -> tuple:
+    """Cantidad, ubicación, precio y OC de una línea normalizados para comparar BD contra TOTVS."""
+    return (_valor_numerico(cantidad), ubicacion or '', _valor_numerico(precio), oc or '')
+
+
+def _clave_detalle(picklist_id, item, producto) -> tuple:
+    # (PickListID, Item, ProductoID) como los compara el UNIQUE de PickListDetalle
+    item = None if item is None else str(item).strip().upper()
+    return (int(picklist_id), item, (producto or '').strip().upper())
+
+
+def leer_contenido_detalle(cursor, picklist_ids, tamano_lote: int = 1000) -> dict:
+    """
+    Contenido de las líneas guardadas de `picklist_ids`:
+    {(PickListID, Item, ProductoID): contenido_detalle(...)}. Se leen las columnas tal
+    cual, un SELECT por cada `tamano_lote` PickList, y se comparan en Python.
+    """
+    ids = sorted(set(picklist_ids))
+    contenido = {}
+    for i in range(0, len(ids), tamano_lote):
+        lote = ids[i:i + tamano_lote]
+        cursor.execute(
+            "SELECT PickListID, Item, ProductoID, CantidadRequerida, UbicacionTotvs, Precio, OC "
+            "FROM PickListDetalle WHERE PickListID IN (" + ", ".join(["%s"] * len(lote)) + ")",
+            tuple(lote),
+        )
+        for pid, item, prod, cantidad, ubicacion, precio, oc in cursor.fetchall():
+            contenido[_clave_detalle(pid, item, prod)] = contenido_detalle(cantidad, ubicacion, precio, oc)
+    return contenido
+
+
+def reconciliar_picklist_detalle(cursor, detalles, tamano_lote: int = TAMANO_LOTE_DEFECTO,
+                                 max_bytes: int = MAX_BYTES_DEFECTO) -> dict:
+    """
+    Compara una lista de (picklist_id, detalle) con las líneas guardadas y escribe solo
+    lo necesario: las líneas nuevas con INSERT IGNORE multi-fila y las que cambiaron con
+    ON DUPLICATE KEY UPDATE multi-fila. Las idénticas no se envían.
+    Si una línea llega repetida cuenta la primera, como con INSERT IGNORE.
+    Devuelve {insertados, actualizados, omitidos}.
+    """
+    entrantes = {}
+    for pid, det in detalles:
+        args = _args_detalle(pid, det)
+        entrantes.setdefault(_clave_detalle(pid, args[6], args[1]), args)
+
+    guardadas = leer_contenido_detalle(cursor, {pid for pid, _ in detalles})
+    nuevos, cambiados = [], []
+    for clave, args in entrantes.items():
+        guardada = guardadas.get(clave)
+        if guardada is None:
+            nuevos.append(args)
+        elif guardada != contenido_detalle(args[2], args[3], args[9], args[8]):
+            cambiados.append(args)
+
+    insertados = sum(max(0, rc) for _, rc in insertar_multifila(
+        cursor, _SQL_DETALLE, nuevos, tamano_lote=tamano_lote, max_bytes=max_bytes))
+    insertar_multifila(cursor, _SQL_DETALLE_CAMBIOS, cambiados, sql_sufijo=_SQL_DETALLE_CAMBIOS_SUFIJO,
+                       tamano_lote=tamano_lote, max_bytes=max_bytes)
+    omitidos = len(detalles) - insertados - len(cambiados)
+    logger.info("PickListDetalle reconciliado: %s nuevos | %s cambiados | %s idénticos o repetidos omitidos",
+                insertados, len(cambiados), omitidos)
+    return {"insertados": insertados, "actualizados": len(cambiados), "omitidos": omitidos}
+
+
+def _clave_pedido(pedido) -> str:
+    # Pedido se compara como lo hace la colación de MySQL: sin espacios finales ni mayúsculas
+    return (pedido or "").strip().upper()
+
+
+def resolver_picklist_ids(cursor, headers: dict, tamano_lote: int = TAMANO_LOTE_DEFECTO,
+                          max_bytes: int = MAX_BYTES_DEFECTO) -> dict:
+    """
+    Inserta en un INSERT multi-fila los PickList de `headers` ({clave: header} con las llaves
+    de insertar_picklist) que no existan y resuelve todos los PickListID con un SELECT por Pedido.
+
+    Devuelve {clave: PickListID}. Como PickList es única por Pedido, si hay varios PickList
+    para un pedido se prefiere el de la misma tienda y cliente; si no, el primero.
+    """
+    if not headers:
+        return {}
+    ordenados = sorted(headers.items(), key=lambda kv: (_clave_pedido(kv[1]['pedido']), kv[1]['tienda'] or ''))
+    resultados = insertar_multifila(
+        cursor,
+        "INSERT INTO PickList (ClienteID, Pedido, Cliente, Tienda, TiendaTOTVS, PickListFecha)",
+        ((h['cliente'], h['pedido'], h['nombre'], h['tienda'], h['tienda']) for _, h in ordenados),
+        fila_sql="(%s, %s, %s, %s, %s, NOW())",
+        sql_sufijo="ON DUPLICATE KEY UPDATE PickListID = PickListID",
+        tamano_lote=tamano_lote, max_bytes=max_bytes,
+    )
+    nuevos = sum(max(0, rc) for _, rc in resultados)
+
+    pedidos = sorted({h['pedido'] for _, h in ordenados})
+    por_pedido: dict[str, list] = {}
+    for i in range(0, len(pedidos), tamano_lote):
+        lote = pedidos[i:i + tamano_lote]
+        cursor.execute(
+            "SELECT PickListID, Pedido, Tienda, ClienteID FROM PickList WHERE Pedido IN ("
+            + ", ".join(["%s"] * len(lote)) + ") ORDER BY PickListID",
+            tuple(lote),
+        )
+        for pid, pedido, tienda, cliente in cursor.fetchall():
+            por_pedido.setdefault(_clave_pedido(pedido), []).append(
+                (pid, (tienda or "").strip(), (cliente or "").strip()))
+
+    ids = {}
+    for clave, h in ordenados:
+        candidatos = por_pedido.get(_clave_pedido(h['pedido']))
+        if not candidatos:
+            raise RuntimeError(f"No se pudo resolver PickListID del pedido {h['pedido']}")
+        exacto = [pid for pid, tienda, cliente in candidatos
+                  if tienda == (h['tienda'] or "") and cliente == (h['cliente'] or "")]
+        ids[clave] = exacto[0] if exacto else candidatos[0][0]
+
+    logger.info("PickList por lotes: %s cabeceras | %s nuevas | %s PickListID resueltos",
+                len(headers), nuevos, len(set(ids.values())))
+    return ids
+
+
 def asegurar_producto_en_catalogo(cursor, producto_id: str, descripcion: str = ""):
     """
     Inserta el producto en la tabla Productos si no existe todavía.
@@ -85,27 +321,55 @@ def asegurar_producto_en_catalogo(cursor, producto_id: str, descripcion: str = "
         logger.warning("No se pudo asegurar producto %s en catálogo: %s", prod, err)
 
 
+# Espacio de nombres fijo para derivar ProductoUbicacionID de (ProductoID, UbicacionID)
+NAMESPACE_PRODUCTO_UBICACION = uuid.UUID("5b0f7d2e-3c1a-5e8b-9f64-2a7c1d0e4b93")
+
+
+def producto_ubicacion_id(producto_id, ubicacion_id) -> str:
+    """
+    ProductoUbicacionID determinístico (uuid5) del par (ProductoID, UbicacionID):
+    el mismo par produce siempre el mismo ID, sin consultar la BD.
+
+    Solo vale para filas nuevas: el ON DUPLICATE KEY UPDATE choca por
+    uk_producto_ubicacion y nunca reescribe ProductoUbicacionID, así que las filas
+    creadas antes conservan su ID original. Por eso nadie debe calcular este ID para
+    buscar una fila existente; el vínculo con PickListDetalle
+    (mapear_ubicacionid_en_picklistdetalle) lee ProductoUbicacionID de la tabla.
+    """
+    clave = f"{(producto_id or '').strip()}|{(ubicacion_id or '').strip().upper()}"
+    return str(uuid.uuid5(NAMESPACE_PRODUCTO_UBICACION, clave))
+
+
+_SQL_PRODUCTO_UBICACION = """
+    INSERT INTO ProductosUbicacion
+        (ProductoUbicacionID, ProductoID, UbicacionID, AnaquelID, Stock)
+"""
+
+
+def _args_producto_ubicacion(data: dict) -> tuple:
+    prod = (data.get("ProductoID") or "").strip()
+    ubic = (data.get("UbicacionID") or "").strip().upper()
+    return (
+        producto_ubicacion_id(prod, ubic),
+        prod,
+        ubic,
+        data.get("AnaquelID") or "",
+        data.get("Stock") or 0
+    )
+
+
 def insertar_producto_ubicacion(cursor, data: dict):
     """
     Inserta en ProductosUbicacion o actualiza el Stock si ya existe.
     """
     try:
-        sql = """
-        INSERT INTO ProductosUbicacion
-            (ProductoUbicacionID, ProductoID, UbicacionID, AnaquelID, Stock)
+        sql = _SQL_PRODUCTO_UBICACION + """
         VALUES
             (%s, %s, %s, %s, %s)
         ON DUPLICATE KEY UPDATE
             Stock = VALUES(Stock)
         """
-        args = (
-            str(uuid.uuid4()),
-            data.get("ProductoID"),
-            data.get("UbicacionID"),
-            data.get("AnaquelID") or "",
-            data.get("Stock") or 0
-        )
-        cursor.execute(sql, args)
+        cursor.execute(sql, _args_producto_ubicacion(data))
 
         if cursor.rowcount == 1:
             logger.info("INSERT ProductosUbicacion (ProductoID=%s, UbicacionID=%s) -> nuevo",
@@ -120,6 +384,106 @@ def insertar_producto_ubicacion(cursor, data: dict):
     except mysql.connector.Error as err:
         logger.exception("Error al insertar/actualizar en ProductosUbicacion")
         raise
+
+
+def filas_productos_ubicacion(registros) -> list[tuple]:
+    """Argumentos de ProductosUbicacion normalizados y sin pares repetidos (gana el último)."""
+    filas = {}
+    for r in registros:
+        args = _args_producto_ubicacion(r)
+        filas[(args[1], args[2])] = args
+    return list(filas.values())
+
+
+def sumar_conteo_upsert(resumen: dict, filas: int, existentes: int, rowcount: int):
+    """
+    Acumula en `resumen` los conteos de un INSERT ... ON DUPLICATE KEY UPDATE de `filas`
+    filas de las que `existentes` ya estaban: rowcount = 1 por nueva + 2 por actualizada.
+    """
+    nuevos = filas - existentes
+    actualizados = max(0, (max(0, rowcount) - nuevos) // 2)
+    resumen["insertados"] += nuevos
+    resumen["actualizados"] += actualizados
+    resumen["sin_cambios"] += existentes - actualizados
+
+
+def leer_stock_productos_ubicacion(cursor, productos, tamano_lote: int = 1000) -> dict:
+    """
+    Foto del Stock guardado en ProductosUbicacion para `productos`:
+    {(ProductoID, UbicacionID): Stock}. Un SELECT por cada `tamano_lote` productos.
+    """
+    productos = sorted({(p or "").strip() for p in productos if p and p.strip()})
+    foto = {}
+    for i in range(0, len(productos), tamano_lote):
+        lote = productos[i:i + tamano_lote]
+        cursor.execute(
+            "SELECT ProductoID, UbicacionID, Stock FROM ProductosUbicacion WHERE ProductoID IN ("
+            + ", ".join(["%s"] * len(lote)) + ")",
+            tuple(lote),
+        )
+        for prod, ubic, stock in cursor.fetchall():
+            foto[((prod or "").strip(), (ubic or "").strip().upper())] = stock
+    return foto
+
+
+def filtrar_productos_ubicacion_cambiados(registros, foto: dict) -> tuple[list[dict], int]:
+    """
+    Deja solo los registros (uno por par, gana el último) que el upsert cambiaría: pares
+    nuevos o con Stock distinto al de `foto`. Solo se compara Stock porque es la única
+    columna que actualiza el ON DUPLICATE KEY (AnaquelID y StockMinimo no se reescriben).
+    Devuelve (cambiados, sin_cambios).
+    """
+    ultimos = {}
+    for r in registros:
+        args = _args_producto_ubicacion(r)
+        ultimos[(args[1], args[2])] = (r, args[4])
+    cambiados = []
+    for clave, (r, stock) in ultimos.items():
+        if clave in foto and foto[clave] == stock:
+            continue
+        cambiados.append(r)
+    return cambiados, len(ultimos) - len(cambiados)
+
+
+def _contar_productos_ubicacion_existentes(cursor, lote) -> int:
+    """Cuántos pares (ProductoID, UbicacionID) del lote ya están en ProductosUbicacion."""
+    sql = ("SELECT COUNT(*) FROM ProductosUbicacion WHERE (ProductoID, UbicacionID) IN ("
+           + ", ".join(["(%s, %s)"] * len(lote)) + ")")
+    cursor.execute(sql, tuple(v for args in lote for v in (args[1], args[2])))
+    fila = cursor.fetchone()
+    return int(fila[0]) if fila else 0
+
+
+def upsert_productos_ubicacion_batch(cursor, registros, tamano_lote: int = TAMANO_LOTE_DEFECTO,
+                                     max_bytes: int = MAX_BYTES_DEFECTO) -> dict:
+    """
+    Inserta/actualiza ProductosUbicacion con INSERT ... ON DUPLICATE KEY UPDATE multi-fila.
+    El ProductoUbicacionID de las filas nuevas es determinístico (producto_ubicacion_id;
+    las existentes conservan el suyo) y los pares repetidos se deduplican (gana el último). Devuelve {insertados, actualizados, sin_cambios}.
+
+    Conteos: antes de cada lote se cuentan los pares que ya existen; con ODKU el rowcount
+    es 1 por fila nueva y 2 por fila cuyo Stock cambió (las que no cambian cuentan 0).
+    """
+    filas = filas_productos_ubicacion(registros)
+
+    resumen = {"insertados": 0, "actualizados": 0, "sin_cambios": 0}
+    lotes = 0
+    try:
+        for lote in lotes_por_tamano(filas, tamano_lote, max_bytes):
+            existentes = _contar_productos_ubicacion_existentes(cursor, lote)
+            sql = (_SQL_PRODUCTO_UBICACION + " VALUES "
+                   + ", ".join(["(%s, %s, %s, %s, %s)"] * len(lote))
+                   + " ON DUPLICATE KEY UPDATE Stock = VALUES(Stock)")
+            cursor.execute(sql, tuple(v for args in lote for v in args))
+            sumar_conteo_upsert(resumen, len(lote), existentes, cursor.rowcount)
+            lotes += 1
+    except mysql.connector.Error:
+        logger.exception("Error en el upsert por lotes de ProductosUbicacion")
+        raise
+
+    logger.info("ProductosUbicacion por lotes: %s lotes | %s nuevos | %s actualizados | %s sin cambios",
+                lotes, resumen["insertados"], resumen["actualizados"], resumen["sin_cambios"])
+    return resumen
     
 def actualizar_detalle_desde_picklist(cursor, picklist_ids=None):
     """
@@ -164,33 +528,48 @@ def actualizar_detalle_desde_picklist(cursor, picklist_ids=None):
         logger.error(f"Error al actualizar PickListDetalle desde PickList: {err}")
         raise
 
-def mapear_ubicacionid_en_picklistdetalle(cursor):
+def mapear_ubicacionid_en_picklistdetalle(cursor, picklist_ids=None, productos=None,
+                                          tamano_lote: int = 1000):
     """
     Actualiza en bloque PickListDetalle.UbicacionID buscando el match en ProductosUbicacion
-    por (ProductoID, UbicacionTotvs ~ UbicacionID). Solo actualiza filas donde UbicacionID
+    por (ProductoID, UbicacionTotvs = UbicacionID). Solo actualiza filas donde UbicacionID
     está NULL o vacío. Devuelve la cantidad de filas afectadas.
 
-    Emparejamiento case-insensitive y sin espacios al borde:
-      UPPER(TRIM(PickListDetalle.UbicacionTotvs)) = UPPER(TRIM(ProductosUbicacion.UbicacionID))
-
-    Requisitos recomendados de índice:
+    Ambas columnas se guardan normalizadas (TRIM + UPPER, ver _args_detalle y
+    _args_producto_ubicacion), así que el JOIN compara columnas directas y puede usar
+    los índices:
       - ProductosUbicacion: UNIQUE(ProductoID, UbicacionID)
       - PickListDetalle:   INDEX (ProductoID, UbicacionTotvs)
+
+    Con `picklist_ids` y/o `productos` solo se revisan los detalles de esos PickList
+    o productos (en lotes de `tamano_lote`); sin ninguno de los dos, toda la tabla.
     """
     sql = """
         UPDATE PickListDetalle d
         JOIN ProductosUbicacion pu
           ON pu.ProductoID = d.ProductoID
-         AND UPPER(TRIM(pu.UbicacionID)) = UPPER(TRIM(d.UbicacionTotvs))
+         AND pu.UbicacionID = d.UbicacionTotvs
         SET d.UbicacionID = pu.ProductoUbicacionID
         WHERE d.ProductoID IS NOT NULL
           AND d.UbicacionTotvs IS NOT NULL
-          AND TRIM(d.UbicacionTotvs) <> ''
+          AND d.UbicacionTotvs <> ''
           AND (d.UbicacionID IS NULL OR d.UbicacionID = '' OR d.UbicacionID = '0')
     """
+    alcances = []
+    if picklist_ids:
+        alcances.append(("d.PickListID", sorted(set(picklist_ids))))
+    if productos:
+        alcances.append(("d.ProductoID", sorted({p for p in productos if p})))
     try:
-        cursor.execute(sql)
-        filas = cursor.rowcount
+        filas = 0
+        if not alcances and picklist_ids is None and productos is None:
+            cursor.execute(sql)
+            filas = cursor.rowcount
+        for columna, valores in alcances:
+            for i in range(0, len(valores), tamano_lote):
+                lote = valores[i:i + tamano_lote]
+                cursor.execute(sql + f" AND {columna} IN ({', '.join(['%s'] * len(lote))})", tuple(lote))
+                filas += max(0, cursor.rowcount)
         logger.info("Vínculo UbicacionID -> PickListDetalle completado. Filas actualizadas: %s", filas)
         return filas
     except mysql.connector.Error:
@@ -198,6 +577,25 @@ def mapear_ubicacionid_en_picklistdetalle(cursor):
         raise
 
 
+def normalizar_ubicaciones(cursor) -> dict:
+    """
+    Normaliza (TRIM + UPPER) las ubicaciones guardadas antes de que se normalizaran al
+    escribir: ProductosUbicacion.UbicacionID y PickListDetalle.UbicacionTotvs.
+    UPDATE IGNORE deja como están las filas que chocarían con uk_producto_ubicacion.
+    Devuelve las filas actualizadas por tabla.
+    """
+    resultado = {}
+    for tabla, columna in (("ProductosUbicacion", "UbicacionID"), ("PickListDetalle", "UbicacionTotvs")):
+        cursor.execute(f"""
+            UPDATE IGNORE {tabla}
+            SET {columna} = UPPER(TRIM({columna}))
+            WHERE BINARY {columna} <> BINARY UPPER(TRIM({columna}))
+        """)
+        resultado[tabla] = max(0, cursor.rowcount)
+    logger.info("Ubicaciones normalizadas: %s", resultado)
+    return resultado
+
+
 def asegurar_cliente_tienda(cursor, cliente_id, tienda_id):
     """
     Garantiza que exista el Cliente y la Tienda asociados al registro de PickList.
@@ -238,4 +636,116 @@ def asegurar_cliente_tienda(cursor, cliente_id, tienda_id):
         logger.exception("Error al asegurar Cliente/Tienda (Cliente=%s, Tienda=%s)", cliente, tienda)
         raise
 
+def _insertar_faltantes(cursor, tabla: str, columnas: tuple, clave: tuple, filas,
+                       tamano_lote: int, max_bytes: int) -> int:
+    """
+    INSERT INTO tabla (columnas) SELECT ... FROM (SELECT ... UNION ALL ...) n
+    WHERE NOT EXISTS (misma clave en tabla), por lotes. Las columnas de `clave`
+    son las primeras de `columnas`. Devuelve las filas insertadas.
+    """
+    primera = "SELECT " + ", ".join(f"%s AS {c}" for c in columnas)
+    resto = "SELECT " + ", ".join(["%s"] * len(columnas))
+    condicion = " AND ".join(f"t.{c} = n.{c}" for c in clave)
+    insertadas = 0
+    for lote in lotes_por_tamano(filas, tamano_lote, max_bytes):
+        derivada = " UNION ALL ".join([primera] + [resto] * (len(lote) - 1))
+        sql = (f"INSERT INTO {tabla} ({', '.join(columnas)}) "
+               f"SELECT {', '.join('n.' + c for c in columnas)} FROM ({derivada}) n "
+               f"WHERE NOT EXISTS (SELECT 1 FROM {tabla} t WHERE {condicion})")
+        cursor.execute(sql, tuple(v for args in lote for v in args))
+        insertadas += max(0, cursor.rowcount)
+    return insertadas
+
+
+def asegurar_productos_batch(cursor, productos, tamano_lote: int = TAMANO_LOTE_DEFECTO,
+                             max_bytes: int = MAX_BYTES_DEFECTO) -> int:
+    """Inserta en Productos los (ProductoID, descripcion) que falten, en INSERT multi-fila."""
+    filas = [(p, (d or "").strip() or p) for p, d in productos]
+    if not filas:
+        return 0
+    resultados = insertar_multifila(
+        cursor, "INSERT INTO Productos (ProductoID, ProductoDescripcion)", filas,
+        sql_sufijo="ON DUPLICATE KEY UPDATE ProductoID = ProductoID",
+        tamano_lote=tamano_lote, max_bytes=max_bytes,
+    )
+    return sum(max(0, rc) for _, rc in resultados)
+
+
+def asegurar_clientes_batch(cursor, clientes, tamano_lote: int = TAMANO_LOTE_DEFECTO,
+                            max_bytes: int = MAX_BYTES_DEFECTO) -> int:
+    """Inserta los ClienteID que falten en Clientes (ClienteNombre = ClienteID), como asegurar_cliente_tienda."""
+    filas = [(c, c) for c in clientes]
+    if not filas:
+        return 0
+    return _insertar_faltantes(cursor, "Clientes", ("ClienteID", "ClienteNombre"), ("ClienteID",),
+                               filas, tamano_lote, max_bytes)
+
+
+def asegurar_tiendas_batch(cursor, tiendas, tamano_lote: int = TAMANO_LOTE_DEFECTO,
+                           max_bytes: int = MAX_BYTES_DEFECTO) -> int:
+    """Inserta los (ClienteID, TiendaID) que falten en Tienda (DestinoNombre = TiendaID)."""
+    filas = [(c, t, t) for c, t in tiendas]
+    if not filas:
+        return 0
+    return _insertar_faltantes(cursor, "Tienda", ("ClienteID", "TiendaID", "DestinoNombre"),
+                               ("ClienteID", "TiendaID"), filas, tamano_lote, max_bytes)
+
+
 # La función cargarPicklistDetalle fue eliminada por redundancia y log erróneo.
+
+
+def asegurar_tabla_sync_estado(cursor):
+    """
+    Crea (si no existe) la tabla SyncEstado, donde se guardan marcas de sincronización
+    (watermarks, checkpoints) como JSON por clave de proceso.
+    Es DDL: MySQL hace commit implícito, llamar fuera de una transacción.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS SyncEstado (
+            Proceso     VARCHAR(64)  NOT NULL PRIMARY KEY,
+            Valor       TEXT         NOT NULL,
+            Actualizado DATETIME     NOT NULL
+        )
+    """)
+
+
+def leer_estado_sync(cursor, proceso: str):
+    """Devuelve el valor (dict) guardado para `proceso` o None si no existe."""
+    cursor.execute("SELECT Valor FROM SyncEstado WHERE Proceso = %s", (proceso,))
+    fila = cursor.fetchone()
+    if not fila:
+        return None
+    try:
+        return json.loads(fila[0])
+    except (TypeError, ValueError):
+        logger.warning("Valor inválido en SyncEstado para %s: %r", proceso, fila[0])
+        return None
+
+
+def guardar_estado_sync(cursor, proceso: str, valor: dict):
+    """Inserta o reemplaza el valor de `proceso`. Se confirma con la transacción en curso."""
+    sql = """
+        INSERT INTO SyncEstado (Proceso, Valor, Actualizado)
+        VALUES (%s, %s, NOW())
+        ON DUPLICATE KEY UPDATE Valor = VALUES(Valor), Actualizado = VALUES(Actualizado)
+    """
+    cursor.execute(sql, (proceso, json.dumps(valor, ensure_ascii=False)))
+
+
+def borrar_estado_sync(cursor, proceso: str):
+    cursor.execute("DELETE FROM SyncEstado WHERE Proceso = %s", (proceso,))
+
+
+def adquirir_bloqueo(cursor, nombre: str, espera: int = 0) -> bool:
+    """
+    Toma el bloqueo con nombre GET_LOCK(`nombre`) para esta sesión, esperando hasta
+    `espera` segundos. Se libera con liberar_bloqueo o al cerrar/resetear la sesión.
+    """
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (nombre, espera))
+    fila = cursor.fetchone()
+    return bool(fila) and fila[0] == 1
+
+
+def liberar_bloqueo(cursor, nombre: str):
+    cursor.execute("SELECT RELEASE_LOCK(%s)", (nombre,))
+    cursor.fetchone()
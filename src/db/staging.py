@@ -0,0 +1,323 @@
+# src/db/staging.py
+"""
+Carga por tablas de staging: las filas ya validadas se vuelcan en tablas TEMPORARY
+de la sesión (LOAD DATA LOCAL INFILE o un documento JSON con JSON_TABLE) y se fusionan en las tablas reales con INSERT ... SELECT por conjuntos,
+manteniendo las reglas de idempotencia del modo por filas:
+
+  - Productos, Clientes, Tienda: solo se insertan las claves que no existen.
+  - PickList: ON DUPLICATE KEY UPDATE sin cambios (único por Pedido).
+  - PickListDetalle: INSERT IGNORE de las líneas nuevas; con reconciliar, UPDATE de las
+    existentes cuya cantidad, ubicación, precio u OC cambió.
+  - ProductosUbicacion: ON DUPLICATE KEY UPDATE Stock.
+"""
+import json
+import os
+import tempfile
+
+import mysql.connector
+
+from db.operations import MAX_BYTES_DEFECTO, lotes_por_tamano, sumar_conteo_upsert
+from utils.logger import logger
+
+STG_PICKLIST = "stg_picklist"
+STG_PICKLIST_IDS = "stg_picklist_ids"
+STG_PRODUCTOS_UBICACION = "stg_productos_ubicacion"
+
+# Columnas (nombre, tipo) de cada tabla de staging; se usan en CREATE TABLE y en JSON_TABLE
+_DEFINICIONES = {
+    STG_PICKLIST: (
+        ("Pedido", "VARCHAR(64)"),
+        ("Tienda", "VARCHAR(64)"),
+        ("ClienteID", "VARCHAR(64)"),
+        ("Cliente", "VARCHAR(255)"),
+        ("ProductoID", "VARCHAR(64)"),
+        ("Descripcion", "VARCHAR(255)"),
+        ("CantidadRequerida", "DECIMAL(14,4)"),
+        ("UbicacionTotvs", "VARCHAR(64)"),
+        ("Item", "VARCHAR(32)"),
+        ("OC", "VARCHAR(64)"),
+        ("Precio", "DECIMAL(14,4)"),
+    ),
+    STG_PRODUCTOS_UBICACION: (
+        ("ProductoUbicacionID", "VARCHAR(36)"),
+        ("ProductoID", "VARCHAR(64)"),
+        ("UbicacionID", "VARCHAR(64)"),
+        ("AnaquelID", "VARCHAR(64)"),
+        ("Stock", "INT"),
+    ),
+}
+COLUMNAS_STG_PICKLIST = tuple(c for c, _ in _DEFINICIONES[STG_PICKLIST])
+COLUMNAS_STG_PRODUCTOS_UBICACION = tuple(c for c, _ in _DEFINICIONES[STG_PRODUCTOS_UBICACION])
+
+
+def _crear_temporal(cursor, tabla: str, indice: str):
+    columnas = ",\n            ".join(f"{c:<20} {tipo}" for c, tipo in _DEFINICIONES[tabla])
+    cursor.execute(f"""
+        CREATE TEMPORARY TABLE {tabla} (
+            {columnas},
+            {indice}
+        )
+    """)
+
+
+def crear_staging_picklist(cursor):
+    """(Re)crea las tablas temporarias del PickList. No provoca commit implícito."""
+    cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {STG_PICKLIST}, {STG_PICKLIST_IDS}")
+    _crear_temporal(cursor, STG_PICKLIST, "KEY idx_grupo (Pedido, Tienda, ClienteID)")
+    cursor.execute(f"""
+        CREATE TEMPORARY TABLE {STG_PICKLIST_IDS} (
+            Pedido      VARCHAR(64),
+            Tienda      VARCHAR(64),
+            ClienteID   VARCHAR(64),
+            PickListID  INT,
+            KEY idx_grupo (Pedido, Tienda, ClienteID)
+        )
+    """)
+
+
+def crear_staging_productos_ubicacion(cursor):
+    cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {STG_PRODUCTOS_UBICACION}")
+    _crear_temporal(cursor, STG_PRODUCTOS_UBICACION, "KEY idx_par (ProductoID, UbicacionID)")
+
+
+def filas_staging_picklist(claves: list, grupos: dict):
+    """
+    Filas de stg_picklist para los grupos `claves` ({clave: registros validados}), con los
+    mismos valores que escribiría el modo por filas (nombre del primer registro del grupo,
+    primera descripción no vacía del producto, ubicación en mayúsculas).
+    """
+    descripciones = {}
+    for key in claves:
+        for r in grupos[key]:
+            if r.get('producto') and not descripciones.get(r['producto']):
+                descripciones[r['producto']] = (r.get('descripcion') or '').strip()
+    for key in claves:
+        pedido, tienda, cliente, _ = key
+        registros = grupos[key]
+        nombre = registros[0].get('nombre', '')
+        for r in registros:
+            prod = (r.get('producto') or '').strip()
+            yield (
+                pedido, tienda, cliente, nombre,
+                prod,
+                descripciones.get(prod) or prod,
+                r.get('cantidad_liberada'),
+                (r.get('ubicacion') or '').strip().upper(),
+                r.get('item'),
+                (r.get('oc') or '').strip(),
+                r.get('precio'),
+            )
+
+
+def _tsv(valor) -> str:
+    if valor is None:
+        return "\\N"
+    texto = str(valor)
+    return (texto.replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def escribir_tsv(ruta: str, filas) -> int:
+    """Escribe `filas` en el formato por defecto de LOAD DATA (tab, \\n, escape \\). Devuelve las filas."""
+    n = 0
+    with open(ruta, "w", encoding="utf-8", newline="\n") as f:
+        for fila in filas:
+            f.write("\t".join(_tsv(v) for v in fila))
+            f.write("\n")
+            n += 1
+    return n
+
+
+def cargar_tsv(cursor, tabla: str, columnas: tuple, filas) -> int:
+    """
+    Vuelca `filas` a un TSV temporal y lo carga con LOAD DATA LOCAL INFILE en `tabla`.
+    Requiere allow_local_infile en la conexión (DB_MODO_CARGA=bulk) y local_infile=ON en el servidor.
+    """
+    fd, ruta = tempfile.mkstemp(prefix=f"{tabla}_", suffix=".tsv")
+    os.close(fd)
+    try:
+        n = escribir_tsv(ruta, filas)
+        if not n:
+            return 0
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE {tabla} CHARACTER SET utf8mb4 ({', '.join(columnas)})",
+            (ruta,),
+        )
+        logger.info("LOAD DATA %s: %s filas", tabla, n)
+        return n
+    finally:
+        os.remove(ruta)
+
+
+def cargar_json(cursor, tabla: str, filas, max_bytes: int = MAX_BYTES_DEFECTO) -> int:
+    """
+    Envía `filas` como un documento JSON (arreglo de arreglos) por sentencia y las
+    inserta en `tabla` con JSON_TABLE (MySQL 8.0.4+). Si el documento excede
+    `max_bytes` se parte en varios, así que normalmente es un round trip por tramo.
+    """
+    definicion = _DEFINICIONES[tabla]
+    columnas = ", ".join(f"{c} {tipo} PATH '$[{i}]'" for i, (c, tipo) in enumerate(definicion))
+    sql = (f"INSERT INTO {tabla} ({', '.join(c for c, _ in definicion)}) "
+           f"SELECT j.* FROM JSON_TABLE(%s, '$[*]' COLUMNS ({columnas})) j")
+    n = 0
+    for lote in lotes_por_tamano(filas, tamano_lote=10 ** 9, max_bytes=max_bytes):
+        documento = json.dumps(lote, ensure_ascii=False, separators=(",", ":"), default=str)
+        cursor.execute(sql, (documento,))
+        n += len(lote)
+    if n:
+        logger.info("JSON_TABLE %s: %s filas", tabla, n)
+    return n
+
+
+# Resuelve el PickListID de cada grupo (pedido, tienda, cliente) del staging: el PickList
+# con la misma tienda y cliente si existe; si no, el del pedido (PickList es única por Pedido).
+SQL_RESOLVER_PICKLIST_IDS = f"""
+    INSERT INTO {STG_PICKLIST_IDS} (Pedido, Tienda, ClienteID, PickListID)
+    SELECT g.Pedido, g.Tienda, g.ClienteID,
+           COALESCE(
+               (SELECT MIN(p.PickListID) FROM PickList p
+                 WHERE p.Pedido = g.Pedido AND p.Tienda = g.Tienda AND p.ClienteID = g.ClienteID),
+               (SELECT MIN(p.PickListID) FROM PickList p WHERE p.Pedido = g.Pedido)
+           )
+    FROM (SELECT DISTINCT Pedido, Tienda, ClienteID FROM {STG_PICKLIST}) g
+"""
+
+_SQL_FUSION_PICKLIST = (
+    ("productos", f"""
+        INSERT INTO Productos (ProductoID, ProductoDescripcion)
+        SELECT n.ProductoID, n.Descripcion
+        FROM (SELECT ProductoID, MAX(Descripcion) AS Descripcion
+              FROM {STG_PICKLIST} WHERE ProductoID <> '' GROUP BY ProductoID) n
+        WHERE NOT EXISTS (SELECT 1 FROM Productos p WHERE p.ProductoID = n.ProductoID)
+        ORDER BY n.ProductoID
+    """),
+    ("clientes", f"""
+        INSERT INTO Clientes (ClienteID, ClienteNombre)
+        SELECT n.ClienteID, n.ClienteID
+        FROM (SELECT DISTINCT ClienteID FROM {STG_PICKLIST} WHERE ClienteID <> '') n
+        WHERE NOT EXISTS (SELECT 1 FROM Clientes c WHERE c.ClienteID = n.ClienteID)
+        ORDER BY n.ClienteID
+    """),
+    ("tiendas", f"""
+        INSERT INTO Tienda (ClienteID, TiendaID, DestinoNombre)
+        SELECT n.ClienteID, n.Tienda, n.Tienda
+        FROM (SELECT DISTINCT ClienteID, Tienda FROM {STG_PICKLIST}
+              WHERE ClienteID <> '' AND Tienda <> '') n
+        WHERE NOT EXISTS (SELECT 1 FROM Tienda t WHERE t.ClienteID = n.ClienteID AND t.TiendaID = n.Tienda)
+        ORDER BY n.ClienteID, n.Tienda
+    """),
+    ("picklist", f"""
+        INSERT INTO PickList (ClienteID, Pedido, Cliente, Tienda, TiendaTOTVS, PickListFecha)
+        SELECT n.ClienteID, n.Pedido, n.Cliente, n.Tienda, n.Tienda, NOW()
+        FROM (SELECT Pedido, Tienda, ClienteID, MAX(Cliente) AS Cliente
+              FROM {STG_PICKLIST} GROUP BY Pedido, Tienda, ClienteID) n
+        ORDER BY n.Pedido, n.Tienda, n.ClienteID
+        ON DUPLICATE KEY UPDATE PickListID = PickList.PickListID
+    """),
+    ("ids", SQL_RESOLVER_PICKLIST_IDS),
+    ("detalles", f"""
+        INSERT IGNORE INTO PickListDetalle
+            (PickListID, ProductoID, CantidadRequerida, UbicacionTotvs,
+             Recolectado, CantidadSurtida, Item, TiendaTOTVS, OC, Precio)
+        SELECT i.PickListID, t.ProductoID, t.CantidadRequerida, t.UbicacionTotvs,
+               0, 0, t.Item, t.Tienda, t.OC, t.Precio
+        FROM {STG_PICKLIST} t
+        JOIN {STG_PICKLIST_IDS} i
+          ON i.Pedido <=> t.Pedido AND i.Tienda <=> t.Tienda AND i.ClienteID <=> t.ClienteID
+        ORDER BY i.PickListID, t.Item
+    """),
+)
+
+# Líneas existentes que cambiaron. En un UPDATE multi-tabla el orden de las asignaciones
+# no está garantizado, así que UbicacionID se limpia en un paso previo cuando cambia la ubicación.
+_JOIN_DETALLE_EXISTENTE = f"""
+        PickListDetalle d
+        JOIN {STG_PICKLIST_IDS} i ON d.PickListID = i.PickListID
+        JOIN {STG_PICKLIST} t
+          ON i.Pedido <=> t.Pedido AND i.Tienda <=> t.Tienda AND i.ClienteID <=> t.ClienteID
+         AND d.Item <=> t.Item AND d.ProductoID = t.ProductoID
+"""
+_SQL_RECONCILIAR_DETALLE = (
+    ("reubicados", f"""
+        UPDATE {_JOIN_DETALLE_EXISTENTE}
+        SET d.UbicacionID = NULL
+        WHERE NOT (d.UbicacionTotvs <=> t.UbicacionTotvs) AND d.UbicacionID IS NOT NULL
+    """),
+    ("cambiados", f"""
+        UPDATE {_JOIN_DETALLE_EXISTENTE}
+        SET d.CantidadRequerida = t.CantidadRequerida,
+            d.UbicacionTotvs    = t.UbicacionTotvs,
+            d.Precio            = t.Precio,
+            d.OC                = t.OC
+        WHERE NOT (d.CantidadRequerida <=> t.CantidadRequerida
+                   AND d.UbicacionTotvs <=> t.UbicacionTotvs
+                   AND d.Precio <=> t.Precio
+                   AND d.OC <=> t.OC)
+    """),
+)
+
+
+def fusionar_picklist_staging(cursor, reconciliar: bool = False) -> dict:
+    """
+    Aplica las fusiones de stg_picklist sobre Productos, Clientes, Tienda, PickList y
+    PickListDetalle. Con `reconciliar`, antes de insertar las líneas nuevas actualiza las
+    existentes que cambiaron. Devuelve las filas afectadas por paso, los PickListID del
+    staging y {detalles, insertados, actualizados, omitidos} de PickListDetalle.
+    """
+    pasos = list(_SQL_FUSION_PICKLIST)
+    if reconciliar:
+        pasos[-1:-1] = _SQL_RECONCILIAR_DETALLE
+    filas = {"reubicados": 0, "cambiados": 0}
+    try:
+        for paso, sql in pasos:
+            cursor.execute(sql)
+            filas[paso] = max(0, cursor.rowcount)
+        cursor.execute(f"SELECT COUNT(*) FROM {STG_PICKLIST}")
+        detalles = int(cursor.fetchone()[0])
+        cursor.execute(f"SELECT DISTINCT PickListID FROM {STG_PICKLIST_IDS} WHERE PickListID IS NOT NULL")
+        picklist_ids = [r[0] for r in cursor.fetchall()]
+    except mysql.connector.Error:
+        logger.exception("Error fusionando el staging del PickList")
+        raise
+
+    logger.info("Staging PickList: %s productos | %s clientes | %s tiendas | %s cabeceras nuevas | "
+                "%s detalles nuevos y %s cambiados de %s",
+                filas["productos"], filas["clientes"], filas["tiendas"], filas["picklist"],
+                filas["detalles"], filas["cambiados"], detalles)
+    return {
+        "filas": filas,
+        "picklist_ids": picklist_ids,
+        "detalles": detalles,
+        "insertados": filas["detalles"],
+        "actualizados": filas["cambiados"],
+        "omitidos": max(0, detalles - filas["detalles"] - filas["cambiados"]),
+    }
+
+
+def fusionar_productos_ubicacion_staging(cursor) -> dict:
+    """ON DUPLICATE KEY UPDATE Stock desde stg_productos_ubicacion. Devuelve {insertados, actualizados, sin_cambios}."""
+    try:
+        cursor.execute(f"SELECT COUNT(*) FROM {STG_PRODUCTOS_UBICACION}")
+        total = int(cursor.fetchone()[0])
+        cursor.execute(f"""
+            SELECT COUNT(*) FROM {STG_PRODUCTOS_UBICACION} s
+            JOIN ProductosUbicacion pu ON pu.ProductoID = s.ProductoID AND pu.UbicacionID = s.UbicacionID
+        """)
+        existentes = int(cursor.fetchone()[0])
+        cursor.execute(f"""
+            INSERT INTO ProductosUbicacion
+                (ProductoUbicacionID, ProductoID, UbicacionID, AnaquelID, Stock)
+            SELECT ProductoUbicacionID, ProductoID, UbicacionID, AnaquelID, Stock
+            FROM {STG_PRODUCTOS_UBICACION}
+            ORDER BY ProductoID, UbicacionID
+            ON DUPLICATE KEY UPDATE Stock = VALUES(Stock)
+        """)
+    except mysql.connector.Error:
+        logger.exception("Error fusionando el staging de ProductosUbicacion")
+        raise
+
+    resumen = {"insertados": 0, "actualizados": 0, "sin_cambios": 0}
+    sumar_conteo_upsert(resumen, total, existentes, cursor.rowcount)
+    logger.info("Staging ProductosUbicacion: %s nuevos | %s actualizados | %s sin cambios",
+                resumen["insertados"], resumen["actualizados"], resumen["sin_cambios"])
+    return resumen
@@ -1,38 +1,130 @@
-from services.data_service import DataService
-from api.api_services import APIService
+import argparse
+from services.data_service import DataService, IngestaInterrumpida
+from services.pipeline import ejecutar_pipeline
+from services.depositos import sincronizar_depositos
+from db.connection import TAMANO_MAXIMO_POOL, cerrar_pool
+from api.api_services import APIService, watermark_desde_registros
+from config.settings import settings
 from utils.logger import setup_logger, logger
 
-def main():
-    setup_logger()
-    logger.info("Iniciando ejecución del programa...")
+def construir_parser(descripcion: str = "Sincroniza PickList y ProductosUbicacion desde TOTVS.") -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=descripcion)
+    parser.add_argument("--full-resync", action="store_true", default=settings.SYNC_FULL_RESYNC,
+                        help="Ignora el watermark guardado y vuelve a pedir todo el historial de RYM0501.")
+    parser.add_argument("--modo-carga", choices=("filas", "bulk", "json"), default=settings.DB_MODO_CARGA,
+                        help="Escritura en BD: INSERT multi-fila (filas), LOAD DATA a staging (bulk) o JSON_TABLE (json).")
+    parser.add_argument("--depositos", default=",".join(settings.DEPOSITOS),
+                        help="Depósitos a sincronizar, separados por coma (p.ej. 01,02); uno en paralelo por depósito.")
+    parser.add_argument("--escritores", type=int, default=settings.DB_ESCRITORES,
+                        help="Conexiones que escriben los detalles en paralelo (modo filas; útil en backfills).")
+    parser.add_argument("--pipeline", action="store_true", default=settings.SYNC_PIPELINE,
+                        help="Descarga, consulta PROUBI y escribe en BD a la vez, por tramos (colas acotadas).")
+    parser.add_argument("--normalizar-ubicaciones", action="store_true",
+                        help="Normaliza (TRIM + UPPER) las ubicaciones ya guardadas antes de sincronizar.")
+    return parser
 
-    api_service = APIService()
-    picklist = api_service.obtener_picklist()
-    if not picklist:
-        return
+def parse_args(argv=None):
+    return construir_parser().parse_args(argv)
 
-    # 2) Con picklist arma y consulta PROUBI para ProductosUbicacion
-    productos_ubi = api_service.obtener_productos_ubicacion_batch(picklist)
+def aplicar_args(args):
+    """Vuelca las opciones en Settings; debe llamarse antes de crear el pool de conexiones."""
+    # El modo bulk necesita allow_local_infile en las conexiones
+    settings.DB_MODO_CARGA = args.modo_carga
+    settings.DEPOSITOS = tuple(dict.fromkeys(d.strip() for d in args.depositos.split(",") if d.strip())) \
+        or settings.DEPOSITOS
+    # Cada depósito toma su conexión más una por escritor en paralelo, además de la principal.
+    # El pool no pasa de TAMANO_MAXIMO_POOL: si no alcanza se reducen los escritores.
+    depositos = len(settings.DEPOSITOS)
+    if depositos * 2 + 1 > TAMANO_MAXIMO_POOL:
+        raise ValueError(f"{depositos} depósitos necesitan al menos {depositos * 2 + 1} conexiones y el pool "
+                         f"admite {TAMANO_MAXIMO_POOL}: sincronice menos depósitos por proceso.")
+    settings.DB_ESCRITORES = max(1, args.escritores)
+    maximo_escritores = (TAMANO_MAXIMO_POOL - 1) // depositos - 1
+    if settings.DB_ESCRITORES > maximo_escritores:
+        logger.warning("%s depósitos x %s escritores no caben en el pool (máx. %s conexiones): se usan %s escritores.",
+                       depositos, settings.DB_ESCRITORES, TAMANO_MAXIMO_POOL, maximo_escritores)
+        settings.DB_ESCRITORES = maximo_escritores
+    conexiones = depositos * (settings.DB_ESCRITORES + 1) + 1
+    settings.DB_POOL_SIZE = max(settings.DB_POOL_SIZE, conexiones)
 
-    data_service = DataService()
+def sincronizar(args, api_service: APIService, data_service: DataService) -> bool:
+    """
+    Una sincronización completa con `data_service` ya conectado. Toma el bloqueo de
+    sincronización de MySQL para no solaparse con otra instancia; devuelve False si
+    otra la tiene tomada y no se hizo nada.
+    """
+    if not data_service.adquirir_bloqueo_sync():
+        logger.warning("Otra sincronización está en curso: se omite esta ejecución.")
+        return False
     try:
-        data_service.conectar_bd()
+        # 1) Watermark de la última sincronización (salvo re-sincronización completa)
+        watermark = None if args.full_resync else data_service.leer_watermark()
+        if args.full_resync:
+            logger.info("Re-sincronización completa solicitada: se ignora el watermark.")
+
+        if args.pipeline:
+            # 2-5) Tramos escritos mientras siguen llegando los demás; el watermark avanza al final
+            ejecutar_pipeline(api_service, data_service, watermark, detener=data_service.detener)
+            data_service.asegurar_productos_desde_picklist()
+            return True
+
+        picklist = api_service.obtener_picklist(watermark)
+        if not picklist:
+            return True
+
+        if len(settings.DEPOSITOS) > 1:
+            # 2-5) Un proceso concurrente por depósito sobre la misma descarga; el watermark
+            # avanza solo si terminaron todos
+            sincronizar_depositos(api_service, data_service, picklist, detener=data_service.detener)
+            siguiente = watermark_desde_registros(picklist, watermark)
+            if siguiente:
+                data_service.guardar_watermark(siguiente)
+            data_service.asegurar_productos_desde_picklist()
+            return True
+
+        # 2) Con picklist arma y consulta PROUBI para ProductosUbicacion
+        productos_ubi = api_service.obtener_productos_ubicacion_batch(picklist)
 
         # data_service.limpiar_tablas()  # Comentado para no borrar datos previos
 
-        # 3) Inserta PickList y PickListDetalle
-        data_service.insertar_datos(picklist)
+        # 3) Inserta PickList y PickListDetalle (y avanza el watermark en el mismo commit)
+        data_service.insertar_datos(picklist, watermark=watermark_desde_registros(picklist, watermark),
+                                    mapear=False)
 
         # 4) Inserta/actualiza ProductosUbicacion
         if productos_ubi:
-            data_service.insertar_productos_ubicacion(productos_ubi)
-        
+            data_service.insertar_productos_ubicacion(productos_ubi, mapear=False)
+
+        # 5) Vincula UbicacionID una sola vez, solo para lo escrito en esta corrida
+        data_service.mapear_ubicaciones()
+
         data_service.asegurar_productos_desde_picklist()
+        return True
+    finally:
+        data_service.liberar_bloqueo_sync()
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logger()
+    aplicar_args(args)
+    logger.info("Iniciando ejecución del programa...")
+
+    data_service = DataService()
+    api_service = APIService()
+    try:
+        data_service.conectar_bd()
+        if args.normalizar_ubicaciones:
+            data_service.normalizar_ubicaciones()
+        sincronizar(args, api_service, data_service)
 
+    except IngestaInterrumpida as e:
+        logger.warning(f"Sincronización interrumpida: {e}")
     except Exception as e:
         logger.error(f"Error al procesar datos: {e}")
     finally:
+        api_service.cerrar()
         data_service.cerrar_conexion()
+        cerrar_pool()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
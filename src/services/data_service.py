@@ -1,24 +1,173 @@
+import hashlib
+import json
+import zlib
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from db.connection import get_db_connection
+from db.cache import DimensionCache
+from db.staging import (
+    STG_PICKLIST,
+    STG_PRODUCTOS_UBICACION,
+    COLUMNAS_STG_PICKLIST,
+    COLUMNAS_STG_PRODUCTOS_UBICACION,
+    crear_staging_picklist,
+    crear_staging_productos_ubicacion,
+    filas_staging_picklist,
+    cargar_tsv,
+    cargar_json,
+    fusionar_picklist_staging,
+    fusionar_productos_ubicacion_staging,
+)
 from db.operations import (
-    insertar_picklist,
-    insertar_picklist_detalle,
+    resolver_picklist_ids,
+    insertar_picklist_detalle_batch,
+    reconciliar_picklist_detalle,
+    obtener_max_allowed_packet,
     insertar_producto_ubicacion,
+    upsert_productos_ubicacion_batch,
+    filas_productos_ubicacion,
+    leer_stock_productos_ubicacion,
+    filtrar_productos_ubicacion_cambiados,
     mapear_ubicacionid_en_picklistdetalle,
-    asegurar_cliente_tienda,
-    asegurar_producto_en_catalogo,
+    actualizar_detalle_desde_picklist,
+    normalizar_ubicaciones,
+    asegurar_productos_batch,
+    asegurar_tabla_sync_estado,
+    leer_estado_sync,
+    guardar_estado_sync,
+    borrar_estado_sync,
+    adquirir_bloqueo,
+    liberar_bloqueo,
 )
+from config.settings import settings
 from utils.logger import logger
 from utils.helpers import validate_data
 
+# Clave en SyncEstado del último serie/folio de RYM0501 procesado
+CLAVE_WATERMARK_PICKLIST = "rym0501_watermark"
+# Clave en SyncEstado del último PickListDetalleID revisado por asegurar_productos_desde_picklist
+CLAVE_HWM_PRODUCTOS_DETALLE = "productos_desde_detalle_hwm"
+
+# Modos de escritura: "filas" (sentencias multi-fila parametrizadas), "bulk" (LOAD DATA a staging)
+# o "json" (un documento JSON por tramo a staging vía JSON_TABLE)
+MODOS_CARGA = ("filas", "bulk", "json")
+
+# Clave en SyncEstado del avance de una ingesta por tramos (último grupo confirmado + huella);
+# con depósitos explícitos se usa una clave por depósito (ver clave_checkpoint)
+CLAVE_CHECKPOINT_PICKLIST = "picklist_checkpoint"
+
+# Bloqueo (GET_LOCK) que evita dos sincronizaciones a la vez contra la misma base
+BLOQUEO_SYNC = "totvs_services_sync"
+
+
+def clave_checkpoint(depositos) -> str:
+    """Clave del checkpoint de una ingesta limitada a `depositos` (p. ej. picklist_checkpoint:01)."""
+    return f"{CLAVE_CHECKPOINT_PICKLIST}:{','.join(depositos)}"
+
+
+class IngestaInterrumpida(Exception):
+    """Se pidió detener la ingesta; lo escrito hasta el último tramo quedó confirmado."""
+
+
+def _orden_clave(key: tuple) -> tuple:
+    """Orden determinístico de las claves de grupo (los None van como '')."""
+    return tuple(v or '' for v in key)
+
+
+def _huella_grupos(claves: list, grupos: dict, h=None):
+    """
+    sha256 de los grupos `claves` (clave y líneas), en orden; con `h` continúa una huella
+    previa. Sirve para comprobar que los grupos ya confirmados no cambiaron al reanudar.
+    """
+    h = hashlib.sha256() if h is None else h
+    for key in claves:
+        h.update(json.dumps([key, grupos[key]], sort_keys=True, default=str).encode("utf-8"))
+    return h
+
+
+def _s(x):
+    return x.strip() if isinstance(x, str) else x
+
+
+def _sanitizar_registro(r: dict) -> dict:
+    rr = dict(r)
+    rr['pedido']   = _s(rr.get('pedido', ''))
+    rr['tienda']   = _s(rr.get('tienda', ''))
+    rr['cliente']  = _s(rr.get('cliente', ''))
+    rr['deposito'] = _s(rr.get('deposito', ''))
+    rr['producto'] = _s(rr.get('producto', ''))
+    rr['ubicacion']= _s(rr.get('ubicacion', ''))
+    rr['nombre']   = _s(rr.get('nombre', ''))
+    rr['oc'] = _s(rr.get('oc', ''))
+    rr['anaquel'] = _s(rr.get('anaquel', ''))
+
+    cant = rr.get('cantidad_liberada')
+    try:
+        rr['cantidad_liberada'] = float(cant) if cant is not None else 0.0
+    except:
+        rr['cantidad_liberada'] = 0.0
+
+    precio = rr.get('precio')
+    try:
+        rr['precio'] = float(precio) if precio is not None else None
+    except:
+        rr['precio'] = None
+
+    it = rr.get('item')
+    if it is not None:
+        it_s = _s(str(it))
+        rr['item'] = int(it_s) if it_s and it_s.isdigit() else it_s
+    return rr
+
+
+def agrupar_registros(validos: list[dict]) -> dict:
+    """Agrupa por (pedido, tienda, cliente, deposito) conservando el orden de llegada."""
+    grupos = {}
+    for r in validos:
+        key = (r['pedido'], r['tienda'], r['cliente'], r['deposito'])
+        grupos.setdefault(key, []).append(r)
+    return grupos
+
+
 class DataService:
     """Clase para manejar la inserción de datos en la base de datos."""
 
-    def __init__(self):
+    def __init__(self, cache: DimensionCache | None = None, modo_carga: str | None = None,
+                 escritores: int | None = None, depositos=None):
         self.cnx = None
         self.cursor = None
+        self.modo_carga = (modo_carga or settings.DB_MODO_CARGA).strip().lower()
+        if self.modo_carga not in MODOS_CARGA:
+            raise ValueError(f"Modo de carga desconocido: {self.modo_carga!r} (válidos: {', '.join(MODOS_CARGA)})")
+        # Claves de Productos/Clientes/Tienda; se comparte entre corridas si se pasa la misma instancia
+        self.cache = cache or DimensionCache()
+        self.tamano_lote = settings.DB_BATCH_SIZE
+        # Conexiones que escriben los detalles en paralelo en insertar_datos (1 = secuencial)
+        self.escritores = escritores or settings.DB_ESCRITORES
+        # Depósitos que se pueden escribir; el resto se bloquea en validar_registros
+        self.depositos = tuple(depositos or settings.DEPOSITOS)
+        # Los procesos por depósito corren a la vez: cada uno guarda su propio checkpoint
+        self.clave_checkpoint = (CLAVE_CHECKPOINT_PICKLIST if depositos is None
+                                 else clave_checkpoint(self.depositos))
+        self._max_bytes = None
+        # PickList y productos escritos en esta corrida y todavía sin mapear UbicacionID
+        self._alcance_mapeo = {"picklist_ids": set(), "productos": set()}
+        # Evento de apagado (modo daemon): insertar_datos se detiene al confirmar el tramo en curso
+        self.detener = None
+        # PickListID ya resueltos por otra conexión ({clave de grupo: PickListID}); ver asegurar_cabeceras
+        self.cabeceras: dict = {}
+        self._bloqueo_tomado = False
+
+    def max_bytes_lote(self) -> int:
+        """Tamaño máximo de un INSERT multi-fila: DB_MAX_PACKET_BYTES acotado por @@max_allowed_packet."""
+        if self._max_bytes is None:
+            servidor = obtener_max_allowed_packet(self.cursor)
+            configurado = settings.DB_MAX_PACKET_BYTES
+            self._max_bytes = min(servidor, configurado) if configurado > 0 else servidor
+        return self._max_bytes
 
     def conectar_bd(self):
-        """Conecta a la base de datos y crea el cursor."""
+        """Toma una conexión del pool (db.connection) y crea el cursor."""
         try:
             self.cnx = get_db_connection()
             self.cursor = self.cnx.cursor()
@@ -27,6 +176,33 @@ class DataService:
             logger.error(f"No se pudo establecer conexión con la base de datos: {e}")
             raise e
 
+    def leer_watermark(self) -> dict | None:
+        """Devuelve el último serie/folio de RYM0501 confirmado, o None si no hay ninguno."""
+        asegurar_tabla_sync_estado(self.cursor)
+        wm = leer_estado_sync(self.cursor, CLAVE_WATERMARK_PICKLIST)
+        if self.cnx.in_transaction:
+            self.cnx.commit()
+        logger.info("Watermark PickList actual: %s", wm)
+        return wm
+
+    def adquirir_bloqueo_sync(self) -> bool:
+        """Toma el bloqueo de sincronización en esta conexión; False si otra instancia lo tiene."""
+        self._bloqueo_tomado = adquirir_bloqueo(self.cursor, BLOQUEO_SYNC)
+        return self._bloqueo_tomado
+
+    def liberar_bloqueo_sync(self):
+        if self._bloqueo_tomado and self.cursor:
+            liberar_bloqueo(self.cursor, BLOQUEO_SYNC)
+        self._bloqueo_tomado = False
+
+    def guardar_watermark(self, watermark: dict):
+        """Confirma `watermark` como el último serie/folio procesado de RYM0501."""
+        if not self.cnx.in_transaction:
+            self.cnx.start_transaction()
+        guardar_estado_sync(self.cursor, CLAVE_WATERMARK_PICKLIST, watermark)
+        self.cnx.commit()
+        logger.info("Watermark PickList avanzado a %s", watermark)
+
     def limpiar_tablas(self):
         """Borra los datos de las tablas antes de la inserción."""
         try:
@@ -37,167 +213,430 @@ class DataService:
         except Exception as e:
             logger.error(f"Error al eliminar datos: {e}")
 
-    def insertar_datos(self, datos: list[dict]):
+    def insertar_datos(self, datos: list[dict], watermark: dict | None = None, mapear: bool = True):
         """
         Inserta PickList (1 por grupo pedido+tienda+cliente+deposito) y todos sus detalles.
-        Idempotente: si ya existe el PickList o un detalle, no se actualiza nada,
-        solo se insertan los nuevos.
-        """
-        def _s(x):
-            return x.strip() if isinstance(x, str) else x
-
-        def _sanitize(r: dict) -> dict:
-            rr = dict(r)
-            rr['pedido']   = _s(rr.get('pedido', ''))
-            rr['tienda']   = _s(rr.get('tienda', ''))
-            rr['cliente']  = _s(rr.get('cliente', ''))
-            rr['deposito'] = _s(rr.get('deposito', ''))
-            rr['producto'] = _s(rr.get('producto', ''))
-            rr['ubicacion']= _s(rr.get('ubicacion', ''))
-            rr['nombre']   = _s(rr.get('nombre', ''))
-            rr['oc'] = _s(rr.get('oc', ''))
-            rr['anaquel'] = _s(rr.get('anaquel', ''))
-
-            cant = rr.get('cantidad_liberada')
-            try:
-                rr['cantidad_liberada'] = float(cant) if cant is not None else 0.0
-            except:
-                rr['cantidad_liberada'] = 0.0
-
-            precio = rr.get('precio')
-            try:
-                rr['precio'] = float(precio) if precio is not None else None
-            except:
-                rr['precio'] = None
-
-            it = rr.get('item')
-            if it is not None:
-                it_s = _s(str(it))
-                rr['item'] = int(it_s) if it_s and it_s.isdigit() else it_s
-            return rr
-
+        Idempotente: si ya existe el PickList no se toca. Con DETALLE_RECONCILIAR los detalles
+        existentes cuya cantidad, ubicación, precio u OC cambiaron se actualizan y los idénticos
+        no se envían; si no, solo se insertan los nuevos.
+        Con modo_carga="bulk" cada tramo se carga con LOAD DATA LOCAL INFILE a tablas
+        temporarias y con "json" como un solo documento vía JSON_TABLE; en ambos casos
+        se fusiona por conjuntos (ver db/staging.py).
+        Se confirma cada DB_CHUNK_GRUPOS grupos (en orden determinístico) guardando un
+        checkpoint en SyncEstado con la última clave confirmada; si una corrida se corta,
+        la siguiente salta los grupos hasta esa clave (aunque traiga grupos nuevos o
+        cambiados después de ella) siempre que los ya confirmados no hayan cambiado.
+        Si se pasa `watermark`, se guarda en la misma transacción que el último tramo.
+        Los detalles se escriben con INSERT multi-fila en lotes de DB_BATCH_SIZE.
+        Productos, Clientes y Tienda faltantes se insertan antes, vía la caché de dimensiones.
+        Con mapear=False el vínculo UbicacionID queda pendiente para mapear_ubicaciones().
+        Con más de un escritor (DB_ESCRITORES, modo "filas") los detalles se escriben en
+        paralelo por varias conexiones; ver _insertar_paralelo.
+        Devuelve un resumen {grupos, detalles, insertados, actualizados, omitidos}.
+        """
         try:
-            if not self.cnx.in_transaction:
-                self.cnx.start_transaction()
-                logger.info("Transacción iniciada (PickList + Detalle por grupos).")
-
             # 1) Validar y normalizar
-            validos = []
-            for i, registro in enumerate(datos, 1):
-                if not validate_data(registro):
-                    logger.warning("Registro inválido omitido (índice %s): %s", i, registro)
-                    continue
-                
-                sanitized = _sanitize(registro)
-                
-                # SEGURIDAD EXTRA: Solo permitir depósito 01
-                if sanitized.get('deposito') != '01':
-                    logger.warning("BLOQUEADO: Se intentó cargar depósito '%s' para pedido %s. Solo se permite '01'", 
-                                   sanitized.get('deposito'), sanitized.get('pedido'))
-                    continue
-
-                validos.append(sanitized)
+            validos = self.validar_registros(datos)
 
             if not validos:
-                logger.info("No hay registros válidos para el depósito 01 para procesar.")
-                return
+                logger.info("No hay registros válidos para los depósitos %s para procesar.", ", ".join(self.depositos))
+                if watermark:
+                    self.guardar_watermark(watermark)
+                return {"grupos": 0, "detalles": 0, "insertados": 0, "actualizados": 0, "omitidos": 0}
 
             # 2) Agrupar por (pedido, tienda, cliente, deposito)
-            grupos = {}
-            for r in validos:
-                key = (r['pedido'], r['tienda'], r['cliente'], r['deposito'])
-                grupos.setdefault(key, []).append(r)
-
+            grupos = agrupar_registros(validos)
             logger.info("Total grupos (pedido, tienda, cliente, deposito): %s", len(grupos))
 
-            afectados_ids = set()
-            total_detalles_intentados = 0
-
-            # 3) Insertar/recuperar PickList por grupo y luego TODOS sus detalles
-            for (pedido, tienda, cliente, deposito), registros in grupos.items():
-                logger.info("Procesando grupo: pedido=%s, tienda=%s, cliente=%s, deposito=%s | items: %s",
-                            pedido, tienda, cliente, deposito, len(registros))
-                asegurar_cliente_tienda(self.cursor, cliente, tienda)
-                header = {
-                    'cliente':  cliente,
-                    'deposito': deposito,
-                    'pedido':   pedido,
-                    'nombre':   registros[0].get('nombre', ''),
-                    'tienda':   tienda,
-                }
-
-                # insertar_picklist devuelve SOLO el ID
-                pid = insertar_picklist(self.cursor, header)
-                afectados_ids.add(pid)
-
-                for det in registros:
-                    # Asegurar producto en catálogo ANTES del detalle
-                    asegurar_producto_en_catalogo(
-                        self.cursor,
-                        det.get('producto'),
-                        det.get('descripcion')
-                    )
-                    
-                    insertar_picklist_detalle(self.cursor, pid, det)
-                    total_detalles_intentados += 1
-
-            # 4) Sincronizar campos y mapear Ubicación
-            if afectados_ids:
-                from db.operations import actualizar_detalle_desde_picklist, mapear_ubicacionid_en_picklistdetalle
-                actualizar_detalle_desde_picklist(self.cursor, list(afectados_ids))
-                mapear_ubicacionid_en_picklistdetalle(self.cursor)
-            
-            self.cnx.commit()
+            # 3) Escribir por tramos de DB_CHUNK_GRUPOS grupos, en orden determinístico
+            claves = sorted(grupos, key=_orden_clave)
+            escritores = self._escritores_efectivos()
+            if escritores > 1:
+                return self._insertar_paralelo(claves, grupos, escritores, watermark, mapear)
+            tramo = settings.DB_CHUNK_GRUPOS if settings.DB_CHUNK_GRUPOS > 0 else len(claves)
+            inicio, huella = 0, None
+            if len(claves) > tramo:
+                inicio, huella = self._leer_checkpoint(claves, grupos)
+                if inicio:
+                    logger.info("Reanudando desde el checkpoint: %s de %s grupos ya confirmados",
+                                inicio, len(claves))
+
+            resumen = {"grupos": len(grupos), "detalles": 0, "insertados": 0, "actualizados": 0, "omitidos": 0}
+            if inicio >= len(claves):
+                # Todos los tramos se confirmaron antes: solo falta cerrar la corrida
+                self._cerrar_ingesta(watermark, huella_previa=True)
+                self.cnx.commit()
+                return resumen
+
+            for desde in range(inicio, len(claves), tramo):
+                hasta = min(desde + tramo, len(claves))
+                ultimo = hasta == len(claves)
+                if not self.cnx.in_transaction:
+                    self.cnx.start_transaction()
+
+                escribir = self._escribir_grupos if self.modo_carga == "filas" else self._escribir_grupos_staging
+                afectados_ids, n, insertados, actualizados, omitidos = escribir(claves[desde:hasta], grupos, mapear)
+
+                if ultimo:
+                    self._cerrar_ingesta(watermark, huella_previa=len(claves) > tramo)
+                else:
+                    _huella_grupos(claves[desde:hasta], grupos, huella)
+                    guardar_estado_sync(self.cursor, self.clave_checkpoint, {
+                        **self._ambito_checkpoint(),
+                        "ultima": list(_orden_clave(claves[hasta - 1])),
+                        "huella": huella.hexdigest(),
+                    })
+
+                self.cnx.commit()
+                self.cache.confirmar()
+                if not mapear:
+                    self._alcance_mapeo["picklist_ids"].update(afectados_ids)
+                resumen["detalles"] += n
+                resumen["insertados"] += insertados
+                resumen["actualizados"] += actualizados
+                resumen["omitidos"] += omitidos
+                if not ultimo:
+                    logger.info("Tramo confirmado: %s/%s grupos", hasta, len(claves))
+                    if self.detener is not None and self.detener.is_set():
+                        raise IngestaInterrumpida(
+                            f"detenida tras confirmar {hasta}/{len(claves)} grupos; se retoma desde el checkpoint"
+                        )
+
             logger.info(
-                "Grupos procesados: %s | Detalles procesados (insertados/omitidos por UNIQUE): %s",
-                len(grupos), total_detalles_intentados
+                "Grupos procesados: %s | Detalles: %s nuevos, %s actualizados, %s omitidos",
+                len(claves) - inicio, resumen["insertados"], resumen["actualizados"], resumen["omitidos"]
             )
+            self.cache.log_estadisticas()
+            return resumen
 
+        except IngestaInterrumpida:
+            raise
         except Exception as e:
             self.cnx.rollback()
+            self.cache.descartar()
             logger.error(f"Error durante la inserción maestro-detalle por grupos: {e}")
             raise
 
+    def asegurar_dimensiones(self, datos: list[dict]) -> int:
+        """
+        Inserta y confirma solo los Productos, Clientes y Tienda de `datos`, en orden de
+        clave. Se usa antes de repartir la escritura entre procesos concurrentes para que
+        no compitan por las mismas filas de catálogo. Devuelve los grupos válidos.
+        """
+        try:
+            grupos = agrupar_registros(self.validar_registros(datos))
+            if not grupos:
+                return 0
+            if not self.cnx.in_transaction:
+                self.cnx.start_transaction()
+            self._asegurar_dimensiones(sorted(grupos, key=_orden_clave), grupos)
+            self.cnx.commit()
+            self.cache.confirmar()
+            return len(grupos)
+        except Exception as e:
+            self.cnx.rollback()
+            self.cache.descartar()
+            logger.error(f"Error al asegurar Productos, Clientes y Tienda: {e}")
+            raise
+
+    def asegurar_cabeceras(self, datos: list[dict]) -> dict:
+        """
+        Inserta y confirma las cabeceras PickList de `datos`, en orden de clave, y devuelve
+        {clave de grupo: PickListID}. Como asegurar_dimensiones, se usa antes de repartir la
+        escritura entre procesos concurrentes: PickList es única por Pedido y un pedido puede
+        tener líneas en varios depósitos.
+        """
+        try:
+            grupos = agrupar_registros(self.validar_registros(datos))
+            if not grupos:
+                return {}
+            if not self.cnx.in_transaction:
+                self.cnx.start_transaction()
+            ids = self._resolver_cabeceras(sorted(grupos, key=_orden_clave), grupos)
+            self.cnx.commit()
+            return ids
+        except Exception as e:
+            self.cnx.rollback()
+            logger.error(f"Error al asegurar las cabeceras PickList: {e}")
+            raise
+
+    def validar_registros(self, datos: list[dict]) -> list[dict]:
+        """Valida y normaliza los registros de RYM0501; descarta los inválidos y los de otros depósitos."""
+        validos = []
+        for i, registro in enumerate(datos, 1):
+            if not validate_data(registro):
+                logger.warning("Registro inválido omitido (índice %s): %s", i, registro)
+                continue
+
+            sanitized = _sanitizar_registro(registro)
+
+            # SEGURIDAD EXTRA: Solo permitir los depósitos de este servicio
+            if sanitized.get('deposito') not in self.depositos:
+                logger.warning("BLOQUEADO: Se intentó cargar depósito '%s' para pedido %s. Solo se permite %s",
+                               sanitized.get('deposito'), sanitized.get('pedido'), ", ".join(self.depositos))
+                continue
+
+            validos.append(sanitized)
+        return validos
+
+    def _ambito_checkpoint(self) -> dict:
+        # Un checkpoint de otro modo de carga o de otros depósitos no aplica
+        return {"modo": self.modo_carga, "depositos": list(self.depositos)}
+
+    def _leer_checkpoint(self, claves: list, grupos: dict):
+        """
+        Cuántas de `claves` (ordenadas) ya confirmó una ingesta anterior: las que no pasan
+        de la última clave guardada. Devuelve (inicio, huella de esos grupos); (0, huella
+        vacía) si no hay checkpoint, es de otro ámbito o los grupos confirmados cambiaron.
+        """
+        if not self.cnx.in_transaction:
+            asegurar_tabla_sync_estado(self.cursor)
+        checkpoint = leer_estado_sync(self.cursor, self.clave_checkpoint)
+        if self.cnx.in_transaction:
+            self.cnx.commit()
+        if not checkpoint or not checkpoint.get("ultima"):
+            return 0, hashlib.sha256()
+        if any(checkpoint.get(k) != v for k, v in self._ambito_checkpoint().items()):
+            logger.info("Checkpoint de otro modo de carga o depósito: se empieza desde cero.")
+            return 0, hashlib.sha256()
+        inicio = bisect_right([_orden_clave(k) for k in claves], tuple(checkpoint["ultima"]))
+        huella = _huella_grupos(claves[:inicio], grupos)
+        if huella.hexdigest() != checkpoint.get("huella"):
+            logger.info("Los grupos ya confirmados cambiaron desde el checkpoint: se empieza desde cero.")
+            return 0, hashlib.sha256()
+        return inicio, huella
+
+    def _cerrar_ingesta(self, watermark: dict | None, huella_previa: bool):
+        """Último tramo: avanza el watermark y borra el checkpoint en la misma transacción."""
+        if huella_previa:
+            borrar_estado_sync(self.cursor, self.clave_checkpoint)
+        if watermark:
+            guardar_estado_sync(self.cursor, CLAVE_WATERMARK_PICKLIST, watermark)
+            logger.info("Watermark PickList avanzado a %s", watermark)
+
+    def _escribir_grupos(self, claves: list, grupos: dict, mapear: bool):
+        """
+        Escribe dimensiones, cabeceras y detalles de los grupos `claves` en la transacción
+        en curso. Devuelve (PickListID afectados, detalles, insertados, actualizados, omitidos).
+        """
+        self._asegurar_dimensiones(claves, grupos)
+        ids = self._resolver_cabeceras(claves, grupos)
+        return self._escribir_detalles(claves, grupos, ids, mapear)
+
+    def _asegurar_dimensiones(self, claves: list, grupos: dict):
+        # Productos, Clientes y Tienda faltantes (antes de los detalles por el FK a Productos)
+        productos = {}
+        for key in claves:
+            for r in grupos[key]:
+                if r.get('producto') and not productos.get(r['producto']):
+                    productos[r['producto']] = r.get('descripcion')
+        self.cache.asegurar(
+            self.cursor,
+            productos,
+            {cliente for _, _, cliente, _ in claves},
+            {(cliente, tienda) for _, tienda, cliente, _ in claves},
+            self.tamano_lote, self.max_bytes_lote(),
+        )
+
+    def _resolver_cabeceras(self, claves: list, grupos: dict) -> dict:
+        # Cabeceras en un INSERT multi-fila y PickListID por SELECT; las ya resueltas
+        # (self.cabeceras) no se vuelven a tocar
+        ids = {key: self.cabeceras[key] for key in claves if key in self.cabeceras}
+        claves = [key for key in claves if key not in ids]
+        if not claves:
+            return ids
+        headers = {
+            (pedido, tienda, cliente, deposito): {
+                'cliente':  cliente,
+                'deposito': deposito,
+                'pedido':   pedido,
+                'nombre':   grupos[(pedido, tienda, cliente, deposito)][0].get('nombre', ''),
+                'tienda':   tienda,
+            }
+            for (pedido, tienda, cliente, deposito) in claves
+        }
+        ids.update(resolver_picklist_ids(self.cursor, headers, self.tamano_lote, self.max_bytes_lote()))
+        return ids
+
+    def _escribir_detalles(self, claves: list, grupos: dict, ids: dict, mapear: bool):
+        afectados_ids = {ids[key] for key in claves}
+        detalles = [(ids[key], det) for key in claves for det in grupos[key]]
+
+        # Detalles de todos los grupos: reconciliados contra lo guardado o INSERT IGNORE multi-fila
+        actualizados = 0
+        if settings.DETALLE_RECONCILIAR:
+            res = reconciliar_picklist_detalle(self.cursor, detalles, self.tamano_lote, self.max_bytes_lote())
+            insertados, actualizados, omitidos = res["insertados"], res["actualizados"], res["omitidos"]
+        else:
+            insertados, omitidos = insertar_picklist_detalle_batch(
+                self.cursor, detalles, self.tamano_lote, self.max_bytes_lote()
+            )
+
+        # Sincronizar campos y mapear Ubicación (solo los PickList de este tramo)
+        if afectados_ids:
+            actualizar_detalle_desde_picklist(self.cursor, list(afectados_ids))
+            if mapear:
+                mapear_ubicacionid_en_picklistdetalle(self.cursor, picklist_ids=afectados_ids)
+        return afectados_ids, len(detalles), insertados, actualizados, omitidos
+
+    def _escritores_efectivos(self) -> int:
+        """Escritores en paralelo que admite el pool (uno de sus lugares es de esta conexión)."""
+        if self.modo_carga != "filas" or self.escritores <= 1:
+            return 1
+        disponibles = max(1, settings.DB_POOL_SIZE - 1)
+        if self.escritores > disponibles:
+            logger.warning("DB_ESCRITORES=%s supera el pool (DB_POOL_SIZE=%s): se usan %s escritores.",
+                           self.escritores, settings.DB_POOL_SIZE, disponibles)
+        return max(1, min(self.escritores, disponibles))
+
+    def _insertar_paralelo(self, claves: list, grupos: dict, escritores: int,
+                           watermark: dict | None, mapear: bool) -> dict:
+        """
+        Escritura en paralelo para backfills grandes:
+          1) Productos, Clientes, Tienda y las cabeceras PickList se escriben aquí, en orden
+             de clave y en una sola transacción, para que los escritores no compitan por ellas.
+          2) Los grupos se reparten por crc32(Pedido) entre `escritores` conexiones del pool
+             (todos los grupos de un PickList caen en el mismo escritor); cada uno confirma
+             sus detalles por tramos de DB_CHUNK_GRUPOS grupos.
+          3) Los resúmenes se suman y el watermark se guarda solo si todos terminaron bien.
+        No usa checkpoint: repetir la corrida es seguro porque los detalles se reconcilian.
+        """
+        if not self.cnx.in_transaction:
+            self.cnx.start_transaction()
+        self._asegurar_dimensiones(claves, grupos)
+        ids = self._resolver_cabeceras(claves, grupos)
+        self.cnx.commit()
+        self.cache.confirmar()
+
+        particiones = [[] for _ in range(escritores)]
+        for key in claves:
+            particiones[zlib.crc32((key[0] or '').upper().encode("utf-8")) % escritores].append(key)
+        particiones = [p for p in particiones if p]
+        logger.info("Escritura en paralelo: %s grupos en %s escritores (%s)",
+                    len(claves), len(particiones), ", ".join(str(len(p)) for p in particiones))
+
+        with ThreadPoolExecutor(max_workers=len(particiones), thread_name_prefix="escritor") as pool:
+            resultados = list(pool.map(lambda p: self._escritor(p, grupos, ids, mapear), particiones))
+
+        resumen = {"grupos": len(claves), "detalles": 0, "insertados": 0, "actualizados": 0, "omitidos": 0}
+        for afectados_ids, n, insertados, actualizados, omitidos in resultados:
+            resumen["detalles"] += n
+            resumen["insertados"] += insertados
+            resumen["actualizados"] += actualizados
+            resumen["omitidos"] += omitidos
+            if not mapear:
+                self._alcance_mapeo["picklist_ids"].update(afectados_ids)
+        if watermark:
+            self.guardar_watermark(watermark)
+        logger.info(
+            "Grupos procesados: %s | Detalles: %s nuevos, %s actualizados, %s omitidos",
+            len(claves), resumen["insertados"], resumen["actualizados"], resumen["omitidos"]
+        )
+        return resumen
+
+    def _escritor(self, claves: list, grupos: dict, ids: dict, mapear: bool):
+        """
+        Un escritor de _insertar_paralelo: conexión propia y una transacción por tramo.
+        Si se activa `detener`, termina el tramo en curso y lanza IngestaInterrumpida.
+        """
+        escritor = DataService(cache=self.cache, modo_carga="filas", escritores=1)
+        escritor.conectar_bd()
+        try:
+            tramo = settings.DB_CHUNK_GRUPOS if settings.DB_CHUNK_GRUPOS > 0 else len(claves)
+            afectados, totales = set(), [0, 0, 0, 0]
+            for desde in range(0, len(claves), tramo):
+                if desde and self.detener is not None and self.detener.is_set():
+                    raise IngestaInterrumpida(
+                        f"escritor detenido tras confirmar {desde}/{len(claves)} de sus grupos"
+                    )
+                escritor.cnx.start_transaction()
+                ids_tramo, *conteos = escritor._escribir_detalles(claves[desde:desde + tramo], grupos, ids, mapear)
+                escritor.cnx.commit()
+                afectados |= ids_tramo
+                totales = [t + c for t, c in zip(totales, conteos)]
+            return (afectados, *totales)
+        finally:
+            escritor.cerrar_conexion()
+
+    def _cargar_staging(self, tabla: str, columnas: tuple, filas) -> int:
+        if self.modo_carga == "json":
+            return cargar_json(self.cursor, tabla, filas, self.max_bytes_lote())
+        return cargar_tsv(self.cursor, tabla, columnas, filas)
+
+    def _escribir_grupos_staging(self, claves: list, grupos: dict, mapear: bool):
+        """
+        Igual que _escribir_grupos pero cargando los grupos en tablas temporarias y
+        fusionándolos con INSERT ... SELECT (modo de carga distinto de "filas").
+        """
+        crear_staging_picklist(self.cursor)
+        self._cargar_staging(STG_PICKLIST, COLUMNAS_STG_PICKLIST, filas_staging_picklist(claves, grupos))
+        res = fusionar_picklist_staging(self.cursor, reconciliar=settings.DETALLE_RECONCILIAR)
+        # Las dimensiones se insertaron por fuera de la caché
+        self.cache.invalidar()
+
+        afectados_ids = set(res["picklist_ids"])
+        if afectados_ids:
+            actualizar_detalle_desde_picklist(self.cursor, list(afectados_ids))
+            if mapear:
+                mapear_ubicacionid_en_picklistdetalle(self.cursor, picklist_ids=afectados_ids)
+        return afectados_ids, res["detalles"], res["insertados"], res["actualizados"], res["omitidos"]
+
     def asegurar_productos_desde_picklist(self) -> int:
         """
-        Inserta en Productos los ProductoID que existan en PickListDetalle pero no estén en Productos.
-        Usa la descripción disponible en PickListDetalle. Devuelve la cantidad de productos insertados.
+        Inserta en Productos los ProductoID de PickListDetalle que no estén en Productos.
+        Solo revisa los detalles con PickListDetalleID posterior al último revisado
+        (marca en SyncEstado), así que el costo depende de lo nuevo y no del historial.
+        Devuelve la cantidad de productos insertados.
+
+        La marca avanza a MAX(PickListDetalleID) confirmado, pero un ID menor reservado por
+        otra transacción puede confirmarse después. Por eso se llama con el bloqueo de
+        sincronización y ya terminados los escritores y depósitos, y además se revisan otra
+        vez los PRODUCTOS_VENTANA_DETALLE IDs por debajo de la marca.
         """
         try:
-            started_transaction = False
             if not self.cnx.in_transaction:
+                asegurar_tabla_sync_estado(self.cursor)
                 self.cnx.start_transaction()
-                logger.info("Transacción iniciada (Productos faltantes desde PickListDetalle).")
-                started_transaction = True
 
+            marca = leer_estado_sync(self.cursor, CLAVE_HWM_PRODUCTOS_DETALLE) or {}
+            desde = int(marca.get("detalle_id") or 0)
+            self.cursor.execute("SELECT MAX(PickListDetalleID) FROM PickListDetalle")
+            fila = self.cursor.fetchone()
+            hasta = int(fila[0]) if fila and fila[0] is not None else 0
+            ventana = max(0, settings.PRODUCTOS_VENTANA_DETALLE)
+            if hasta <= desde and not (ventana and desde):
+                logger.info("No hay detalles nuevos desde PickListDetalleID=%s para revisar en Productos.", desde)
+                self.cnx.commit()
+                return 0
+            inicio = max(0, desde - ventana)
+            hasta = max(hasta, desde)
+
+            # Join por la columna directa (Productos.ProductoID es la PK); TRIM solo en la salida
             consulta_faltantes = """
-                SELECT DISTINCT
-                    TRIM(d.ProductoID) AS ProductoID,
-                    TRIM(d.ProductoID) AS ProductoDescripcion
+                SELECT DISTINCT TRIM(d.ProductoID)
                 FROM PickListDetalle d
-                LEFT JOIN Productos p ON p.ProductoID = TRIM(d.ProductoID)
-                WHERE d.ProductoID IS NOT NULL
-                  AND TRIM(d.ProductoID) <> ''
+                LEFT JOIN Productos p ON p.ProductoID = d.ProductoID
+                WHERE d.PickListDetalleID > %s
+                  AND d.PickListDetalleID <= %s
+                  AND d.ProductoID IS NOT NULL
+                  AND d.ProductoID <> ''
                   AND p.ProductoID IS NULL
             """
-            self.cursor.execute(consulta_faltantes)
-            faltantes = self.cursor.fetchall()
-
-            if not faltantes:
-                logger.info("No se encontraron productos nuevos para registrar en Productos.")
-                if started_transaction:
-                    self.cnx.commit()
-                return 0
+            self.cursor.execute(consulta_faltantes, (inicio, hasta))
+            faltantes = sorted({r[0] for r in self.cursor.fetchall() if r[0]})
 
-            insercion = """
-                INSERT INTO Productos (ProductoID, ProductoDescripcion)
-                VALUES (%s, %s)
-            """
-            self.cursor.executemany(insercion, faltantes)
-            if started_transaction:
-                self.cnx.commit()
-            logger.info("Productos nuevos insertados en Productos: %s", len(faltantes))
-            return len(faltantes)
+            insertados = 0
+            if faltantes:
+                insertados = asegurar_productos_batch(
+                    self.cursor, [(p, p) for p in faltantes], self.tamano_lote, self.max_bytes_lote()
+                )
+            if hasta > desde:
+                guardar_estado_sync(self.cursor, CLAVE_HWM_PRODUCTOS_DETALLE, {"detalle_id": hasta})
+            self.cnx.commit()
+            self.cache.registrar_productos(faltantes)
+            logger.info("Productos desde PickListDetalle (%s < ID <= %s): %s nuevos",
+                        inicio, hasta, insertados)
+            return insertados
 
         except Exception as e:
             if self.cnx.in_transaction:
@@ -206,26 +645,101 @@ class DataService:
             raise
 
     def cerrar_conexion(self):
-        """Cierra la conexión con la base de datos."""
+        """Cierra el cursor y devuelve la conexión al pool."""
         if self.cursor:
             self.cursor.close()
+            self.cursor = None
         if self.cnx:
+            if self.cnx.in_transaction:
+                self.cnx.rollback()
+            # El reset de sesión del pool libera también el bloqueo de sincronización
             self.cnx.close()
+            self.cnx = None
+        self._bloqueo_tomado = False
         logger.info("Conexión a la base de datos cerrada.")
 
-    def insertar_productos_ubicacion(self, registros: list[dict]):
-        """Inserta/actualiza la tabla ProductosUbicacion a partir de la lista mapeada."""
+    def mapear_ubicaciones(self) -> int:
+        """
+        Vincula UbicacionID de una sola vez para los PickList y productos que quedaron
+        pendientes (insertar_datos / insertar_productos_ubicacion con mapear=False).
+        """
+        alcance = self._alcance_mapeo
+        if not alcance["picklist_ids"] and not alcance["productos"]:
+            return 0
+        try:
+            filas = mapear_ubicacionid_en_picklistdetalle(
+                self.cursor, picklist_ids=alcance["picklist_ids"], productos=alcance["productos"]
+            )
+            self.cnx.commit()
+        except Exception as e:
+            self.cnx.rollback()
+            logger.error(f"Error al mapear UbicacionID: {e}")
+            raise
+        alcance["picklist_ids"].clear()
+        alcance["productos"].clear()
+        return filas
+
+    def normalizar_ubicaciones(self) -> dict:
+        """Normaliza (una vez) las ubicaciones guardadas antes de normalizarlas al escribir."""
+        try:
+            resultado = normalizar_ubicaciones(self.cursor)
+            self.cnx.commit()
+            return resultado
+        except Exception as e:
+            self.cnx.rollback()
+            logger.error(f"Error al normalizar ubicaciones: {e}")
+            raise
+
+    def insertar_productos_ubicacion(self, registros: list[dict], mapear: bool = True):
+        """
+        Inserta/actualiza la tabla ProductosUbicacion a partir de la lista mapeada.
+        En modo de carga "bulk" o "json" pasa por la tabla de staging; si no, con PU_UPSERT_POR_LOTES
+        usa el upsert multi-fila. Ambos devuelven
+        {insertados, actualizados, sin_cambios}; si no, una sentencia por fila (devuelve None).
+        Con PU_SOLO_CAMBIOS se compara contra el Stock guardado y solo se escriben los pares
+        nuevos o con Stock distinto; el resumen agrega `omitidos` (sin cambios, no escritos).
+        El mapeo de UbicacionID se limita a los productos escritos; con mapear=False
+        queda pendiente para mapear_ubicaciones().
+        """
         try:
             if not self.cnx.in_transaction:
                 self.cnx.start_transaction()
                 logger.info("Transacción iniciada (ProductosUbicacion).")
 
-            for r in registros:
-                insertar_producto_ubicacion(self.cursor, r)
-            
-            mapear_ubicacionid_en_picklistdetalle(self.cursor)
+            omitidos = 0
+            if settings.PU_SOLO_CAMBIOS:
+                # Foto del Stock actual en un SELECT por lote de productos; solo se escriben los cambios
+                foto = leer_stock_productos_ubicacion(
+                    self.cursor, {r.get("ProductoID") for r in registros}
+                )
+                registros, omitidos = filtrar_productos_ubicacion_cambiados(registros, foto)
+                logger.info("ProductosUbicacion: %s pares con cambios | %s sin cambios omitidos",
+                            len(registros), omitidos)
+            productos = {(r.get("ProductoID") or "").strip() for r in registros}
+
+            resumen = None
+            if self.modo_carga != "filas":
+                crear_staging_productos_ubicacion(self.cursor)
+                self._cargar_staging(STG_PRODUCTOS_UBICACION, COLUMNAS_STG_PRODUCTOS_UBICACION,
+                                     filas_productos_ubicacion(registros))
+                resumen = fusionar_productos_ubicacion_staging(self.cursor)
+            elif settings.PU_UPSERT_POR_LOTES:
+                resumen = upsert_productos_ubicacion_batch(
+                    self.cursor, registros, self.tamano_lote, self.max_bytes_lote()
+                )
+            else:
+                for r in registros:
+                    insertar_producto_ubicacion(self.cursor, r)
+
+            if mapear:
+                mapear_ubicacionid_en_picklistdetalle(self.cursor, productos=productos)
             self.cnx.commit()
+            if not mapear:
+                self._alcance_mapeo["productos"].update(productos)
             logger.info("ProductosUbicacion insertado/actualizado correctamente.")
+            if resumen is not None:
+                resumen["omitidos"] = omitidos
+            return resumen
         except Exception as e:
             self.cnx.rollback()
             logger.error(f"Error en ProductosUbicacion: {e}")
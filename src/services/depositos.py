@@ -0,0 +1,98 @@
+# src/services/depositos.py
+"""
+Sincronización de varios depósitos a partir de una sola descarga de RYM0501.
+
+Los registros se reparten por depósito y cada depósito corre su propio proceso en
+paralelo (PROUBI, PickList, ProductosUbicacion y mapeo de UbicacionID) con su conexión
+del pool, su lista de depósitos permitidos y sus métricas. Productos, Clientes, Tienda y
+las cabeceras PickList se escriben antes, una sola vez y en orden, para que los depósitos
+no compitan por ellos (PickList es única por Pedido y un pedido puede tener varios depósitos).
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config.settings import settings
+from services.data_service import DataService
+from utils.logger import logger
+
+
+def dividir_por_deposito(registros, depositos) -> dict[str, list[dict]]:
+    """{deposito: registros} para cada depósito de `depositos`; el resto se descarta."""
+    por_deposito = {d: [] for d in depositos}
+    for r in registros:
+        lista = por_deposito.get(str(r.get("deposito") or "").strip())
+        if lista is not None:
+            lista.append(r)
+    return por_deposito
+
+
+def _sincronizar_deposito(deposito: str, registros: list[dict], api_service, cache, cabeceras: dict,
+                          detener=None) -> dict:
+    t0 = time.perf_counter()
+    latencias = {}
+    productos_ubi = api_service.obtener_productos_ubicacion_batch(registros, metricas=latencias)
+    metricas = {
+        "deposito": deposito,
+        "registros": len(registros),
+        "productos_ubicacion": len(productos_ubi),
+        "proubi_s": round(time.perf_counter() - t0, 3),
+        "proubi": latencias,
+    }
+
+    data_service = DataService(cache=cache, depositos=(deposito,))
+    data_service.detener = detener
+    data_service.cabeceras = cabeceras
+    data_service.conectar_bd()
+    try:
+        t1 = time.perf_counter()
+        resumen = data_service.insertar_datos(registros, mapear=False)
+        if productos_ubi:
+            data_service.insertar_productos_ubicacion(productos_ubi, mapear=False)
+        metricas["mapeados"] = data_service.mapear_ubicaciones()
+        metricas["bd_s"] = round(time.perf_counter() - t1, 3)
+    finally:
+        data_service.cerrar_conexion()
+
+    metricas.update({k: resumen[k] for k in ("grupos", "insertados", "actualizados", "omitidos")})
+    metricas["total_s"] = round(time.perf_counter() - t0, 3)
+    logger.info("Depósito %(deposito)s: %(registros)s registros | %(grupos)s grupos | detalles %(insertados)s "
+                "nuevos, %(actualizados)s actualizados, %(omitidos)s omitidos | %(productos_ubicacion)s "
+                "ProductosUbicacion | PROUBI %(proubi_s)ss | BD %(bd_s)ss | total %(total_s)ss", metricas)
+    return metricas
+
+
+def sincronizar_depositos(api_service, data_service: DataService, registros: list[dict],
+                          depositos=None, detener=None) -> dict[str, dict]:
+    """
+    Escribe `registros` (ya descargados de RYM0501) con un proceso concurrente por depósito.
+    `data_service` (conectado) escribe los catálogos y las cabeceras PickList y presta su
+    caché de dimensiones; cada depósito recibe los PickListID ya resueltos.
+    Devuelve {deposito: métricas}. Si algún depósito falla, los demás terminan igual y
+    luego se propaga el primer error (el llamador no debe avanzar el watermark).
+    Con `detener` activado, cada depósito termina su tramo en curso y lanza IngestaInterrumpida.
+    """
+    depositos = tuple(depositos or settings.DEPOSITOS)
+    por_deposito = {d: regs for d, regs in dividir_por_deposito(registros, depositos).items() if regs}
+    if not por_deposito:
+        logger.info("Ningún registro de los depósitos %s.", ", ".join(depositos))
+        return {}
+    data_service.asegurar_dimensiones(registros)
+    cabeceras = data_service.asegurar_cabeceras(registros)
+
+    with ThreadPoolExecutor(max_workers=len(por_deposito), thread_name_prefix="deposito") as pool:
+        futuros = {
+            d: pool.submit(_sincronizar_deposito, d, regs, api_service, data_service.cache,
+                           {k: v for k, v in cabeceras.items() if k[3] == d}, detener)
+            for d, regs in por_deposito.items()
+        }
+
+    metricas, errores = {}, []
+    for deposito, futuro in futuros.items():
+        try:
+            metricas[deposito] = futuro.result()
+        except Exception as e:
+            logger.error("Depósito %s falló: %s", deposito, e)
+            errores.append(e)
+    if errores:
+        raise errores[0]
+    return metricas
@@ -0,0 +1,174 @@
+# src/services/pipeline.py
+"""
+Sincronización en pipeline: la descarga de RYM0501, las consultas PROUBI y la escritura
+en MySQL corren a la vez, unidas por colas acotadas:
+
+    RYM0501 (hilo) --[cola]--> PROUBI (hilo) --[cola]--> BD (hilo que llama)
+
+El PickList se corta en tramos de PIPELINE_TRAMO_REGISTROS registros. Cada tramo se
+escribe (PickList, detalles, ProductosUbicacion y mapeo de UbicacionID) y se confirma
+mientras los tramos siguientes todavía se están descargando. Con las colas llenas, la
+etapa anterior espera (backpressure), así que la memoria queda acotada aunque la BD sea
+más lenta que la API. El watermark se avanza una sola vez, al terminar sin errores.
+"""
+import queue
+import threading
+import time
+
+from api.api_services import watermark_desde_registros
+from api.proubi_planner import clave_par
+from config.settings import settings
+from services.data_service import IngestaInterrumpida
+from utils.logger import logger
+
+# Marca de fin de la etapa anterior
+_FIN = object()
+
+
+class _Fallo:
+    """Error de una etapa, reenviado por la cola hasta la escritura."""
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+def _tramos(registros, tamano: int):
+    tramo = []
+    for r in registros:
+        tramo.append(r)
+        if len(tramo) >= tamano:
+            yield tramo
+            tramo = []
+    if tramo:
+        yield tramo
+
+
+def _poner(cola: queue.Queue, item, detener: threading.Event) -> bool:
+    """put() que se rinde si la escritura pidió detener el pipeline."""
+    while not detener.is_set():
+        try:
+            cola.put(item, timeout=0.2)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _tomar(cola: queue.Queue, detener: threading.Event):
+    while not detener.is_set():
+        try:
+            return cola.get(timeout=0.2)
+        except queue.Empty:
+            continue
+    return _FIN
+
+
+def _etapa_picklist(api_service, watermark, tamano: int, salida: queue.Queue, detener: threading.Event):
+    try:
+        if settings.RYM0501_STREAMING:
+            registros = api_service.iter_picklist(watermark)
+        else:
+            registros = api_service.obtener_picklist(watermark)
+        for tramo in _tramos(registros, tamano):
+            if not _poner(salida, (tramo, time.monotonic()), detener):
+                return
+        _poner(salida, _FIN, detener)
+    except Exception as e:
+        _poner(salida, _Fallo(e), detener)
+
+
+def _etapa_proubi(api_service, entrada: queue.Queue, salida: queue.Queue, detener: threading.Event):
+    # Pares ya consultados en tramos anteriores: no se vuelven a pedir
+    consultados = set()
+    try:
+        while True:
+            item = _tomar(entrada, detener)
+            if item is _FIN or isinstance(item, _Fallo):
+                _poner(salida, item, detener)
+                return
+            tramo, liberado = item
+            pendientes = []
+            for r in tramo:
+                par = clave_par(r.get("producto"), r.get("ubicacion"))
+                if par not in consultados:
+                    consultados.add(par)
+                    pendientes.append(r)
+            productos_ubi = api_service.obtener_productos_ubicacion_batch(pendientes) if pendientes else []
+            if not _poner(salida, (tramo, productos_ubi, liberado), detener):
+                return
+    except Exception as e:
+        _poner(salida, _Fallo(e), detener)
+
+
+def ejecutar_pipeline(api_service, data_service, watermark: dict | None = None,
+                      tamano_tramo: int | None = None, tamano_cola: int | None = None,
+                      detener: threading.Event | None = None) -> dict:
+    """
+    Sincroniza PickList y ProductosUbicacion en pipeline (ver el docstring del módulo).
+    `data_service` debe estar conectado; la escritura ocurre en el hilo que llama.
+    Devuelve {tramos, registros, productos_ubicacion, watermark, latencia_max_s, total_s}.
+    Si una etapa falla, los tramos ya confirmados quedan escritos, el watermark no se
+    mueve y la excepción se propaga. Si se activa `detener`, se termina el tramo en curso
+    y se lanza IngestaInterrumpida (tampoco se mueve el watermark).
+    """
+    tamano_tramo = max(1, tamano_tramo or settings.PIPELINE_TRAMO_REGISTROS)
+    tamano_cola = max(1, tamano_cola or settings.PIPELINE_COLA)
+    cola_picklist = queue.Queue(maxsize=tamano_cola)
+    cola_escritura = queue.Queue(maxsize=tamano_cola)
+    # Corta las etapas de descarga y PROUBI al salir; `detener` es el pedido de apagado externo
+    parar = threading.Event()
+    hilos = [
+        threading.Thread(target=_etapa_picklist, name="pipeline-rym0501", daemon=True,
+                         args=(api_service, watermark, tamano_tramo, cola_picklist, parar)),
+        threading.Thread(target=_etapa_proubi, name="pipeline-proubi", daemon=True,
+                         args=(api_service, cola_picklist, cola_escritura, parar)),
+    ]
+    logger.info("Pipeline iniciado: tramos de %s registros, colas de %s tramos.", tamano_tramo, tamano_cola)
+
+    t0 = time.monotonic()
+    resumen = {"tramos": 0, "registros": 0, "productos_ubicacion": 0, "watermark": None}
+    latencias = []
+    siguiente = watermark
+    for hilo in hilos:
+        hilo.start()
+    try:
+        while True:
+            item = cola_escritura.get()
+            if item is _FIN:
+                break
+            if isinstance(item, _Fallo):
+                raise item.error
+            tramo, productos_ubi, liberado = item
+
+            data_service.insertar_datos(tramo, mapear=False)
+            if productos_ubi:
+                data_service.insertar_productos_ubicacion(productos_ubi, mapear=False)
+            data_service.mapear_ubicaciones()
+
+            # Desde que RYM0501 entregó el tramo hasta que quedó confirmado en MySQL
+            latencias.append(time.monotonic() - liberado)
+            resumen["tramos"] += 1
+            resumen["registros"] += len(tramo)
+            resumen["productos_ubicacion"] += len(productos_ubi)
+            siguiente = watermark_desde_registros(tramo, siguiente) or siguiente
+            logger.info("Pipeline tramo %s: %s registros | %s ProductosUbicacion | latencia %.3fs | "
+                        "en cola: %s PickList, %s escritura",
+                        resumen["tramos"], len(tramo), len(productos_ubi), latencias[-1],
+                        cola_picklist.qsize(), cola_escritura.qsize())
+            if detener is not None and detener.is_set():
+                raise IngestaInterrumpida(f"pipeline detenido tras {resumen['tramos']} tramos confirmados")
+
+        if siguiente and siguiente is not watermark:
+            data_service.guardar_watermark(siguiente)
+            resumen["watermark"] = siguiente
+    finally:
+        parar.set()
+        for hilo in hilos:
+            hilo.join(timeout=5)
+
+    resumen["latencia_max_s"] = round(max(latencias), 3) if latencias else 0.0
+    resumen["total_s"] = round(time.monotonic() - t0, 3)
+    logger.info("Pipeline terminado: %(tramos)s tramos | %(registros)s registros | "
+                "%(productos_ubicacion)s ProductosUbicacion | latencia máx %(latencia_max_s)ss | "
+                "total %(total_s)ss", resumen)
+    return resumen
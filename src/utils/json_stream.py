@@ -0,0 +1,108 @@
+# src/utils/json_stream.py
+
+import json
+
+_ESPACIOS = " \t\n\r"
+
+
+class ArregloJSONIncompleto(ValueError):
+    """El arreglo empezó bien pero se cortó o se corrompió: los elementos ya entregados son parciales."""
+
+
+def iter_json_array(chunks):
+    """
+    Recorre un arreglo JSON de nivel superior a partir de fragmentos de texto
+    (p.ej. resp.iter_content decodificado) y devuelve sus elementos uno a uno.
+
+    Solo mantiene en memoria el elemento en curso y el fragmento pendiente, por lo
+    que el consumo no crece con el tamaño del arreglo.
+    Lanza ValueError si el documento no es un arreglo JSON y ArregloJSONIncompleto
+    (subclase de ValueError) si se corta o se corrompe después de abrir el arreglo.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ""
+    pos = 0
+    agotado = False
+
+    def _leer() -> bool:
+        nonlocal buf, pos, agotado
+        for chunk in chunks:
+            if chunk:
+                buf = buf[pos:] + chunk
+                pos = 0
+                return True
+        agotado = True
+        return False
+
+    def _saltar_espacios() -> bool:
+        """Avanza hasta el siguiente carácter significativo; False si se acabó la entrada."""
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _ESPACIOS:
+                pos += 1
+            if pos < len(buf):
+                return True
+            if not _leer():
+                return False
+
+    if not _saltar_espacios() or buf[pos] != "[":
+        raise ValueError("La respuesta no es un arreglo JSON.")
+    pos += 1
+
+    primero = True
+    while True:
+        if not _saltar_espacios():
+            raise ArregloJSONIncompleto("Arreglo JSON incompleto.")
+        if buf[pos] == "]":
+            return
+        if not primero:
+            if buf[pos] != ",":
+                raise ArregloJSONIncompleto(f"Se esperaba ',' en la posición {pos} del fragmento.")
+            pos += 1
+            if not _saltar_espacios():
+                raise ArregloJSONIncompleto("Arreglo JSON incompleto.")
+        primero = False
+
+        while True:
+            try:
+                valor, fin = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if agotado or not _leer():
+                    raise ArregloJSONIncompleto("Elemento JSON inválido o incompleto.")
+                continue
+            # Un número al final del fragmento podría continuar en el siguiente
+            if fin == len(buf) and not agotado and _leer():
+                continue
+            break
+        pos = fin
+        yield valor
+
+
+class EscritorArregloJSON:
+    """Escribe elementos uno a uno como arreglo JSON compacto. Sin ruta no hace nada."""
+
+    def __init__(self, ruta: str | None):
+        self.ruta = ruta
+        self._f = None
+        self._primero = True
+
+    def __enter__(self):
+        if self.ruta:
+            self._f = open(self.ruta, "w", encoding="utf-8")
+            self._f.write("[")
+        return self
+
+    def escribir(self, elemento):
+        if self._f is None:
+            return
+        if not self._primero:
+            self._f.write(",\n")
+        self._primero = False
+        self._f.write(json.dumps(elemento, ensure_ascii=False, separators=(",", ":")))
+
+    def __exit__(self, *exc):
+        if self._f is not None:
+            self._f.write("]\n")
+            self._f.close()
+            self._f = None
@@ -0,0 +1,14 @@
+# tests/conftest.py
+# Los módulos de src/ se importan entre sí sin prefijo (config, db, services...):
+# se agrega src/ al path para que cada archivo de pruebas se pueda correr por separado.
+import os
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
+
+# Sin caché de token en disco: si no, la suite escribe .token_cache.json(.lock) en la raíz
+# del repo. Las pruebas del caché parchean TOKEN_CACHE_FILE a un directorio temporal.
+# load_dotenv() no sobreescribe variables ya definidas, así que esto gana sobre el .env.
+os.environ['TOKEN_CACHE_FILE'] = ''
@@ -3,8 +3,19 @@
 import unittest
 from unittest.mock import patch, MagicMock
 from src.api.client import APIClient
+from src.api.api_services import APIService, WATERMARK_INICIAL, watermark_desde_registros
+from src.api.proubi_planner import planificar_consultas, repartir_respuestas
+from src.api.auth import OAuth2Manager
+from src.api.resilience import CircuitBreaker, parse_retry_after
+from src.utils.json_stream import ArregloJSONIncompleto, iter_json_array
+import requests
 import json
 import logging
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 class TestAPIClient(unittest.TestCase):
     @patch('src.api.client.requests.get')
@@ -53,6 +64,321 @@ class TestAPIClient(unittest.TestCase):
         self.assertIsNone(data)
         mock_logger.error.assert_called_with("La respuesta de la API no está en formato JSON.")
 
+class TestAPIServiceProubi(unittest.TestCase):
+    def _service(self, get_proubi):
+        with patch('src.api.api_services.APIClient'):
+            service = APIService()
+        service.api.get_proubi.side_effect = get_proubi
+        return service
+
+    def test_batch_concurrente_conserva_orden(self):
+        en_vuelo = {'actual': 0, 'max': 0}
+        lock = threading.Lock()
+
+        def get_proubi(json_body):
+            with lock:
+                en_vuelo['actual'] += 1
+                en_vuelo['max'] = max(en_vuelo['max'], en_vuelo['actual'])
+            # Respuestas más lentas para los primeros registros
+            time.sleep(0.02 if json_body['de_producto'] < 'P05' else 0.001)
+            with lock:
+                en_vuelo['actual'] -= 1
+            return [{'producto': json_body['de_producto'], 'ubicacion': json_body['de_ubicacion'],
+                     'deposito': '01', 'cantidadTotal': '3'},
+                    {'producto': json_body['de_producto'], 'ubicacion': 'OTRA', 'deposito': '02'}]
+
+        service = self._service(get_proubi)
+        picklist = [{'producto': f'P{i:02d}', 'ubicacion': f'U{i}'} for i in range(10)]
+        metricas = {}
+        out = service.obtener_productos_ubicacion_batch(picklist, max_workers=3, metricas=metricas)
+
+        self.assertEqual([r['ProductoID'] for r in out], [f'P{i:02d}' for i in range(10)])
+        self.assertTrue(all(r['Stock'] == 3 for r in out))
+        self.assertLessEqual(en_vuelo['max'], 3)
+        self.assertEqual(metricas['llamadas'], 10)
+
+    def test_batch_secuencial_ignora_respuestas_invalidas(self):
+        service = self._service(lambda json_body: None)
+        out = service.obtener_productos_ubicacion_batch([{'producto': 'A', 'ubicacion': 'B'}], max_workers=1)
+        self.assertEqual(out, [])
+
+
+class TestProubiPlanner(unittest.TestCase):
+    def test_elimina_duplicados_y_agrupa_por_rango(self):
+        pares = [('B', 'u2'), ('A', 'U1'), ('B', 'U2'), ('C', 'U0'), ('D', 'U9')]
+        consultas = planificar_consultas(pares, '01', max_pares=3)
+
+        self.assertEqual(len(consultas), 2)
+        self.assertEqual(consultas[0]['pares'], [('A', 'U1'), ('B', 'U2'), ('C', 'U0')])
+        body = consultas[0]['body']
+        self.assertEqual((body['de_producto'], body['a_producto']), ('A', 'C'))
+        self.assertEqual((body['de_ubicacion'], body['a_ubicacion']), ('U0', 'U2'))
+        self.assertFalse(consultas[1]['rango'])
+
+    def test_max_pares_uno_es_consulta_exacta(self):
+        consultas = planificar_consultas([('A', 'U1'), ('A', 'U1'), ('A', '')], '01', max_pares=1)
+        self.assertEqual([c['body']['de_ubicacion'] for c in consultas], ['', 'U1'])
+        self.assertTrue(all(not c['rango'] for c in consultas))
+
+    def test_prefijo_acota_el_ancho_del_rango(self):
+        pares = [('135087', 'A31'), ('135090', 'A40'), ('135095', 'B10'), ('990001', 'A31'), ('990002', 'A32')]
+        consultas = planificar_consultas(pares, '01', max_pares=10, prefijo_producto=3, prefijo_ubicacion=1)
+
+        self.assertEqual([c['pares'] for c in consultas],
+                         [[('135087', 'A31'), ('135090', 'A40')], [('135095', 'B10')],
+                          [('990001', 'A31'), ('990002', 'A32')]])
+        self.assertEqual([c['rango'] for c in consultas], [True, False, True])
+        self.assertEqual(consultas[2]['body']['a_producto'], '990002')
+        # Sin prefijo solo manda max_pares
+        self.assertEqual(len(planificar_consultas(pares, '01', max_pares=10)), 1)
+
+    def test_reparte_filas_del_rango(self):
+        consultas = planificar_consultas([('A', 'U1'), ('C', 'U3')], '01', max_pares=5)
+        filas = [{'producto': 'A   ', 'ubicacion': 'u1 '}, {'producto': 'B', 'ubicacion': 'U2'},
+                 {'producto': 'C', 'ubicacion': 'U3'}]
+        por_par = repartir_respuestas(consultas, [filas])
+        self.assertEqual(len(por_par[('A', 'U1')]), 1)
+        self.assertEqual(len(por_par[('C', 'U3')]), 1)
+        self.assertNotIn(('B', 'U2'), por_par)
+
+
+class _EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        largo = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(largo)
+        cuerpo = b'[{"ok": 1}]'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestAPIClientSesion(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _EchoHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{self.server.server_port}/rest'
+        self.patcher = patch.multiple('src.api.client.settings', API_URL=base + '/RYM0501',
+                                      API_URL_PROUBI=base + '/RYM0503', API_TOKEN_URL=base + '/token')
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reutiliza_conexiones_keep_alive(self):
+        client = APIClient()
+        with patch.object(client.oauth_manager, 'get_token', return_value='tkn'):
+            for _ in range(3):
+                self.assertEqual(client.get_proubi(json_body={'a': 1}), [{'ok': 1}])
+        stats = client.stats_conexiones()['proubi']
+        self.assertEqual(stats, {'peticiones': 3, 'nuevas': 1, 'reutilizadas': 2})
+        # Por ciclo (daemon): solo lo ocurrido desde el registro anterior
+        self.assertEqual(client.log_conexiones()['proubi'], stats)
+        with patch.object(client.oauth_manager, 'get_token', return_value='tkn'):
+            client.get_proubi(json_body={'a': 1})
+        self.assertEqual(client.log_conexiones()['proubi'], {'peticiones': 1, 'nuevas': 0, 'reutilizadas': 1})
+        client.close()
+        self.assertIsNone(client.session)
+
+
+class TestReintentosYCircuitBreaker(unittest.TestCase):
+    def _respuesta(self, status, json_data=None, headers=None):
+        resp = MagicMock()
+        resp.status_code = status
+        resp.headers = headers or {}
+        resp.json.return_value = json_data
+        resp.elapsed.total_seconds.return_value = 0.01
+        return resp
+
+    def _client(self, respuestas):
+        client = APIClient()
+        client.session = MagicMock()
+        client.session.request.side_effect = respuestas
+        client._dormir = MagicMock()
+        return client
+
+    def test_reintenta_5xx_y_respeta_retry_after(self):
+        client = self._client([self._respuesta(503, headers={'Retry-After': '7'}),
+                               requests.ConnectionError('reset'),
+                               self._respuesta(200, [1])])
+        with patch.object(client.oauth_manager, 'get_token', return_value='tkn'):
+            self.assertEqual(client.get_proubi(json_body={}), [1])
+        self.assertEqual(client.session.request.call_count, 3)
+        self.assertEqual(client._dormir.call_args_list[0].args, (7.0,))
+        self.assertEqual(client.metricas['proubi']['reintentos'], 2)
+
+    def test_no_reintenta_4xx(self):
+        client = self._client([self._respuesta(404)])
+        with patch.object(client.oauth_manager, 'get_token', return_value='tkn'):
+            self.assertIsNone(client.get_rym0501(json_body={}))
+        self.assertEqual(client.session.request.call_count, 1)
+        self.assertEqual(client.breakers['rym0501'].estado, CircuitBreaker.CERRADO)
+
+    def test_breaker_abre_y_se_recupera(self):
+        ahora = [0.0]
+        breaker = CircuitBreaker('X', umbral_error=0.5, min_llamadas=4, ventana=4,
+                                 enfriamiento=10, reloj=lambda: ahora[0])
+        for _ in range(2):
+            breaker.registrar_exito()
+        for _ in range(2):
+            breaker.registrar_fallo()
+        self.assertEqual(breaker.estado, CircuitBreaker.ABIERTO)
+        self.assertFalse(breaker.permitir())
+
+        ahora[0] = 11
+        self.assertTrue(breaker.permitir())
+        self.assertFalse(breaker.permitir())
+        breaker.registrar_exito()
+        self.assertEqual(breaker.estado, CircuitBreaker.CERRADO)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('3'), 3.0)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+        self.assertIsNone(parse_retry_after('mañana'))
+
+
+class TestStreamingPicklist(unittest.TestCase):
+    def _trozos(self, texto, tam):
+        return [texto[i:i + tam] for i in range(0, len(texto), tam)]
+
+    def test_iter_json_array_con_fragmentos_pequenos(self):
+        with open('picklist_response.json', encoding='utf-8') as f:
+            texto = f.read()
+        esperado = json.loads(texto)
+        for tam in (1, 7, 4096):
+            self.assertEqual(list(iter_json_array(self._trozos(texto, tam))), esperado)
+
+    def test_iter_json_array_numeros_en_el_borde(self):
+        self.assertEqual(list(iter_json_array(['[1', '23, 4', '5 ]'])), [123, 45])
+        self.assertEqual(list(iter_json_array(['  [ ', ' ]'])), [])
+
+    def test_iter_json_array_rechaza_no_arreglos(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(['{"error": "x"}']))
+        with self.assertRaises(ArregloJSONIncompleto):
+            list(iter_json_array(['[{"a": 1}, {"b"']))
+
+    def test_iter_picklist_filtra_deposito(self):
+        with patch('src.api.api_services.APIClient'):
+            service = APIService()
+        service.api.iter_rym0501.return_value = iter([
+            {'deposito': '01', 'pedido': '1'}, {'deposito': '02', 'pedido': '2'}, {'deposito': ' 01 ', 'pedido': '3'}])
+        with patch('src.api.api_services.settings.PICKLIST_DUMP_FILE', ''):
+            self.assertEqual([r['pedido'] for r in service.iter_picklist()], ['1', '3'])
+
+    def test_varios_depositos_filtran_y_consultan_proubi_por_deposito(self):
+        with patch('src.api.api_services.APIClient'):
+            service = APIService(depositos=('01', '02'))
+        service.api.iter_rym0501.return_value = iter([
+            {'deposito': '01', 'pedido': '1'}, {'deposito': '03', 'pedido': '2'}, {'deposito': '02', 'pedido': '3'}])
+        with patch('src.api.api_services.settings.PICKLIST_DUMP_FILE', ''):
+            self.assertEqual([r['pedido'] for r in service.iter_picklist()], ['1', '3'])
+
+        bodies = []
+
+        def get_proubi(json_body):
+            bodies.append(json_body)
+            return [{'producto': 'A', 'ubicacion': 'U1', 'deposito': '01', 'cantidadTotal': '1'},
+                    {'producto': 'A', 'ubicacion': 'U1', 'deposito': '02', 'cantidadTotal': '2'}]
+        service.api.get_proubi.side_effect = get_proubi
+        picklist = [{'producto': 'A', 'ubicacion': 'U1', 'deposito': '02'},
+                    {'producto': 'A', 'ubicacion': 'U1', 'deposito': '01'}]
+
+        out = service.obtener_productos_ubicacion_batch(picklist, max_workers=1, max_pares_rango=1)
+
+        self.assertEqual(sorted(b['de_deposito'] for b in bodies), ['01', '02'])
+        # Cada línea conserva solo el stock de su depósito
+        self.assertEqual([r['Stock'] for r in out], [2, 1])
+
+
+class TestWatermarkPicklist(unittest.TestCase):
+    def test_body_usa_watermark_o_valor_inicial(self):
+        with patch('src.api.api_services.APIClient'):
+            service = APIService()
+        self.assertEqual(service._build_picklist_body()['referencia_serie'], WATERMARK_INICIAL['serie'])
+        wm = {'serie': '20251230.......', 'folio': '00:00:00.......'}
+        self.assertEqual(service._build_picklist_body(wm),
+                         {'referencia_serie': '20251230.......', 'referencia_folio': '00:00:00.......'})
+
+    def test_watermark_desde_registros_solo_avanza(self):
+        regs = [{'fecha': '20251229'}, {'fecha': '20251230'}, {'fecha': ''}]
+        self.assertEqual(watermark_desde_registros(regs)['serie'], '20251230.......')
+        self.assertIsNone(watermark_desde_registros(regs, {'serie': '20251230.......'}))
+        self.assertIsNone(watermark_desde_registros([{'fecha': 'x'}]))
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.patcher = patch.multiple('src.api.auth.settings', TOKEN_CACHE_FILE=os.path.join(self.dir.name, 'tk.json'),
+                                      TOKEN_BACKGROUND_REFRESH=False, API_TOKEN_URL='http://x/token',
+                                      API_USERNAME='u')
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.dir.cleanup()
+
+    def _manager(self):
+        manager = object.__new__(OAuth2Manager)
+        manager._init()
+        return manager
+
+    def _respuesta_token(self, token):
+        resp = MagicMock()
+        resp.status_code = 200
+        resp.json.return_value = {'access_token': token, 'refresh_token': 'r', 'expires_in': 3600}
+        return resp
+
+    def test_refresco_single_flight_entre_hilos(self):
+        manager = self._manager()
+
+        def post_lento(data):
+            time.sleep(0.05)
+            return self._respuesta_token('t1')
+
+        with patch.object(manager, '_post', side_effect=post_lento) as mock_post:
+            hilos = [threading.Thread(target=manager.get_token) for _ in range(5)]
+            for h in hilos:
+                h.start()
+            for h in hilos:
+                h.join()
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(manager.access_token, 't1')
+
+    def test_margen_de_refresco_no_supera_la_mitad_de_la_vida_del_token(self):
+        manager = self._manager()
+        manager.background_refresh = True
+        manager.refresh_margin = 300
+        manager.access_token = 't1'
+        with patch('src.api.auth.threading.Timer') as timer:
+            manager.expires_at = time.time() + 120  # vive menos que el margen
+            manager._schedule_refresh()
+            self.assertAlmostEqual(timer.call_args.args[0], 60, delta=1)
+
+            manager.expires_at = time.time() + 3600
+            manager._schedule_refresh()
+            self.assertAlmostEqual(timer.call_args.args[0], 3300, delta=1)
+
+    def test_token_se_reutiliza_desde_cache(self):
+        primero = self._manager()
+        with patch.object(primero, '_post', return_value=self._respuesta_token('t1')):
+            primero.get_token()
+
+        segundo = self._manager()
+        with patch.object(segundo, '_post') as mock_post:
+            self.assertEqual(segundo.get_token(), 't1')
+        mock_post.assert_not_called()
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,85 @@
+# tests/test_daemon.py
+
+import argparse
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+from src import daemon
+from config.settings import settings
+
+
+def _args(**extra):
+    valores = {'intervalo': 60.0, 'jitter': 0.0, 'ciclos': 0, 'full_resync': False, 'pipeline': False}
+    valores.update(extra)
+    return argparse.Namespace(**valores)
+
+
+class TestDaemon(unittest.TestCase):
+    def test_siguiente_turno_saltea_los_vencidos(self):
+        self.assertEqual(daemon.siguiente_turno(100.0, 130.0, 60.0), (160.0, 0))
+        # El ciclo duró 150s: los turnos de 160 y 220 ya pasaron
+        self.assertEqual(daemon.siguiente_turno(100.0, 250.0, 60.0), (280.0, 2))
+
+    def test_reutiliza_servicios_entre_ciclos(self):
+        api, ds = MagicMock(), MagicMock()
+        detener = threading.Event()
+        with patch.object(daemon, 'ejecutar_ciclo', return_value=True) as mock_ciclo:
+            ciclos = daemon.ejecutar_daemon(_args(intervalo=1.0, ciclos=2), api, ds, detener)
+
+        self.assertEqual(ciclos, 2)
+        self.assertEqual(mock_ciclo.call_count, 2)
+        self.assertTrue(all(c.args[1] is api and c.args[2] is ds for c in mock_ciclo.call_args_list))
+
+    def test_detener_corta_la_espera(self):
+        detener = threading.Event()
+
+        def ciclo(*_):
+            detener.set()  # p.ej. SIGTERM durante el ciclo
+            return True
+        with patch.object(daemon, 'ejecutar_ciclo', side_effect=ciclo):
+            self.assertEqual(daemon.ejecutar_daemon(_args(intervalo=3600.0), MagicMock(), MagicMock(), detener), 1)
+
+    def test_ciclo_con_error_no_detiene_el_daemon_y_devuelve_la_conexion(self):
+        ds = MagicMock()
+        with patch.object(daemon, 'sincronizar', side_effect=RuntimeError("TOTVS caído")):
+            self.assertFalse(daemon.ejecutar_ciclo(_args(), MagicMock(), ds))
+        ds.conectar_bd.assert_called_once()
+        ds.cerrar_conexion.assert_called_once()
+
+    def test_cada_ciclo_registra_las_conexiones_http(self):
+        api = MagicMock()
+        with patch.object(daemon, 'sincronizar', return_value=True):
+            self.assertTrue(daemon.ejecutar_ciclo(_args(), api, MagicMock()))
+        api.log_conexiones.assert_called_once()
+        api.cerrar.assert_not_called()
+
+    def test_otra_instancia_con_el_bloqueo_omite_el_ciclo(self):
+        ds = MagicMock()
+        ds.adquirir_bloqueo_sync.return_value = False
+        api = MagicMock()
+        self.assertFalse(daemon.sincronizar(_args(), api, ds))
+        api.obtener_picklist.assert_not_called()
+        ds.leer_watermark.assert_not_called()
+
+
+class TestAplicarArgs(unittest.TestCase):
+    def _aplicar(self, *argv):
+        with patch.multiple(settings, DEPOSITOS=('01',), DB_ESCRITORES=1, DB_POOL_SIZE=4, DB_MODO_CARGA='filas'):
+            daemon.aplicar_args(daemon.construir_parser().parse_args(list(argv)))
+            return settings.DB_ESCRITORES, settings.DB_POOL_SIZE
+
+    def test_pool_por_deposito_y_escritor(self):
+        self.assertEqual(self._aplicar('--depositos', '01,02', '--escritores', '3'), (3, 2 * 4 + 1))
+
+    def test_reduce_escritores_si_no_caben_en_el_pool(self):
+        escritores, pool = self._aplicar('--depositos', '01,02,03,04', '--escritores', '8')
+        self.assertEqual(escritores, 6)
+        self.assertLessEqual(pool, 32)
+
+    def test_rechaza_depositos_que_no_caben_en_el_pool(self):
+        with self.assertRaises(ValueError):
+            self._aplicar('--depositos', ','.join(f'{i:02d}' for i in range(16)))
+
+
+if __name__ == '__main__':
+    unittest.main()
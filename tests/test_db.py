@@ -1,8 +1,26 @@
 # tests/test_db.py
 
+import json
+from decimal import Decimal
+import os
+import tempfile
+import threading
 import unittest
 from unittest.mock import patch, MagicMock
-from src.db.operations import insertar_picklist, insertar_picklist_detalle
+from src.db.operations import (
+    insertar_picklist, insertar_picklist_detalle, insertar_picklist_detalle_batch, lotes_por_tamano,
+    producto_ubicacion_id, upsert_productos_ubicacion_batch, resolver_picklist_ids,
+    mapear_ubicacionid_en_picklistdetalle, leer_stock_productos_ubicacion, reconciliar_picklist_detalle,
+    contenido_detalle,
+    filtrar_productos_ubicacion_cambiados,
+)
+from src.services import data_service as data_service_mod
+from src.services.data_service import (
+    DataService, IngestaInterrumpida, CLAVE_WATERMARK_PICKLIST, CLAVE_CHECKPOINT_PICKLIST, clave_checkpoint,
+)
+from src.db import connection
+from src.db.cache import DimensionCache
+from src.db.staging import escribir_tsv
 
 class TestDBOperations(unittest.TestCase):
     @patch('src.db.operations.logger')
@@ -63,6 +81,596 @@ class TestDBOperations(unittest.TestCase):
         mock_cursor.execute.assert_called_once()
         mock_logger.info.assert_called_with("Insertado PickListDetalle con PickListDetalleID: 10")
 
+def _registro(**extra):
+    r = {'cliente': ' 000134 ', 'deposito': '01', 'pedido': '135087', 'nombre': 'AMAZON', 'tienda': '01',
+         'producto': '939-14991 ', 'descripcion': 'MOUNT', 'cantidad_liberada': 15, 'ubicacion': 'a31ndch5 ',
+         'item': '09', 'oc': 'MS-1', 'precio': 135}
+    r.update(extra)
+    return r
+
+
+class TestDataServiceWatermark(unittest.TestCase):
+    def _service(self, depositos=None):
+        service = DataService(depositos=depositos)
+        service.cnx = MagicMock()
+        service.cnx.in_transaction = False
+        service.cursor = MagicMock()
+        service.cursor.lastrowid = 7
+        service.cursor.rowcount = 1
+        service.cursor.fetchall.side_effect = lambda: (
+            [(7, '135087', '01', '000134')] if 'FROM PickList ' in service.cursor.execute.call_args.args[0] else []
+        )
+        return service
+
+    @patch('src.services.data_service.guardar_estado_sync')
+    def test_watermark_se_guarda_antes_del_commit(self, mock_guardar):
+        service = self._service()
+        orden = []
+        mock_guardar.side_effect = lambda *a: orden.append('watermark')
+        service.cnx.commit.side_effect = lambda: orden.append('commit')
+        wm = {'serie': '20251230.......', 'folio': '00:00:00.......'}
+
+        service.insertar_datos([_registro()], watermark=wm)
+
+        mock_guardar.assert_called_once_with(service.cursor, CLAVE_WATERMARK_PICKLIST, wm)
+        self.assertEqual(orden, ['watermark', 'commit'])
+
+    @patch('src.services.data_service.guardar_estado_sync')
+    def test_sin_watermark_no_se_guarda(self, mock_guardar):
+        self._service().insertar_datos([_registro()])
+        mock_guardar.assert_not_called()
+
+    def test_cabeceras_resueltas_por_otra_conexion_no_se_reescriben(self):
+        service = self._service(depositos=('01',))
+        service.cabeceras = {('135087', '01', '000134', '01'): 42}
+
+        service.insertar_datos([_registro()])
+
+        sentencias = [c.args for c in service.cursor.execute.call_args_list]
+        self.assertFalse(any('INSERT INTO PickList (' in sql for sql, *_ in sentencias))
+        detalle = next(args for sql, *args in sentencias if 'INSERT IGNORE INTO PickListDetalle' in sql)
+        self.assertEqual(detalle[0][0], 42)
+
+
+@patch('src.services.data_service.asegurar_tabla_sync_estado', MagicMock())
+@patch.object(data_service_mod.settings, 'DB_CHUNK_GRUPOS', 1)
+class TestIngestaPorTramos(unittest.TestCase):
+    def _service(self, depositos=None):
+        service = TestDataServiceWatermark._service(self, depositos)
+        service.cursor.fetchall.side_effect = lambda: (
+            [(1, '100', '01', '000134'), (2, '200', '01', '000134'), (3, '300', '01', '000134'),
+             (4, '400', '01', '000134')]
+            if 'FROM PickList ' in service.cursor.execute.call_args.args[0] else []
+        )
+        return service
+
+    def _datos(self):
+        return [_registro(pedido=p) for p in ('300', '100', '200')]
+
+    def _detalles_escritos(self, service):
+        return [c.args[1][0] for c in service.cursor.execute.call_args_list
+                if 'INSERT IGNORE INTO PickListDetalle' in c.args[0]]
+
+    @patch('src.services.data_service.borrar_estado_sync')
+    @patch('src.services.data_service.guardar_estado_sync')
+    @patch('src.services.data_service.leer_estado_sync', return_value=None)
+    def test_commit_por_tramo_con_checkpoint(self, _leer, mock_guardar, mock_borrar):
+        service = self._service()
+        wm = {'serie': '20251230.......', 'folio': '00:00:00.......'}
+
+        resumen = service.insertar_datos(self._datos(), watermark=wm)
+
+        self.assertEqual(resumen['grupos'], 3)
+        self.assertEqual(service.cnx.commit.call_count, 3)  # un commit por tramo
+        self.assertEqual(self._detalles_escritos(service), [1, 2, 3])  # orden determinístico
+        checkpoints = [c.args[2] for c in mock_guardar.call_args_list if c.args[1] == CLAVE_CHECKPOINT_PICKLIST]
+        self.assertEqual([c['ultima'][0] for c in checkpoints], ['100', '200'])  # último pedido confirmado
+        mock_guardar.assert_called_with(service.cursor, CLAVE_WATERMARK_PICKLIST, wm)
+        mock_borrar.assert_called_once_with(service.cursor, CLAVE_CHECKPOINT_PICKLIST)
+
+    @patch('src.services.data_service.borrar_estado_sync')
+    @patch('src.services.data_service.guardar_estado_sync')
+    @patch('src.services.data_service.leer_estado_sync')
+    def test_reanuda_despues_de_la_ultima_clave_confirmada(self, mock_leer, mock_guardar, _borrar):
+        mock_leer.return_value = None
+        self._service().insertar_datos(self._datos())
+        checkpoint = mock_guardar.call_args_list[1].args[2]  # confirmados 100 y 200
+
+        def escritos(datos, guardado=checkpoint):
+            mock_leer.return_value = guardado
+            service = self._service()
+            service.insertar_datos(datos)
+            return self._detalles_escritos(service)
+
+        self.assertEqual(escritos(self._datos()), [3])
+        # Grupos nuevos o cambiados después de la marca no impiden reanudar
+        self.assertEqual(escritos(self._datos() + [_registro(pedido='400')]), [3, 4])
+        self.assertEqual(escritos(self._datos()[1:] + [_registro(pedido='300', cantidad_liberada=99)]), [3])
+        # Un grupo ya confirmado que cambió, o un checkpoint de otro modo de carga: desde cero
+        datos = self._datos()
+        self.assertEqual(escritos([datos[0], datos[2], _registro(pedido='100', cantidad_liberada=99)]), [1, 2, 3])
+        self.assertEqual(escritos(self._datos(), dict(checkpoint, modo='bulk')), [1, 2, 3])
+
+    @patch('src.services.data_service.borrar_estado_sync')
+    @patch('src.services.data_service.guardar_estado_sync')
+    @patch('src.services.data_service.leer_estado_sync', return_value=None)
+    def test_checkpoint_por_deposito(self, mock_leer, mock_guardar, mock_borrar):
+        service = self._service(depositos=('01',))
+        service.insertar_datos(self._datos())
+
+        clave = clave_checkpoint(('01',))
+        self.assertEqual(clave, 'picklist_checkpoint:01')
+        mock_leer.assert_called_once_with(service.cursor, clave)
+        self.assertEqual(len([c for c in mock_guardar.call_args_list if c.args[1] == clave]), 2)
+        self.assertFalse(any(c.args[1] == CLAVE_CHECKPOINT_PICKLIST for c in mock_guardar.call_args_list))
+        mock_borrar.assert_called_once_with(service.cursor, clave)
+
+    @patch('src.services.data_service.borrar_estado_sync')
+    @patch('src.services.data_service.guardar_estado_sync')
+    @patch('src.services.data_service.leer_estado_sync', return_value=None)
+    def test_detener_termina_el_tramo_en_curso(self, _leer, mock_guardar, mock_borrar):
+        service = self._service()
+        service.detener = threading.Event()
+        service.detener.set()
+
+        with self.assertRaises(IngestaInterrumpida):
+            service.insertar_datos(self._datos(), watermark={'serie': 'S'})
+
+        self.assertEqual(self._detalles_escritos(service), [1])
+        service.cnx.rollback.assert_not_called()
+        checkpoints = [c.args[2]['ultima'][0] for c in mock_guardar.call_args_list
+                       if c.args[1] == CLAVE_CHECKPOINT_PICKLIST]
+        self.assertEqual(checkpoints, ['100'])
+        self.assertFalse(any(c.args[1] == CLAVE_WATERMARK_PICKLIST for c in mock_guardar.call_args_list))
+        mock_borrar.assert_not_called()
+
+
+@patch('src.services.data_service.guardar_estado_sync')
+@patch.object(data_service_mod.settings, 'DB_POOL_SIZE', 4)
+class TestEscritoresParalelos(unittest.TestCase):
+    def test_detalles_repartidos_por_pedido_entre_escritores(self, mock_guardar):
+        service = DataService(modo_carga='filas', escritores=3)
+        service.cnx = MagicMock(in_transaction=False)
+        service.cursor = MagicMock(rowcount=1)
+        service._max_bytes = 1 << 20
+        pedidos = ['100', '200', '300', '400']
+        service.cursor.fetchall.side_effect = lambda: (
+            [(i + 1, p, '01', '000134') for i, p in enumerate(pedidos)]
+            if 'FROM PickList ' in service.cursor.execute.call_args.args[0] else []
+        )
+        escritores = []
+
+        def conectar(self_):
+            self_.cnx = MagicMock(in_transaction=False)
+            self_.cursor = MagicMock(rowcount=1)
+            self_.cursor.fetchall.return_value = []
+            self_._max_bytes = 1 << 20
+            escritores.append((self_.cnx, self_.cursor))
+
+        # Las dos tiendas de un pedido comparten PickList: cada una con su Item
+        datos = [_registro(pedido=p, tienda=t, item=t) for p in pedidos for t in ('01', '02')]
+        with patch.object(DataService, 'conectar_bd', conectar):
+            resumen = service.insertar_datos(datos, watermark={'serie': 'S'}, mapear=False)
+
+        self.assertEqual(resumen['grupos'], 8)
+        self.assertEqual(resumen['detalles'], 8)
+        self.assertGreater(len(escritores), 1)
+        # Un INSERT por escritor (rowcount simulado = 1)
+        self.assertEqual(resumen['insertados'], len(escritores))
+        # Catálogos y cabeceras solo por la conexión principal
+        sqls = [c.args[0] for c in service.cursor.execute.call_args_list]
+        self.assertFalse(any('INTO PickListDetalle' in q for q in sqls))
+        pedidos_por_escritor = []
+        for cnx, cursor in escritores:
+            sqls = [c.args[0] for c in cursor.execute.call_args_list]
+            self.assertFalse(any('INTO PickList ' in q or 'INTO Productos' in q for q in sqls))
+            pedidos_por_escritor.append({pid for c in cursor.execute.call_args_list
+                                         if 'INSERT IGNORE INTO PickListDetalle' in c.args[0]
+                                         for pid in c.args[1][0::10]})
+            cnx.commit.assert_called_once()
+            cnx.close.assert_called_once()
+        # Cada PickList (y sus dos tiendas) en un solo escritor
+        self.assertEqual(sorted(i for ids in pedidos_por_escritor for i in ids), [1, 2, 3, 4])
+        mock_guardar.assert_called_once_with(service.cursor, 'rym0501_watermark', {'serie': 'S'})
+        self.assertEqual(service._alcance_mapeo['picklist_ids'], {1, 2, 3, 4})
+
+    @patch.object(data_service_mod.settings, 'DB_CHUNK_GRUPOS', 1)
+    def test_detener_corta_a_los_escritores_tras_su_tramo(self, mock_guardar):
+        service = DataService(modo_carga='filas', escritores=2)
+        service.cnx = MagicMock(in_transaction=False)
+        service.cursor = MagicMock(rowcount=1)
+        service._max_bytes = 1 << 20
+        pedidos = [str(100 + i) for i in range(6)]
+        service.cursor.fetchall.side_effect = lambda: (
+            [(i + 1, p, '01', '000134') for i, p in enumerate(pedidos)]
+            if 'FROM PickList ' in service.cursor.execute.call_args.args[0] else []
+        )
+        service.detener = threading.Event()
+        service.detener.set()
+        conexiones = []
+
+        def conectar(self_):
+            self_.cnx = MagicMock(in_transaction=False)
+            self_.cursor = MagicMock(rowcount=1)
+            self_.cursor.fetchall.return_value = []
+            self_._max_bytes = 1 << 20
+            conexiones.append(self_.cnx)
+
+        with patch.object(DataService, 'conectar_bd', conectar):
+            with self.assertRaises(IngestaInterrumpida):
+                service.insertar_datos([_registro(pedido=p) for p in pedidos], watermark={'serie': 'S'})
+
+        self.assertTrue(conexiones)
+        self.assertTrue(all(cnx.commit.call_count == 1 for cnx in conexiones))
+        self.assertFalse(any(c.args[1] == CLAVE_WATERMARK_PICKLIST for c in mock_guardar.call_args_list))
+
+
+@patch('src.services.data_service.asegurar_tabla_sync_estado', MagicMock())
+class TestProductosDesdeDetalle(unittest.TestCase):
+    def _service(self, maximo):
+        service = DataService()
+        service.cnx = MagicMock(in_transaction=False)
+        service.cursor = MagicMock(rowcount=1)
+        service.cursor.fetchone.return_value = (maximo,)
+        service.cursor.fetchall.return_value = [('P2',), ('P1',)]
+        service._max_bytes = 4 * 1024 * 1024
+        return service
+
+    @patch.object(data_service_mod.settings, 'PRODUCTOS_VENTANA_DETALLE', 0)
+    @patch('src.services.data_service.guardar_estado_sync')
+    @patch('src.services.data_service.leer_estado_sync', return_value={'detalle_id': 100})
+    def test_revisa_solo_detalles_posteriores_a_la_marca(self, _leer, mock_guardar):
+        service = self._service(150)
+        service.cursor.rowcount = 2
+
+        self.assertEqual(service.asegurar_productos_desde_picklist(), 2)
+
+        sql, args = service.cursor.execute.call_args_list[1].args
+        self.assertIn('p.ProductoID = d.ProductoID', sql)
+        self.assertEqual(args, (100, 150))
+        insercion = service.cursor.execute.call_args_list[2].args
+        self.assertTrue(insercion[0].startswith('INSERT INTO Productos'))
+        self.assertEqual(insercion[1], ('P1', 'P1', 'P2', 'P2'))
+        mock_guardar.assert_called_once_with(service.cursor, 'productos_desde_detalle_hwm', {'detalle_id': 150})
+
+    @patch.object(data_service_mod.settings, 'PRODUCTOS_VENTANA_DETALLE', 0)
+    @patch('src.services.data_service.guardar_estado_sync')
+    @patch('src.services.data_service.leer_estado_sync', return_value={'detalle_id': 150})
+    def test_sin_detalles_nuevos_no_consulta(self, _leer, mock_guardar):
+        service = self._service(150)
+        self.assertEqual(service.asegurar_productos_desde_picklist(), 0)
+        self.assertEqual(service.cursor.execute.call_count, 1)
+        mock_guardar.assert_not_called()
+
+    @patch.object(data_service_mod.settings, 'PRODUCTOS_VENTANA_DETALLE', 30)
+    @patch('src.services.data_service.guardar_estado_sync')
+    @patch('src.services.data_service.leer_estado_sync', return_value={'detalle_id': 150})
+    def test_revisa_la_ventana_bajo_la_marca_sin_moverla(self, _leer, mock_guardar):
+        # Un ID < 150 que se confirmó después de mover la marca todavía se revisa
+        service = self._service(150)
+        service.cursor.rowcount = 2
+
+        self.assertEqual(service.asegurar_productos_desde_picklist(), 2)
+
+        self.assertEqual(service.cursor.execute.call_args_list[1].args[1], (120, 150))
+        mock_guardar.assert_not_called()
+
+
+class TestCargaBulk(unittest.TestCase):
+    def test_tsv_escapa_separadores_y_nulos(self):
+        fd, ruta = tempfile.mkstemp(suffix='.tsv')
+        os.close(fd)
+        try:
+            escribir_tsv(ruta, [('a\tb', None, 'c\\d\n', 1.5)])
+            with open(ruta, encoding='utf-8') as f:
+                self.assertEqual(f.read(), 'a\\tb\t\\N\tc\\\\d\\n\t1.5\n')
+        finally:
+            os.remove(ruta)
+
+    @patch('src.services.data_service.cargar_tsv')
+    def test_modo_bulk_carga_staging_y_fusiona(self, mock_cargar):
+        service = DataService(modo_carga='bulk')
+        service.cnx = MagicMock(in_transaction=False)
+        service.cursor = MagicMock(rowcount=1)
+        service.cursor.fetchone.return_value = (2,)
+        service.cursor.fetchall.return_value = [(7,)]
+        filas = []
+        mock_cargar.side_effect = lambda cursor, tabla, columnas, gen: filas.extend(gen) or len(filas)
+
+        resumen = service.insertar_datos([_registro(), _registro(item='10', producto='P2')], mapear=False)
+
+        self.assertEqual(mock_cargar.call_args.args[1], 'stg_picklist')
+        self.assertEqual([f[4] for f in filas], ['939-14991', 'P2'])
+        self.assertEqual(filas[0][7], 'A31NDCH5')
+        sqls = [c.args[0] for c in service.cursor.execute.call_args_list]
+        self.assertTrue(any('INSERT IGNORE INTO PickListDetalle' in q and 'stg_picklist' in q for q in sqls))
+        self.assertTrue(any(q.lstrip().startswith('UPDATE') and 'stg_picklist' in q for q in sqls))
+        self.assertEqual(resumen, {'grupos': 1, 'detalles': 2, 'insertados': 1, 'actualizados': 1, 'omitidos': 0})
+        self.assertEqual(service._alcance_mapeo['picklist_ids'], {7})
+        service.cnx.commit.assert_called_once()
+
+    def test_modo_json_envia_un_documento_por_tramo(self):
+        service = DataService(modo_carga='json')
+        service.cnx = MagicMock(in_transaction=False)
+        service.cursor = MagicMock(rowcount=2)
+        service.cursor.fetchone.return_value = (2,)
+        service.cursor.fetchall.return_value = [(7,)]
+        service._max_bytes = 4 * 1024 * 1024
+
+        service.insertar_datos([_registro(), _registro(item='10', producto='P2')])
+
+        cargas = [c.args for c in service.cursor.execute.call_args_list if 'JSON_TABLE' in c.args[0]]
+        self.assertEqual(len(cargas), 1)
+        self.assertTrue(cargas[0][0].startswith('INSERT INTO stg_picklist'))
+        documento = json.loads(cargas[0][1][0])
+        self.assertEqual([fila[4] for fila in documento], ['939-14991', 'P2'])
+
+    def test_modo_desconocido(self):
+        with self.assertRaises(ValueError):
+            DataService(modo_carga='csv')
+
+
+class TestInsercionPorLotes(unittest.TestCase):
+    def test_lotes_respetan_filas_y_bytes(self):
+        filas = [('x' * 100,)] * 10
+        self.assertEqual([len(l) for l in lotes_por_tamano(filas, tamano_lote=4)], [4, 4, 2])
+        # ~108 bytes por fila y límite mínimo de 1024 * 0.9 -> lotes más chicos que tamano_lote
+        self.assertTrue(all(len(l) <= 9 for l in lotes_por_tamano(filas * 3, tamano_lote=500, max_bytes=1024)))
+
+    def test_tamano_en_bytes_utf8_con_escapes(self):
+        filas = [('ñandú ÓPTICO ' * 10 + "o'brien",)] * 30
+        for lote in lotes_por_tamano(filas, tamano_lote=500, max_bytes=2048):
+            sql_valores = ", ".join("('" + a.replace("'", "\\'") + "')" for (a,) in lote)
+            self.assertLessEqual(len(sql_valores.encode('utf-8')), 2048 * 0.9)
+
+    def test_detalle_batch_cuenta_insertados_y_omitidos(self):
+        cursor = MagicMock()
+        rowcounts = iter([2, 1])
+
+        def execute(sql, args):
+            cursor.rowcount = next(rowcounts)
+        cursor.execute.side_effect = execute
+        detalles = [(1, {'producto': f'P{i} ', 'ubicacion': 'a1', 'item': i, 'cantidad_liberada': 1.0})
+                    for i in range(5)]
+
+        self.assertEqual(insertar_picklist_detalle_batch(cursor, detalles, tamano_lote=3), (3, 2))
+        self.assertEqual(cursor.execute.call_count, 2)
+        sql, args = cursor.execute.call_args_list[0].args
+        self.assertTrue(sql.strip().startswith('INSERT IGNORE INTO PickListDetalle'))
+        self.assertEqual(len(args), 3 * 10)
+        self.assertEqual(args[1], 'P0')
+        self.assertEqual(args[3], 'A1')
+
+    def test_reconciliacion_escribe_solo_nuevos_y_cambiados(self):
+        cursor = MagicMock(rowcount=1)
+        igual = {'producto': 'P1', 'ubicacion': 'A1', 'item': '01', 'cantidad_liberada': 2, 'precio': 10.5}
+        cambiado = {'producto': 'P2', 'ubicacion': 'B1', 'item': '02', 'cantidad_liberada': 3, 'precio': 1}
+        nuevo = {'producto': 'P3', 'ubicacion': 'C1', 'item': '03', 'cantidad_liberada': 1, 'precio': 1}
+        # Columnas como las devuelve MySQL (DECIMAL -> Decimal)
+        cursor.fetchall.return_value = [(7, '01', 'P1', Decimal('2.00'), 'A1', Decimal('10.50'), ''),
+                                        (7, '02', 'p2', Decimal('3.00'), 'A9', Decimal('1.00'), '')]
+
+        res = reconciliar_picklist_detalle(cursor, [(7, igual), (7, cambiado), (7, nuevo), (7, dict(nuevo))])
+
+        self.assertEqual(res, {'insertados': 1, 'actualizados': 1, 'omitidos': 2})
+        select, insercion, cambio = [c.args for c in cursor.execute.call_args_list]
+        self.assertIn('FROM PickListDetalle', select[0])
+        self.assertEqual(select[1], (7,))
+        self.assertTrue(insercion[0].strip().startswith('INSERT IGNORE INTO PickListDetalle'))
+        self.assertEqual(insercion[1][1], 'P3')
+        self.assertIn('ON DUPLICATE KEY UPDATE', cambio[0])
+        # UbicacionID se limpia antes de pisar UbicacionTotvs
+        self.assertLess(cambio[0].index('UbicacionID       ='), cambio[0].index('UbicacionTotvs    ='))
+        self.assertEqual(cambio[1][1], 'P2')
+
+    def test_reconciliacion_compara_por_valor_sin_asumir_la_escala(self):
+        cursor = MagicMock(rowcount=0)
+        detalles = [(7, {'producto': 'P1', 'ubicacion': 'A1', 'item': '01', 'cantidad_liberada': 2.5, 'precio': 0.125}),
+                    (7, {'producto': 'P2', 'ubicacion': 'A1', 'item': '02', 'cantidad_liberada': 1, 'precio': 3})]
+        # Columnas con otra escala: DECIMAL(14,3) y un entero
+        cursor.fetchall.return_value = [(7, '01', 'P1', Decimal('2.500'), 'A1', Decimal('0.125'), None),
+                                        (7, '02', 'P2', 1, 'A1', Decimal('3.001'), None)]
+
+        res = reconciliar_picklist_detalle(cursor, detalles)
+
+        self.assertEqual(res, {'insertados': 0, 'actualizados': 1, 'omitidos': 1})
+        self.assertEqual(cursor.execute.call_args.args[1][1], 'P2')
+        self.assertEqual(contenido_detalle('2', 'A1', 1.5, None), contenido_detalle(Decimal('2.000'), 'A1', '1.50', ''))
+
+    def test_cabeceras_en_un_insert_y_un_select(self):
+        cursor = MagicMock()
+        cursor.rowcount = 1
+        cursor.fetchall.return_value = [(10, '100 ', 'T1', 'C1'), (11, '200', 'T2', 'C2'), (12, '200', 'T3', 'C2')]
+        headers = {
+            ('200', 'T3', 'C2', '01'): {'pedido': '200', 'tienda': 'T3', 'cliente': 'C2', 'nombre': 'N'},
+            ('100', 'T1', 'C1', '01'): {'pedido': '100', 'tienda': 'T1', 'cliente': 'C1', 'nombre': 'N'},
+            ('200', 'T9', 'C2', '01'): {'pedido': '200', 'tienda': 'T9', 'cliente': 'C2', 'nombre': 'N'},
+        }
+
+        ids = resolver_picklist_ids(cursor, headers)
+
+        self.assertEqual(cursor.execute.call_count, 2)
+        sql, args = cursor.execute.call_args_list[0].args
+        self.assertEqual(sql.count('NOW()'), 3)
+        self.assertEqual(args[1], '100')  # cabeceras ordenadas por pedido
+        self.assertEqual(ids, {('100', 'T1', 'C1', '01'): 10, ('200', 'T3', 'C2', '01'): 12,
+                               ('200', 'T9', 'C2', '01'): 11})
+
+
+class TestUpsertProductosUbicacion(unittest.TestCase):
+    def test_id_deterministico(self):
+        self.assertEqual(producto_ubicacion_id('P1', 'A1'), producto_ubicacion_id(' P1 ', 'A1 '))
+        self.assertNotEqual(producto_ubicacion_id('P1', 'A1'), producto_ubicacion_id('P1', 'A2'))
+
+    def test_upsert_no_reescribe_el_id_de_filas_existentes(self):
+        cursor = MagicMock(rowcount=0)
+        cursor.fetchone.return_value = (1,)
+        upsert_productos_ubicacion_batch(cursor, [{'ProductoID': 'P1', 'UbicacionID': 'A1', 'Stock': 5}])
+        actualizacion = cursor.execute.call_args.args[0].split('ON DUPLICATE KEY UPDATE')[1]
+        self.assertNotIn('ProductoUbicacionID', actualizacion)
+        # El vínculo con PickListDetalle usa el ID guardado, no uno recalculado
+        mapear_ubicacionid_en_picklistdetalle(cursor)
+        self.assertIn('SET d.UbicacionID = pu.ProductoUbicacionID', cursor.execute.call_args.args[0])
+
+    def test_upsert_por_lotes_cuenta_insertados_actualizados_sin_cambios(self):
+        cursor = MagicMock()
+        # Lote de 3 pares: 1 ya existía -> rowcount 2 nuevos + 2 (el existente cambió de Stock)
+        cursor.fetchone.return_value = (1,)
+        cursor.rowcount = 4
+        registros = [
+            {'ProductoID': 'P1', 'UbicacionID': 'A1', 'Stock': 5},
+            {'ProductoID': 'P2', 'UbicacionID': 'A1', 'Stock': 1},
+            {'ProductoID': 'P3', 'UbicacionID': 'B2', 'Stock': 0},
+            {'ProductoID': 'P1', 'UbicacionID': 'A1', 'Stock': 7},  # duplicado: gana el último
+        ]
+
+        resumen = upsert_productos_ubicacion_batch(cursor, registros)
+
+        self.assertEqual(resumen, {'insertados': 2, 'actualizados': 1, 'sin_cambios': 0})
+        sql, args = cursor.execute.call_args_list[-1].args
+        self.assertIn('ON DUPLICATE KEY UPDATE', sql)
+        self.assertEqual(len(args), 3 * 5)
+        self.assertEqual(args[:5], (producto_ubicacion_id('P1', 'A1'), 'P1', 'A1', '', 7))
+
+    def test_sin_cambios_no_cuenta_como_actualizado(self):
+        cursor = MagicMock()
+        cursor.fetchone.return_value = (2,)
+        cursor.rowcount = 0
+        registros = [{'ProductoID': 'P1', 'UbicacionID': 'A1'}, {'ProductoID': 'P2', 'UbicacionID': 'A1'}]
+        self.assertEqual(upsert_productos_ubicacion_batch(cursor, registros),
+                         {'insertados': 0, 'actualizados': 0, 'sin_cambios': 2})
+
+    def test_solo_cambios_descarta_pares_con_el_mismo_stock(self):
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [('P1', 'a1', 5), ('P2', 'A1', 1)]
+        foto = leer_stock_productos_ubicacion(cursor, {'P1', ' P2', None})
+        self.assertEqual(foto, {('P1', 'A1'): 5, ('P2', 'A1'): 1})
+        self.assertEqual(cursor.execute.call_args.args[1], ('P1', 'P2'))
+
+        registros = [
+            {'ProductoID': 'P1', 'UbicacionID': 'A1 ', 'Stock': 5},
+            {'ProductoID': 'P2', 'UbicacionID': 'A1', 'Stock': 3},
+            {'ProductoID': 'P3', 'UbicacionID': 'B2', 'Stock': 0},
+        ]
+        cambiados, sin_cambios = filtrar_productos_ubicacion_cambiados(registros, foto)
+        self.assertEqual([r['ProductoID'] for r in cambiados], ['P2', 'P3'])
+        self.assertEqual(sin_cambios, 1)
+
+    @patch('src.services.data_service.settings')
+    def test_data_service_escribe_solo_los_cambios(self, mock_settings):
+        mock_settings.PU_SOLO_CAMBIOS = True
+        mock_settings.PU_UPSERT_POR_LOTES = True
+        service = DataService(modo_carga='filas')
+        service.cnx = MagicMock(in_transaction=True)
+        service.cursor = MagicMock()
+        service.cursor.fetchall.return_value = [('P1', 'A1', 5)]
+        service.cursor.fetchone.return_value = (0,)
+        service.cursor.rowcount = 1
+        service._max_bytes = 1 << 20
+
+        resumen = service.insertar_productos_ubicacion(
+            [{'ProductoID': 'P1', 'UbicacionID': 'A1', 'Stock': 5},
+             {'ProductoID': 'P2', 'UbicacionID': 'A1', 'Stock': 2}], mapear=False)
+
+        self.assertEqual(resumen['omitidos'], 1)
+        self.assertEqual(resumen['insertados'], 1)
+        self.assertEqual(service._alcance_mapeo['productos'], {'P2'})
+
+
+class TestPoolConexiones(unittest.TestCase):
+    @patch('src.db.connection.time.sleep')
+    @patch('src.db.connection.obtener_pool')
+    def test_espera_conexion_libre_y_hace_ping(self, mock_pool, _sleep):
+        cnx = MagicMock()
+        mock_pool.return_value.get_connection.side_effect = [connection.pooling.PoolError("agotado"), cnx]
+
+        self.assertIs(connection.get_db_connection(), cnx)
+        cnx.ping.assert_called_once()
+        self.assertTrue(cnx.ping.call_args.kwargs['reconnect'])
+
+    @patch('src.db.connection.obtener_pool')
+    def test_contexto_hace_rollback_y_devuelve_la_conexion(self, mock_pool):
+        cnx = MagicMock(in_transaction=True)
+        mock_pool.return_value.get_connection.return_value = cnx
+
+        with self.assertRaises(RuntimeError):
+            with connection.conexion():
+                raise RuntimeError("falla")
+        cnx.rollback.assert_called_once()
+        cnx.close.assert_called_once()
+
+
+class TestMapeoUbicaciones(unittest.TestCase):
+    def test_join_sin_funciones_y_acotado_a_la_corrida(self):
+        cursor = MagicMock()
+        cursor.rowcount = 2
+
+        filas = mapear_ubicacionid_en_picklistdetalle(cursor, picklist_ids={3, 1, 2}, productos={'P1'},
+                                                      tamano_lote=2)
+
+        self.assertEqual(filas, 6)
+        self.assertEqual(cursor.execute.call_count, 3)
+        sql, args = cursor.execute.call_args_list[0].args
+        self.assertIn('pu.UbicacionID = d.UbicacionTotvs', sql)
+        self.assertNotIn('TRIM(pu', sql)
+        self.assertIn('d.PickListID IN (%s, %s)', sql)
+        self.assertEqual(args, (1, 2))
+        self.assertEqual(cursor.execute.call_args_list[2].args[1], ('P1',))
+
+    def test_alcance_vacio_no_recorre_la_tabla(self):
+        cursor = MagicMock()
+        self.assertEqual(mapear_ubicacionid_en_picklistdetalle(cursor, picklist_ids=set()), 0)
+        cursor.execute.assert_not_called()
+
+    def test_ubicacion_normalizada_al_escribir(self):
+        cursor = MagicMock()
+        cursor.fetchone.return_value = (0,)
+        cursor.rowcount = 1
+        upsert_productos_ubicacion_batch(cursor, [{'ProductoID': 'P1 ', 'UbicacionID': ' a31ndch5 '}])
+        args = cursor.execute.call_args.args[1]
+        self.assertEqual(args[1:3], ('P1', 'A31NDCH5'))
+        self.assertEqual(args[0], producto_ubicacion_id('P1', 'a31ndch5'))
+
+
+class TestDimensionCache(unittest.TestCase):
+    def _cursor(self):
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [[('P1',)], [('C1 ',)], [('C1', 'T1')]]
+        cursor.rowcount = 1
+        return cursor
+
+    def test_solo_inserta_faltantes_una_sentencia_por_tabla(self):
+        cursor = self._cursor()
+        cache = DimensionCache()
+
+        cache.asegurar(cursor, {'P1': '', 'P2': 'Desc'}, {'C1', 'C2'}, {('C1', 'T1'), ('C2', 'T9')})
+
+        sqls = [c.args[0] for c in cursor.execute.call_args_list]
+        self.assertEqual(len(sqls), 6)  # 3 SELECT de carga + 1 INSERT por tabla
+        self.assertTrue(sqls[3].startswith('INSERT INTO Productos'))
+        self.assertEqual(cursor.execute.call_args_list[3].args[1], ('P2', 'Desc'))
+        self.assertIn('NOT EXISTS', sqls[4])
+        self.assertEqual(cursor.execute.call_args_list[5].args[1], ('C2', 'T9', 'T9'))
+        self.assertEqual((cache.aciertos, cache.fallos), (3, 3))
+
+        # Las claves pendientes no se vuelven a insertar en la misma transacción
+        cache.asegurar(cursor, {'P2': 'Desc'}, {'C2'}, {('C2', 'T9')})
+        self.assertEqual(cursor.execute.call_count, 6)
+
+    def test_descartar_tras_rollback_vuelve_a_insertar(self):
+        cursor = self._cursor()
+        cache = DimensionCache()
+        cache.asegurar(cursor, {'P2': ''}, set(), set())
+        cache.descartar()
+        cache.asegurar(cursor, {'P2': ''}, set(), set())
+        self.assertEqual(cursor.execute.call_count, 5)
+
+        cache.confirmar()
+        cache.asegurar(cursor, {'P2': ''}, set(), set())
+        self.assertEqual(cursor.execute.call_count, 5)
+        self.assertIn('P2', cache.productos)
+
+
 if __name__ == '__main__':
     unittest.main()
 
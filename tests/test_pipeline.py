@@ -0,0 +1,159 @@
+# tests/test_pipeline.py
+
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+import json
+from src.services.pipeline import ejecutar_pipeline
+from api.api_services import APIService
+from services.data_service import IngestaInterrumpida
+from utils.json_stream import ArregloJSONIncompleto, iter_json_array
+from src.services import depositos as depositos_mod
+from src.services.depositos import dividir_por_deposito, sincronizar_depositos
+
+
+def _registro(i, fecha='20251230'):
+    return {'pedido': str(100 + i), 'producto': f'P{i % 2}', 'ubicacion': 'A1', 'fecha': fecha}
+
+
+class TestPipeline(unittest.TestCase):
+    def _api(self, registros):
+        api = MagicMock()
+        api.iter_picklist.side_effect = lambda wm: iter(registros)
+        api.obtener_productos_ubicacion_batch.side_effect = lambda regs: [
+            {'ProductoID': r['producto'], 'UbicacionID': r['ubicacion'], 'Stock': 1} for r in regs
+        ]
+        return api
+
+    @patch('src.services.pipeline.settings')
+    def test_escribe_por_tramos_y_avanza_watermark_al_final(self, mock_settings):
+        mock_settings.RYM0501_STREAMING = True
+        registros = [_registro(i) for i in range(4)] + [_registro(4, fecha='20251231')]
+        api = self._api(registros)
+        ds = MagicMock()
+        orden = []
+        ds.insertar_datos.side_effect = lambda tramo, mapear: orden.append(('datos', len(tramo)))
+        ds.guardar_watermark.side_effect = lambda wm: orden.append(('watermark', wm['serie']))
+
+        resumen = ejecutar_pipeline(api, ds, {'serie': '20251201.......', 'folio': '00:00:00.......'},
+                                    tamano_tramo=2, tamano_cola=1)
+
+        self.assertEqual(orden, [('datos', 2), ('datos', 2), ('datos', 1), ('watermark', '20251231.......')])
+        self.assertEqual(resumen['tramos'], 3)
+        self.assertEqual(resumen['registros'], 5)
+        # Los pares (P0, A1) y (P1, A1) se consultan una sola vez
+        self.assertEqual(resumen['productos_ubicacion'], 2)
+        ds.insertar_datos.assert_called_with(registros[4:], mapear=False)
+        self.assertEqual(ds.mapear_ubicaciones.call_count, 3)
+
+    @patch('src.services.pipeline.settings')
+    def test_error_en_una_etapa_no_mueve_el_watermark(self, mock_settings):
+        mock_settings.RYM0501_STREAMING = True
+        api = self._api([_registro(i) for i in range(4)])
+        api.obtener_productos_ubicacion_batch.side_effect = RuntimeError("PROUBI caído")
+        ds = MagicMock()
+
+        with self.assertRaises(RuntimeError):
+            ejecutar_pipeline(api, ds, None, tamano_tramo=2, tamano_cola=1)
+        ds.insertar_datos.assert_not_called()
+        ds.guardar_watermark.assert_not_called()
+
+    @patch('src.services.pipeline.settings')
+    def test_respuesta_cortada_no_mueve_el_watermark(self, mock_settings):
+        mock_settings.RYM0501_STREAMING = True
+        with patch('api.api_services.APIClient'):
+            api = APIService(depositos=('01',))
+        texto = json.dumps([dict(_registro(i), deposito='01') for i in range(31)])
+        corte = texto.index('{"pedido": "120"')
+        api.api.iter_rym0501.side_effect = lambda json_body: iter_json_array([texto[:corte + 10]])
+        api.obtener_productos_ubicacion_batch = MagicMock(return_value=[])
+        ds = MagicMock()
+
+        with patch('api.api_services.settings.PICKLIST_DUMP_FILE', ''):
+            with self.assertRaises(ArregloJSONIncompleto):
+                ejecutar_pipeline(api, ds, None, tamano_tramo=10, tamano_cola=1)
+            # Modo por lotes: tampoco se escribe un PickList parcial
+            with patch('api.api_services.settings.RYM0501_STREAMING', True):
+                with self.assertRaises(ArregloJSONIncompleto):
+                    api.obtener_picklist(None)
+        self.assertLessEqual(sum(len(c.args[0]) for c in ds.insertar_datos.call_args_list), 20)
+        ds.guardar_watermark.assert_not_called()
+
+    @patch('src.services.pipeline.settings')
+    def test_detener_termina_el_tramo_en_curso(self, mock_settings):
+        mock_settings.RYM0501_STREAMING = True
+        api = self._api([_registro(i) for i in range(6)])
+        ds = MagicMock()
+        detener = threading.Event()
+        detener.set()
+
+        with self.assertRaises(IngestaInterrumpida):
+            ejecutar_pipeline(api, ds, None, tamano_tramo=2, tamano_cola=1, detener=detener)
+        self.assertEqual(ds.insertar_datos.call_count, 1)
+        ds.guardar_watermark.assert_not_called()
+
+
+class TestDepositos(unittest.TestCase):
+    def test_divide_una_descarga_por_deposito(self):
+        registros = [{'deposito': '01', 'pedido': '1'}, {'deposito': ' 02', 'pedido': '2'},
+                     {'deposito': '03', 'pedido': '3'}]
+        self.assertEqual({d: [r['pedido'] for r in regs] for d, regs in dividir_por_deposito(registros, ('01', '02')).items()},
+                         {'01': ['1'], '02': ['2']})
+
+    def test_un_proceso_por_deposito_con_su_lista_permitida(self):
+        api = MagicMock()
+
+        def proubi(regs, metricas):
+            metricas['llamadas'] = len(regs)
+            return [{'ProductoID': 'P'}] * len(regs)
+
+        api.obtener_productos_ubicacion_batch.side_effect = proubi
+        principal = MagicMock()
+        principal.asegurar_cabeceras.return_value = {('1', 'T', 'C', '01'): 10, ('1', 'T', 'C', '02'): 10,
+                                                     ('2', 'T', 'C', '02'): 11}
+        creados = []
+
+        def data_service(cache, depositos):
+            ds = MagicMock(depositos=depositos)
+            ds.insertar_datos.return_value = {'grupos': 1, 'insertados': 2, 'actualizados': 0, 'omitidos': 0}
+            ds.mapear_ubicaciones.return_value = 2
+            creados.append(ds)
+            return ds
+
+        registros = [{'deposito': '01'}, {'deposito': '02'}, {'deposito': '02'}]
+        with patch.object(depositos_mod, 'DataService', side_effect=data_service):
+            detener = threading.Event()
+            metricas = sincronizar_depositos(api, principal, registros, depositos=('01', '02'), detener=detener)
+
+        principal.asegurar_dimensiones.assert_called_once_with(registros)
+        # Las cabeceras se resuelven una vez en la conexión principal y cada depósito recibe las suyas
+        principal.asegurar_cabeceras.assert_called_once_with(registros)
+        self.assertEqual({ds.depositos: ds.cabeceras for ds in creados},
+                         {('01',): {('1', 'T', 'C', '01'): 10},
+                          ('02',): {('1', 'T', 'C', '02'): 10, ('2', 'T', 'C', '02'): 11}})
+        self.assertTrue(all(ds.detener is detener for ds in creados))
+        self.assertEqual(sorted(ds.depositos for ds in creados), [('01',), ('02',)])
+        self.assertEqual(metricas['02']['registros'], 2)
+        self.assertEqual(metricas['02']['productos_ubicacion'], 2)
+        self.assertEqual({d: m['proubi']['llamadas'] for d, m in metricas.items()}, {'01': 1, '02': 2})
+        self.assertTrue(all(ds.cerrar_conexion.called for ds in creados))
+
+    def test_error_de_un_deposito_se_propaga_despues_de_los_demas(self):
+        api = MagicMock()
+        api.obtener_productos_ubicacion_batch.return_value = []
+        ok = MagicMock()
+        ok.insertar_datos.return_value = {'grupos': 1, 'insertados': 1, 'actualizados': 0, 'omitidos': 0}
+        falla = MagicMock()
+        falla.insertar_datos.side_effect = RuntimeError("BD")
+        servicios = {('01',): ok, ('02',): falla}
+
+        with patch.object(depositos_mod, 'DataService', side_effect=lambda cache, depositos: servicios[depositos]):
+            with self.assertRaises(RuntimeError):
+                sincronizar_depositos(api, MagicMock(), [{'deposito': '01'}, {'deposito': '02'}],
+                                      depositos=('01', '02'))
+        ok.insertar_datos.assert_called_once()
+        falla.cerrar_conexion.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
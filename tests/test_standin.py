@@ -0,0 +1,58 @@
+# tests/test_standin.py
+
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.api.api_services import APIService
+from src.api.standin import StandInServer
+
+
+class TestStandInServer(unittest.TestCase):
+    def _arrancar(self, **kwargs):
+        server = StandInServer.desde_grabaciones(self.dir.name, **kwargs)
+        server.iniciar_en_hilo()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base = server.url_base
+        patcher = patch.multiple('src.api.client.settings', API_URL=base + '/RYM0501',
+                                 API_URL_PROUBI=base + '/RYM0503', API_TOKEN_URL=base + '/token',
+                                 API_RECORD_DIR=self.dir.name, API_RETRY_MAX=1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        service = APIService()
+        service.api._dormir = lambda s: None
+        self.addCleanup(service.cerrar)
+        token = patch.object(service.api.oauth_manager, 'get_token', return_value='tkn')
+        token.start()
+        self.addCleanup(token.stop)
+        return server, service
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def test_reproduce_picklist_y_proubi_por_rango(self):
+        server, service = self._arrancar(escala=3)
+        picklist = service.obtener_picklist()
+        self.assertEqual(len(picklist), 31 * 3)
+
+        productos_ubi = service.obtener_productos_ubicacion_batch(picklist[:31], max_workers=4, max_pares_rango=10)
+        self.assertEqual(len(productos_ubi), 31)
+        self.assertEqual(server.stats['rym0501'], 1)
+        self.assertLess(server.stats['rym0503'], 31)
+
+        # El tráfico quedó grabado y se puede reproducir
+        with open(os.path.join(self.dir.name, 'rym0501.json'), encoding='utf-8') as f:
+            self.assertEqual(len(json.load(f)), 31 * 3)
+        self.assertTrue(os.path.exists(os.path.join(self.dir.name, 'rym0503.jsonl')))
+
+    def test_errores_simulados_agotan_reintentos(self):
+        server, service = self._arrancar(tasa_error=1.0, retry_after=0)
+        self.assertEqual(service.consultar_proubi_por_registro({'producto': 'X', 'ubicacion': 'Y'}), [])
+        self.assertEqual(server.stats['errores'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()